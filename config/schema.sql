@@ -13,6 +13,36 @@ CREATE TABLE users (
 );
 
 
+-- Login throttling buckets that were still draining when the server stopped (see core.user.throttle).
+-- kind: what the bucket limits, 'user' or 'address'.
+-- key: the username or client address.
+-- tokens: the tokens left in the bucket at the time it was saved.
+-- updated: when the bucket last changed, in seconds since the epoch.
+--
+DROP TABLE IF EXISTS login_throttle;
+CREATE TABLE login_throttle (
+  kind TEXT NOT NULL,
+  key TEXT NOT NULL,
+  tokens REAL NOT NULL,
+  updated REAL NOT NULL,
+  PRIMARY KEY (kind, key)
+);
+
+
+-- Server-side sessions that were spilled out of memory (see core.web.sessions).
+-- id: the session id.
+-- data: the session's data, as JSON.
+-- expires: when the session expires, in seconds since the epoch.
+--
+DROP TABLE IF EXISTS sessions;
+CREATE TABLE sessions (
+  id TEXT PRIMARY KEY,
+  data TEXT NOT NULL,
+  expires REAL NOT NULL
+);
+CREATE INDEX sessions_expires ON sessions (expires);
+
+
 DROP TABLE IF EXISTS households;
 CREATE TABLE households (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -21,6 +51,29 @@ CREATE TABLE households (
   created_date INTEGER DEFAULT (DATETIME('now'))
 );
 
+-- Full-text index over household names for the join-household search, kept in sync with households by the triggers
+-- below. Prefix indexes make the typeahead's prefix queries as cheap as whole-word ones.
+DROP TABLE IF EXISTS households_fts;
+CREATE VIRTUAL TABLE households_fts USING fts5(
+  household_name,
+  content='households',
+  content_rowid='id',
+  prefix='1 2 3'
+);
+
+CREATE TRIGGER households_fts_insert AFTER INSERT ON households BEGIN
+  INSERT INTO households_fts(rowid, household_name) VALUES (new.id, new.household_name);
+END;
+
+CREATE TRIGGER households_fts_delete AFTER DELETE ON households BEGIN
+  INSERT INTO households_fts(households_fts, rowid, household_name) VALUES ('delete', old.id, old.household_name);
+END;
+
+CREATE TRIGGER households_fts_update AFTER UPDATE OF household_name ON households BEGIN
+  INSERT INTO households_fts(households_fts, rowid, household_name) VALUES ('delete', old.id, old.household_name);
+  INSERT INTO households_fts(rowid, household_name) VALUES (new.id, new.household_name);
+END;
+
 
 DROP TABLE IF EXISTS household_memberships;
 CREATE TABLE household_memberships (
@@ -33,6 +86,9 @@ CREATE TABLE household_memberships (
   FOREIGN KEY(household) REFERENCES households(id)
 );
 
+-- The primary key already covers lookups by user; this covers listing the members of a household.
+CREATE INDEX household_memberships_household ON household_memberships (household);
+
 
 -- Table for log events..
 -- id: the event id (primary key).
@@ -53,6 +109,33 @@ CREATE TABLE event_log (
   FOREIGN KEY(blame) REFERENCES  users(id)
 );
 
+-- The log viewer pages through one log type at a time by id, optionally for a single user.
+CREATE INDEX event_log_type_id ON event_log (e_log_event_type, id);
+CREATE INDEX event_log_blame_id ON event_log (blame, id);
+
+
+-- Hourly event counts, kept after the events themselves are pruned from event_log.
+-- hour: the hour the events were raised in, as YYYY-MM-DD HH:00:00.
+-- e_log_event_type, e_log_event_level: as in event_log.
+-- count: the number of events.
+--
+DROP TABLE IF EXISTS event_log_rollup;
+CREATE TABLE event_log_rollup (
+  hour TEXT NOT NULL,
+  e_log_event_type INTEGER NOT NULL,
+  e_log_event_level INTEGER NOT NULL,
+  count INTEGER NOT NULL,
+  PRIMARY KEY (hour, e_log_event_type, e_log_event_level)
+);
+
+
+-- Bookkeeping for event log retention, e.g. how far the rollups have counted.
+DROP TABLE IF EXISTS event_log_state;
+CREATE TABLE event_log_state (
+  key TEXT PRIMARY KEY,
+  value INTEGER NOT NULL
+);
+
 
 
 
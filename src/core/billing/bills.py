@@ -1,4 +1,15 @@
-import persistent, transaction, datetime
+import persistent, datetime
+
+import BTrees.OOBTree
+from persistent.list import PersistentList
+
+from core.billing import settlement
+from core.database import unitofwork
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class Bill(persistent.Persistent):
     """
@@ -11,30 +22,42 @@ class Bill(persistent.Persistent):
                         positive adjustment.
         * Total - dollar amount of charges less the sum of deductions, always positive. A bill can never be adjusted to
                   have a negative total.
+
+    A bill that belongs to a bill group keeps a reference to it and to the cycle it was added in, so that the group's
+    running totals can follow changes to the bill. Once that cycle is closed, the amounts on the bill are frozen.
     """
 
+    # Bills persisted before the running totals existed won't have these set; BillGroup.verifyTotals fills them in.
+    _adjustmentTotal = None
+    _group = None
+    _cycle = None
+
     def __init__(self):
         self._charge = 0    # Initialize private member first before running the property setter, since the setter looks
                             # to this parameter for a value check.
 
         self._adjustments = []
+        self._adjustmentTotal = 0
         self._charge = 0
         self._owner = None
         self._name = None
         self._date = None
         self._active = True
-        transaction.commit()
+        unitofwork.commit()
 
     def addAdjustment(self, amount, why):
         if amount is None or type(amount) is not int:
             raise TypeError('Amount must be an integer.')
+        self._checkNotArchived()
         if self.getTotal() + amount < 0:
             raise ValueError('An adjustment may not cause the bill amount to become negative.')
 
 
         self._adjustments.append((amount, why))
+        self._adjustmentTotal = self._getAdjustmentTotal() + amount
         self._p_changed = True
-        transaction.commit()
+        self._contributionChanged(self._owner, amount)
+        unitofwork.commit()
 
     def getAdjustments(self):
         """
@@ -46,10 +69,35 @@ class Bill(persistent.Persistent):
 
     def getTotal(self):
         """
-        Recalculate the total for this bill.
+        Get the total for this bill, from the charge and the running sum of the adjustments.
         """
-        adjustments = sum(i for i, __ in self._adjustments)
-        return self.charge + adjustments
+        return self.charge + self._getAdjustmentTotal()
+
+    def _getAdjustmentTotal(self):
+        """
+        Gets the sum of the adjustments on this bill.
+        :return: The running sum of the adjustments, or a freshly calculated one if this bill predates running sums.
+        """
+        if self._adjustmentTotal is None:
+            return sum(i for i, __ in self._adjustments)
+        return self._adjustmentTotal
+
+    def _contributionChanged(self, owner, amount):
+        """
+        Tells the bill group this bill belongs to that the owner's contribution changed, if the bill currently counts.
+        :param owner: The payor whose contribution changed.
+        :param amount: How much the contribution changed by.
+        """
+        if self._group is not None and self._active:
+            self._group._addContribution(owner, amount)
+
+    def _checkNotArchived(self):
+        """
+        Check that this bill is not part of a closed cycle of its bill group, since those can no longer change.
+        :raises ValueError: If this bill belongs to a closed cycle.
+        """
+        if self._group is not None and self._cycle != self._group.getCurrentCycle():
+            raise ValueError('This bill belongs to a closed cycle and can no longer be changed.')
 
     @property
     def charge(self):
@@ -61,12 +109,15 @@ class Bill(persistent.Persistent):
             raise TypeError('Charge must be an integer.')
         if value < 0:
             raise ValueError('Charge must be non-negative.')
+        self._checkNotArchived()
 
         if (self.getTotal() - self.charge) + value < 0:
             raise ValueError('New charge may not cause the bill amount to become negative.')
 
+        delta = value - self._charge
         self._charge = value
-        transaction.commit()
+        self._contributionChanged(self._owner, delta)
+        unitofwork.commit()
 
     @property
     def name(self):
@@ -76,7 +127,7 @@ class Bill(persistent.Persistent):
     @name.setter
     def name(self, value):
         self._name = value
-        transaction.commit()
+        unitofwork.commit()
 
     @property
     def owner(self):
@@ -85,8 +136,13 @@ class Bill(persistent.Persistent):
 
     @owner.setter
     def owner(self, value):
+        self._checkNotArchived()
+        self._contributionChanged(self._owner, -self.getTotal())
+        if self._group is not None:
+            self._group._moveOwner(self._owner, value)
         self._owner = value
-        transaction.commit()
+        self._contributionChanged(self._owner, self.getTotal())
+        unitofwork.commit()
 
     @property
     def date(self):
@@ -98,7 +154,7 @@ class Bill(persistent.Persistent):
             raise TypeError('A date must be of type datetime.')
 
         self._date = value
-        transaction.commit()
+        unitofwork.commit()
 
     @property
     def active(self):
@@ -114,8 +170,32 @@ class Bill(persistent.Persistent):
         if type(value) is not bool:
             raise TypeError('Active must be either true or false.')
 
+        if value == self._active:
+            return
+        self._checkNotArchived()
+
+        if self._group is not None:
+            self._group._addContribution(self._owner, self.getTotal() if value else -self.getTotal())
+
         self._active = value
-        transaction.commit()
+        unitofwork.commit()
+
+
+class CycleSummary(persistent.Persistent):
+    """
+    A frozen snapshot of a closed cycle of a bill group, taken when the cycle ends. Reports on past cycles can be served
+    from the snapshot without loading or walking that cycle's bills, and without recalculating against payor weights
+    that may have changed since.
+    """
+
+    def __init__(self, cycle, billCount, contributions, weights=None, liabilities=None, transfers=None):
+        self.cycle = cycle
+        self.billCount = billCount
+        self.contributions = dict(contributions)    # Payor => total of their active bills in the cycle
+        self.contributionTotal = sum(self.contributions.values())
+        self.weights = dict(weights or {})          # Payor => weight at the time the cycle ended
+        self.liabilities = dict(liabilities or {})  # Payor => liability at the time the cycle ended
+        self.transfers = list(transfers or [])      # Settlement as (payer, payee, amount) tuples
 
 
 class BillGroup(persistent.Persistent):
@@ -124,12 +204,35 @@ class BillGroup(persistent.Persistent):
     assumption is that a payor has already paid the bill, and that the amount of the bill is their "contribution" to the
     shared pot of money, which will be redistributed according to the split of everyone in the shared bill group.
 
-    Bill groups are tracked in cycles, which are buckets of bills split by e.g. month.
+    Bill groups are tracked in cycles, which are buckets of bills split by e.g. month. Each cycle's bills are stored in
+    their own bucket, so that work on the current cycle never has to load or rewrite the bills of closed cycles. Closed
+    cycles are also summarized when they end.
+
+    The group keeps running totals of the active bills (per payor and overall) that are updated as bills are added or
+    changed, so that contributions can be read without walking every bill.
     """
 
+    # Bill groups persisted before the running totals existed won't have these set; verifyTotals fills them in.
+    _contributions = None
+    _contributionTotal = None
+
+    # Bill groups persisted before cycles were partitioned won't have these set; _getCycles fills them in.
+    _cycles = None
+    _cycle = 0
+    _archives = None
+
+    # Bill groups persisted before the owner index existed won't have this set; _getOwnerCounts fills it in.
+    _ownerCounts = None
+
     def __init__(self):
-        self._bills = []    # List of bills with owners.
+        self._cycles = BTrees.OOBTree.BTree()   # Cycle id => list of the bills in that cycle
+        self._cycle = 0                         # The id of the current cycle
+        self._cycles[self._cycle] = PersistentList()
+        self._archives = BTrees.OOBTree.BTree() # Cycle id => CycleSummary, for closed cycles
+        self._ownerCounts = {}                  # Owner => number of bills they own, across all cycles
         self._payors = {}   # Tuple of payor => weight
+        self._contributions = {}    # Running total of active bills, payor => amount
+        self._contributionTotal = 0 # Running total of all active bills
         self._name = None
 
     def addOrUpdatePayor(self, payor, weight):
@@ -149,7 +252,7 @@ class BillGroup(persistent.Persistent):
 
         self._payors[payor] = weight
         self._p_changed = True
-        transaction.commit()
+        unitofwork.commit()
 
     def removePayor(self, payor):
         """
@@ -164,13 +267,13 @@ class BillGroup(persistent.Persistent):
         if not payor in self.getPayors():
             raise ValueError('This payor does not exist for this bill.')
 
-        count = len([bill for bill in self._bills if bill.owner == payor])
-        if (count > 0):
+        if self.getBillCountFor(payor) > 0:
             raise ValueError('A payor cannot be removed if they have bills associated with them.')
 
         self._payors.pop(payor)
+        self._getContributions().pop(payor, None)
         self._p_changed = True
-        transaction.commit()
+        unitofwork.commit()
 
     def getPayors(self):
         """
@@ -192,22 +295,122 @@ class BillGroup(persistent.Persistent):
         if payor is None:
             raise TypeError('A bill must have a payor.')
 
-        if bill in self._bills:
+        if bill._group is self:
             raise ValueError('This bill is already part of this shared bill.')
+        if bill._group is not None:
+            raise ValueError('This bill is already part of another shared bill.')
         if payor not in self.getPayors():
             raise ValueError('This payor is not associated with this bill group.')
 
         bill.owner = payor
-        self._bills.append(bill)
+        bill._group = self
+        bill._cycle = self.getCurrentCycle()
+        self._getCycles()[bill._cycle].append(bill)
+        self._moveOwner(None, payor)
+        if bill.active:
+            self._addContribution(payor, bill.getTotal())
+        self._p_changed = True
+        unitofwork.commit()
+
+    def removeBill(self, bill):
+        """
+        Removes a bill from the current cycle of this bill group. It no longer counts towards anyone's contribution, and
+        may be added to a bill group again.
+        :param bill: The bill to remove.
+        :raises ValueError: If the bill is not part of this bill group, or belongs to a closed cycle.
+        """
+        if bill is None or bill._group is not self:
+            raise ValueError('This bill is not part of this shared bill.')
+        bill._checkNotArchived()
+
+        if bill.active:
+            self._addContribution(bill.owner, -bill.getTotal())
+        self._moveOwner(bill.owner, None)
+        self.getBills().remove(bill)
+
+        bill._group = None
+        bill._cycle = None
+        self._p_changed = True
+        unitofwork.commit()
+
+    def getBillCountFor(self, who):
+        """
+        Gets how many bills someone owns in this bill group, across all cycles.
+        :param who: The owner.
+        :return: The number of bills they own.
+        """
+        return self._getOwnerCounts().get(who, 0)
+
+    def _getOwnerCounts(self):
+        """
+        Gets the owner index, building it from every bill first if this bill group predates it.
+        :return: The dictionary of owner => number of bills they own.
+        """
+        if self._ownerCounts is None:
+            counts = {}
+            for bill in self.getAllBills():
+                counts[bill.owner] = counts.get(bill.owner, 0) + 1
+            self._ownerCounts = counts
+            unitofwork.commit()
+        return self._ownerCounts
+
+    def _moveOwner(self, old, new):
+        """
+        Moves one bill from one owner to another in the owner index. Called when bills are added, removed or reassigned.
+        :param old: The previous owner, or None if the bill is being added.
+        :param new: The new owner, or None if the bill is being removed.
+        """
+        counts = self._getOwnerCounts()
+        if old is not None:
+            counts[old] = counts.get(old, 0) - 1
+            if counts[old] <= 0:
+                del counts[old]
+        if new is not None:
+            counts[new] = counts.get(new, 0) + 1
         self._p_changed = True
-        transaction.commit()
 
-    def getBills(self):
+    def getBills(self, cycle=None):
+        """
+        Return the list of bills in a cycle of this bill group.
+        :param cycle: The cycle id to get the bills for. Defaults to the current cycle.
+        :return: The list of bills in that cycle, or an empty list if there is no such cycle.
+        """
+        if cycle is None:
+            cycle = self.getCurrentCycle()
+        return self._getCycles().get(cycle, [])
+
+    def getAllBills(self):
         """
-        Return the list of bills associated with this bill group.
-        :return: The list of bills associated with this bill group.
+        Iterate over every bill associated with this bill group, across all cycles. This loads every cycle's bills.
+        :return: A generator of all the bills in this bill group, oldest cycle first.
         """
-        return self._bills
+        for bills in self._getCycles().values():
+            for bill in bills:
+                yield bill
+
+    def getCurrentCycle(self):
+        """
+        Gets the id of the current (open) cycle.
+        :return: The current cycle id.
+        """
+        self._getCycles()
+        return self._cycle
+
+    def getCycles(self):
+        """
+        Gets the ids of every cycle of this bill group, including the current one.
+        :return: A list of cycle ids, oldest first.
+        """
+        return list(self._getCycles().keys())
+
+    def getCycleSummary(self, cycle):
+        """
+        Gets the summary of a closed cycle.
+        :param cycle: The cycle id.
+        :return: The CycleSummary for that cycle, or None if the cycle does not exist or is still open.
+        """
+        self._getCycles()
+        return self._archives.get(cycle)
 
     def calculateLiabilityFor(self, who):
         """
@@ -229,6 +432,42 @@ class BillGroup(persistent.Persistent):
         myContribution = self.getContributionFor(who)
         return myResponsibility - myContribution
 
+    def calculateAllLiabilities(self):
+        """
+        Calculates the liability of every payor on this bill group at once, from the running totals. Uses NumPy for the
+        per-payor arithmetic when it is available.
+        :return: A dictionary of payor => (responsibility, contribution, liability). Responsibility is the payor's
+                 weighted share of the contribution total, contribution is how much they have paid, and liability is
+                 the difference between the two, as in calculateLiabilityFor.
+        """
+        payors = list(self._payors.keys())
+        if len(payors) == 0:
+            return {}
+
+        running = self._getContributions()
+        contributions = {p: running.get(p, 0) for p in payors}
+        total = self.getContributionTotal()
+        weightSum = self._getWeightSum()
+
+        if numpy is not None:
+            weights = numpy.array([self._payors[p] for p in payors], dtype=numpy.float64)
+            paid = numpy.array([contributions[p] for p in payors], dtype=numpy.float64)
+            shares = (weights / weightSum) * total
+            responsibilities = shares.tolist()
+            liabilities = (shares - paid).tolist()
+        else:
+            responsibilities = [(self._payors[p] / weightSum) * total for p in payors]
+            liabilities = [r - contributions[p] for r, p in zip(responsibilities, payors)]
+
+        return {p: (responsibilities[i], contributions[p], liabilities[i]) for i, p in enumerate(payors)}
+
+    def calculateSettlement(self):
+        """
+        Calculates a near-minimal list of transfers between payors that settles everyone's liability for this cycle.
+        :return: A list of (payer, payee, amount) tuples, meaning payer pays payee amount (in whole cents).
+        """
+        return settlement.settle({p: l for p, (__, __, l) in self.calculateAllLiabilities().items()})
+
     def _getWeightSum(self):
         """
         Gets the sum of the liability weights for this group bill.
@@ -247,21 +486,134 @@ class BillGroup(persistent.Persistent):
         if who not in self.getPayors():
             raise ValueError('This payor is not associated with this bill group.')
 
-        return sum([b.getTotal() for b in self._bills if b.owner == who and b.active])
+        return self._getContributions().get(who, 0)
 
     def getContributionTotal(self):
         """
         Calculates the total amount of the bills in this bill group.
         :return: The total dollar amount of bills in the bill group.
         """
-        return sum([b.getTotal() for b in self._bills if b.active])
+        self._getContributions()
+        return self._contributionTotal
 
     def endCycle(self):
         """
-        Deactivate all of the bills in the current cycle. They will no longer affect billing calculations.
+        Deactivate all of the bills in the current cycle and close it. They will no longer affect billing calculations,
+        and a snapshot of the cycle's totals, liabilities and settlement is archived. New bills go into a fresh cycle.
+        The whole cycle is closed in a single commit.
+        """
+        bills = self.getBills()
+        liabilities = {p: l for p, (__, __, l) in self.calculateAllLiabilities().items()}
+        summary = CycleSummary(self._cycle, len(bills), self._getContributions(), self._payors, liabilities,
+                               settlement.settle(liabilities))
+
+        # Flip the bills directly rather than through the active setter, which would commit once per bill. The running
+        # totals are reset below anyway.
+        for bill in bills:
+            bill._active = False
+
+        self._archives[self._cycle] = summary
+        self._cycle += 1
+        self._cycles[self._cycle] = PersistentList()
+
+        # Nothing is active anymore, so start the running totals over rather than carry any drift into the next cycle.
+        self._contributions = {}
+        self._contributionTotal = 0
+        unitofwork.commit()
+
+    def _getCycles(self):
+        """
+        Gets the cycle buckets, first moving the bills of a bill group persisted before cycles were partitioned into
+        buckets: deactivated bills go into a closed cycle, and active bills into the current one.
+        :return: The BTree of cycle id => list of bills.
+        """
+        if self._cycles is not None:
+            return self._cycles
+
+        bills = getattr(self, '_bills', [])
+        self._cycles = BTrees.OOBTree.BTree()
+        self._archives = BTrees.OOBTree.BTree()
+        self._cycle = 0
+
+        closed = PersistentList(bill for bill in bills if not bill.active)
+        if len(closed) > 0:
+            contributions = {}
+            for bill in closed:
+                contributions[bill.owner] = contributions.get(bill.owner, 0) + bill.getTotal()
+                bill._cycle = self._cycle
+            self._cycles[self._cycle] = closed
+            self._archives[self._cycle] = CycleSummary(self._cycle, len(closed), contributions)
+            self._cycle += 1
+
+        self._cycles[self._cycle] = PersistentList(bill for bill in bills if bill.active)
+        for bill in self._cycles[self._cycle]:
+            bill._cycle = self._cycle
+
+        for bill in bills:
+            bill._group = self
+
+        if hasattr(self, '_bills'):
+            del self._bills
+        unitofwork.commit()
+
+        return self._cycles
+
+    def _getContributions(self):
+        """
+        Gets the running per-payor totals, building them first if this bill group predates running totals.
+        :return: The dictionary of payor => running total of their active bills.
+        """
+        if self._contributions is None:
+            self.verifyTotals()
+        return self._contributions
+
+    def _addContribution(self, payor, amount):
+        """
+        Adjusts the running totals when an active bill changes. Called by the bills in this group.
+        :param payor: The payor whose contribution changed.
+        :param amount: How much the contribution changed by.
+        """
+        contributions = self._getContributions()
+        contributions[payor] = contributions.get(payor, 0) + amount
+        self._contributionTotal += amount
+        self._p_changed = True
+
+    def verifyTotals(self):
+        """
+        Rebuilds the running totals (and each bill's running adjustment total) from scratch by walking the bills of the
+        current cycle. If any stored total disagrees with the rebuilt one, the rebuilt totals replace the stored ones.
+        :return: True if the stored totals were consistent, False if they had to be rebuilt.
         """
-        for bill in self._bills:
-            bill.active = False
+        consistent = True
+        contributions = {}
+        total = 0
+
+        for bill in self.getBills():
+            adjustmentTotal = sum(i for i, __ in bill.getAdjustments())
+            if bill._adjustmentTotal != adjustmentTotal:
+                bill._adjustmentTotal = adjustmentTotal
+                consistent = False
+            if bill._group is not self:
+                bill._group = self
+                consistent = False
+
+            if not bill.active:
+                continue
+
+            billTotal = bill.getTotal()
+            contributions[bill.owner] = contributions.get(bill.owner, 0) + billTotal
+            total += billTotal
+
+        stored = {p: c for p, c in (self._contributions or {}).items() if c != 0}
+        if stored != {p: c for p, c in contributions.items() if c != 0} or self._contributionTotal != total:
+            consistent = False
+
+        if not consistent:
+            self._contributions = contributions
+            self._contributionTotal = total
+            unitofwork.commit()
+
+        return consistent
 
     @property
     def name(self):
@@ -270,4 +622,4 @@ class BillGroup(persistent.Persistent):
     @name.setter
     def name(self, value):
         self._name = value
-        transaction.commit()
\ No newline at end of file
+        unitofwork.commit()
\ No newline at end of file
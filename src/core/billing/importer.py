@@ -0,0 +1,257 @@
+# ######################################################################################################################
+# Bill importer
+#
+# Loads bills in bulk from bank or receipt exports into a bill group. Rows are streamed from the file one at a time, so
+# large exports never have to fit in memory, and bills are committed in chunks rather than one transaction per setter.
+#
+# Each row describes one bill:
+#     * owner       - The payor who paid the bill. Must already be a payor of the bill group. (required)
+#     * charge      - The charge, as an integer amount. (required)
+#     * name        - The title of the bill.
+#     * date        - When the bill was paid, as YYYY-MM-DD or YYYY-MM-DD HH:MM:SS.
+#     * adjustments - Adjustments to the bill. In JSON Lines, a list of [amount, why] pairs. In CSV, pairs written as
+#                     amount:why and separated by semicolons, e.g. "-500:Personal items;200:Delivery".
+# ######################################################################################################################
+
+import csv
+import datetime
+import json
+
+from core.billing.bills import Bill
+from core.database import unitofwork
+
+# The number of bills committed together.
+DEFAULT_CHUNK_SIZE = 1000
+
+DATE_FORMATS = ['%Y-%m-%d', '%Y-%m-%d %H:%M:%S']
+
+
+class BillImportException(Exception):
+    """Exception raised when a row of a bill import cannot be turned into a bill."""
+    pass
+
+
+def readCsv(f):
+    """
+    Stream the rows of a CSV export. The first line must be a header naming the columns.
+    :param f: An open text file.
+    :return: A generator of row dictionaries.
+    """
+    for row in csv.DictReader(f):
+        yield row
+
+
+def readJsonLines(f):
+    """
+    Stream the rows of a JSON Lines export, one JSON object per line. Blank lines are skipped.
+    :param f: An open text file.
+    :return: A generator of row dictionaries.
+    """
+    for line in f:
+        line = line.strip()
+        if len(line) == 0:
+            continue
+
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield BillImportException('Malformed JSON: ' + str(e))
+
+
+def importFile(group, path, chunkSize=DEFAULT_CHUNK_SIZE, progress=None):
+    """
+    Import bills from a CSV (.csv) or JSON Lines (.jsonl, .json) file into a bill group.
+    :param group: The bill group to add the bills to.
+    :param path: The path of the export file.
+    :param chunkSize: How many bills to commit at a time.
+    :param progress: An optional function called as progress(imported, rows) after each chunk is committed.
+    :return: A tuple (imported, errors), as in importBills.
+    :raises ValueError: If the file type is not recognized.
+    """
+    if path.endswith('.csv'):
+        reader = readCsv
+    elif path.endswith('.jsonl') or path.endswith('.json'):
+        reader = readJsonLines
+    else:
+        raise ValueError('Bills can only be imported from .csv or .jsonl files.')
+
+    with open(path, mode='r', newline='') as f:
+        return importBills(group, reader(f), chunkSize, progress)
+
+
+def importBills(group, rows, chunkSize=DEFAULT_CHUNK_SIZE, progress=None):
+    """
+    Import bills from rows into a bill group. Rows that fail validation are skipped and reported, and don't stop the
+    rest of the import. Each chunk of bills is committed in one transaction; if this runs inside a request's unit of
+    work, everything is committed with the request instead.
+    :param group: The bill group to add the bills to.
+    :param rows: An iterable of row dictionaries (e.g. from readCsv or readJsonLines).
+    :param chunkSize: How many bills to commit at a time.
+    :param progress: An optional function called as progress(imported, rows) after each chunk is committed.
+    :return: A tuple (imported, errors), where imported is the number of bills added and errors is a list of
+             (row number, message) tuples for the rows that were skipped. Row numbers start at 1.
+    """
+    if chunkSize is None or type(chunkSize) is not int:
+        raise TypeError('Chunk size must be an integer.')
+    if chunkSize <= 0:
+        raise ValueError('Chunk size must be positive.')
+
+    imported = 0
+    pending = 0
+    rowNumber = 0
+    errors = []
+
+    success = False
+    unitofwork.begin()
+    try:
+        for rowNumber, row in enumerate(rows, 1):
+            try:
+                bill, owner = _parseRow(group, row)
+                group.addBill(bill, owner)
+            except (BillImportException, TypeError, ValueError) as e:
+                errors.append((rowNumber, str(e)))
+                continue
+
+            imported += 1
+            pending += 1
+            if pending >= chunkSize:
+                _commitChunk(group)
+                pending = 0
+                if progress is not None:
+                    progress(imported, rowNumber)
+
+        success = True
+    finally:
+        unitofwork.end(success)
+
+    if progress is not None and pending > 0:
+        progress(imported, rowNumber)
+
+    return imported, errors
+
+
+def _commitChunk(group):
+    """
+    Commit the bills imported so far and start a new chunk. Lets the connection drop the committed bills from its
+    cache, so that memory use stays flat over a large import.
+    :param group: The bill group being imported into.
+    """
+    unitofwork.end()
+    if group._p_jar is not None:
+        group._p_jar.cacheGC()
+    unitofwork.begin()
+
+
+def _parseRow(group, row):
+    """
+    Validate a row and build the bill it describes.
+    :param group: The bill group the bill is for.
+    :param row: The row dictionary.
+    :return: A tuple (bill, owner) ready to be added to the group.
+    :raises BillImportException: If the row is not valid.
+    """
+    if isinstance(row, BillImportException):
+        raise row
+    if not isinstance(row, dict):
+        raise BillImportException('A row must be an object.')
+
+    owner = _parseOwner(group, row.get('owner'))
+    charge = _parseAmount(row.get('charge'), 'charge')
+
+    bill = Bill()
+    bill.charge = charge
+
+    for amount, why in _parseAdjustments(row.get('adjustments')):
+        bill.addAdjustment(amount, why)
+
+    if row.get('name'):
+        bill.name = str(row['name'])
+
+    if row.get('date'):
+        bill.date = _parseDate(row['date'])
+
+    return bill, owner
+
+
+def _parseOwner(group, value):
+    """
+    Match an owner from a row to a payor of the bill group. Exports are text, so an owner that only matches a payor
+    once converted to an integer is accepted as well.
+    :param group: The bill group.
+    :param value: The owner from the row.
+    :return: The payor.
+    :raises BillImportException: If there is no such payor.
+    """
+    if value is None or value == '':
+        raise BillImportException('A bill must have an owner.')
+
+    payors = group.getPayors()
+    if value in payors:
+        return value
+
+    try:
+        if int(value) in payors:
+            return int(value)
+    except (TypeError, ValueError):
+        pass
+
+    raise BillImportException('Owner ' + str(value) + ' is not a payor of this bill group.')
+
+
+def _parseAmount(value, what):
+    """
+    Parse an integer amount from a row.
+    :param value: The amount, as an integer or a string.
+    :param what: What the amount is, for the error message.
+    :return: The amount as an integer.
+    :raises BillImportException: If the amount is missing or not an integer.
+    """
+    if type(value) is int:
+        return value
+
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise BillImportException('The ' + what + ' must be an integer (got ' + repr(value) + ').')
+
+
+def _parseAdjustments(value):
+    """
+    Parse the adjustments of a row.
+    :param value: A list of [amount, why] pairs, or a string of amount:why pairs separated by semicolons.
+    :return: A list of (amount, why) tuples.
+    :raises BillImportException: If the adjustments are malformed.
+    """
+    if value is None or value == '':
+        return []
+
+    if isinstance(value, str):
+        pairs = [item.split(':', 1) for item in value.split(';') if item.strip()]
+    elif isinstance(value, list):
+        pairs = value
+    else:
+        raise BillImportException('Adjustments must be a list or a string.')
+
+    adjustments = []
+    for pair in pairs:
+        if len(pair) != 2:
+            raise BillImportException('An adjustment must have an amount and a reason.')
+        adjustments.append((_parseAmount(pair[0], 'adjustment'), str(pair[1]).strip()))
+
+    return adjustments
+
+
+def _parseDate(value):
+    """
+    Parse the date of a row.
+    :param value: The date string.
+    :return: The date as a datetime.
+    :raises BillImportException: If the date is not in a recognized format.
+    """
+    for dateFormat in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(str(value).strip(), dateFormat)
+        except ValueError:
+            continue
+
+    raise BillImportException('Unrecognized date ' + repr(value) + '.')
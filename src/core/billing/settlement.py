@@ -0,0 +1,154 @@
+# ######################################################################################################################
+# Settlement
+#
+# Turns the net liabilities of a bill group into a list of transfers between payors that settles everyone up. A
+# positive liability means that payor owes money, a negative one means they are owed. Amounts are in integer cents.
+#
+# The fewest possible transfers for a group is the number of payors with a non-zero balance, less the number of groups
+# their balances can be split into that each sum to zero. Finding that split is exponential, so it is only done exactly
+# for small groups; larger groups cancel out matching balances and then settle greedily, which takes at most one
+# transfer fewer than the number of payors.
+# ######################################################################################################################
+
+import heapq
+import math
+
+# The largest number of non-zero balances that are solved exactly. The exact solver is O(2^n * n).
+EXACT_LIMIT = 12
+
+
+def settle(liabilities):
+    """
+    Computes a near-minimal list of transfers that settles every payor's liability.
+    :param liabilities: A dictionary of payor => net liability. Fractional amounts are rounded to whole cents.
+    :return: A list of (payer, payee, amount) tuples, meaning payer pays payee amount cents.
+    """
+    balances = {p: c for p, c in roundToCents(liabilities).items() if c != 0}
+    transfers = []
+
+    # Payors who owe exactly what someone else is owed can settle with each other in a single transfer, which is
+    # always part of some minimal solution.
+    owed = {}
+    for payor, cents in balances.items():
+        if cents < 0:
+            owed.setdefault(-cents, []).append(payor)
+    for payor, cents in list(balances.items()):
+        if cents > 0 and owed.get(cents):
+            payee = owed[cents].pop()
+            transfers.append((payor, payee, cents))
+            del balances[payor]
+            del balances[payee]
+
+    if len(balances) <= EXACT_LIMIT:
+        for group in _zeroSumGroups(balances):
+            transfers.extend(_settleGreedy(group))
+    else:
+        transfers.extend(_settleGreedy(balances))
+
+    return transfers
+
+
+def roundToCents(liabilities):
+    """
+    Rounds liabilities to whole cents while keeping their sum the same (largest remainder first).
+    :param liabilities: A dictionary of payor => liability.
+    :return: A dictionary of payor => liability in integer cents.
+    """
+    cents = {p: math.floor(v) for p, v in liabilities.items()}
+    remainder = int(round(sum(liabilities.values()))) - sum(cents.values())
+
+    byFraction = sorted(liabilities, key=lambda p: liabilities[p] - cents[p], reverse=True)
+    for payor in byFraction[:max(remainder, 0)]:
+        cents[payor] += 1
+
+    return cents
+
+
+def formatCents(cents):
+    """
+    Formats an amount in cents as dollars, like $1,234.56. Fractional cents are rounded.
+    :param cents: The amount in cents.
+    :return: The formatted amount, with a leading minus sign if it is negative.
+    """
+    cents = int(round(cents))
+    return ('-' if cents < 0 else '') + '$' + format(abs(cents) / 100, ',.2f')
+
+
+def _zeroSumGroups(balances):
+    """
+    Splits balances into as many groups as possible that each sum to zero, by dynamic programming over subsets.
+    :param balances: A dictionary of payor => non-zero balance in cents, summing to zero.
+    :return: A list of dictionaries of payor => balance, each summing to zero.
+    """
+    payors = list(balances.keys())
+    n = len(payors)
+    if n == 0:
+        return []
+
+    full = (1 << n) - 1
+    sums = [0] * (full + 1)
+    best = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        low = (mask & -mask).bit_length() - 1
+        sums[mask] = sums[mask & (mask - 1)] + balances[payors[low]]
+
+        rest = max(best[mask & ~(1 << i)] for i in range(n) if mask & (1 << i))
+        best[mask] = rest + (1 if sums[mask] == 0 else 0)
+
+    # Walk back down from the full set to recover an order in which the running sum hits zero as often as possible;
+    # each stretch between zeroes is one group.
+    order = []
+    mask = full
+    while mask:
+        closes = 1 if sums[mask] == 0 else 0
+        for i in range(n):
+            bit = 1 << i
+            if mask & bit and best[mask & ~bit] + closes == best[mask]:
+                order.append(payors[i])
+                mask &= ~bit
+                break
+    order.reverse()
+
+    groups = []
+    group = {}
+    running = 0
+    for payor in order:
+        group[payor] = balances[payor]
+        running += balances[payor]
+        if running == 0:
+            groups.append(group)
+            group = {}
+
+    # Balances that don't quite sum to zero leave a last group that never closes; settle what can be settled of it.
+    if group:
+        groups.append(group)
+
+    return groups
+
+
+def _settleGreedy(balances):
+    """
+    Settles balances by repeatedly having the largest debtor pay the largest creditor.
+    :param balances: A dictionary of payor => non-zero balance in cents, summing to zero.
+    :return: A list of (payer, payee, amount) tuples.
+    """
+    # Heap entries carry an insertion index so that ties never compare the payors themselves.
+    debtors = [(-c, i, p) for i, (p, c) in enumerate(balances.items()) if c > 0]
+    creditors = [(c, i, p) for i, (p, c) in enumerate(balances.items()) if c < 0]
+    heapq.heapify(debtors)
+    heapq.heapify(creditors)
+
+    transfers = []
+    while debtors and creditors:
+        owes, i, payer = heapq.heappop(debtors)
+        owed, j, payee = heapq.heappop(creditors)
+
+        amount = min(-owes, -owed)
+        transfers.append((payer, payee, amount))
+
+        if -owes > amount:
+            heapq.heappush(debtors, (owes + amount, i, payer))
+        if -owed > amount:
+            heapq.heappush(creditors, (owed + amount, j, payee))
+
+    return transfers
@@ -0,0 +1,78 @@
+# ######################################################################################################################
+# Cache
+#
+# A small in-process cache for values that are expensive to look up and cheap to be briefly out of date about, like
+# display names or search results. Each process has its own caches, so every entry also expires after a while to pick
+# up changes made by other processes.
+# ######################################################################################################################
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LruCache:
+    """
+    A bounded, least recently used cache whose entries expire. Safe to share between threads.
+    """
+
+    def __init__(self, size, ttl):
+        """
+        Create a cache.
+        :param size: The most entries kept. The least recently used entry is dropped to make room.
+        :param ttl: How long an entry is kept, in seconds.
+        """
+        if type(size) is not int:
+            raise TypeError('Cache size must be an integer.')
+        if size <= 0:
+            raise ValueError('Cache size must be positive.')
+
+        self._size = size
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Gets a cached value.
+        :param key: The key to look up.
+        :return: A tuple (found, value). Found is False if nothing is cached for the key (or it has expired).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return False, None
+
+            self._entries.move_to_end(key)
+            return True, value
+
+    def put(self, key, value):
+        """
+        Caches a value.
+        :param key: The key.
+        :param value: The value, which may be None.
+        """
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self._ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """
+        Drops an entry from the cache.
+        :param key: The key to drop. If None, the whole cache is cleared.
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
@@ -3,6 +3,8 @@
 # ######################################################################################################################
 
 from core.notification.yo.yoer import Yoer
+from core.user import passwords, throttle
+from core.web import client, sessions
 from shell.shell import ShellContext
 from route import routes
 
@@ -29,6 +31,27 @@ class Context(ShellContext):
         # Set up singleton fields specific to the CuteCasa application.
         self._yoer = None
 
+        # Password hashing pool and cost tuning. These are optional and fall back to the hasher defaults.
+        self._hasher = passwords.PasswordHasher(
+            int(self.shell.env_get_default("PASSWORD_HASH_WORKERS", passwords.DEFAULT_WORKERS)),
+            int(self.shell.env_get_default("PASSWORD_HASH_QUEUE_SIZE", passwords.DEFAULT_QUEUE_SIZE)),
+            float(self.shell.env_get_default("PASSWORD_HASH_TIMEOUT", passwords.DEFAULT_TIMEOUT)),
+            self.shell.env_get_default("PASSWORD_HASH_SCHEME", passwords.DEFAULT_SCHEME),
+            int(self.shell.env_get_default("PASSWORD_HASH_ITERATIONS", passwords.ITERATIONS)))
+
+        # Login throttling. Saving the throttle across restarts is optional.
+        self._login_throttle = throttle.LoginThrottle()
+        self._login_throttle_persist = self.shell.env_get_default("LOGIN_THROTTLE_PERSIST", False)
+
+        # Server-side sessions. These are optional; otherwise the whole session is kept in the cookie.
+        self._session_store = None
+        if self.shell.env_get_default("SERVER_SESSIONS", False):
+            self._session_store = sessions.SessionStore(
+                self._db_sql_pool,
+                int(self.shell.env_get_default("SESSION_STORE_SIZE", sessions.DEFAULT_SIZE)),
+                float(self.shell.env_get_default("SESSION_LIFETIME", sessions.DEFAULT_LIFETIME)))
+            self._flask_app.session_interface = sessions.ServerSessionInterface(self._session_store)
+
     # region Initialization
 
     def init_routes(self, flask_app: Flask) -> None:
@@ -49,6 +72,22 @@ class Context(ShellContext):
         """
         self._flask_app.run(host='0.0.0.0', port=self._port)
 
+    def _shutdown(self) -> None:
+        """
+        Shutdown requirements of the process hosting this context. Stops the password hashing processes, and saves the
+        login throttle if it is kept across restarts and the server-side sessions if they are in use.
+        """
+        self._hasher.shutdown()
+        if self._session_store is not None:
+            self._session_store.flush()
+        if self._login_throttle_persist:
+            connection = self.db_sql_connect()
+            try:
+                self._login_throttle.save(connection)
+            finally:
+                self.db_sql_release(connection)
+        super()._shutdown()
+
     # endregion
 
     # region Singletons
@@ -63,6 +102,9 @@ class Context(ShellContext):
         # The context object (this one) should have methods to get the following singletons. We'll expose them on g.s
         # for ease of access.
         g.s.Yoer = self.singleton_get_yoer()
+        g.s.hasher = self.singleton_get_hasher()
+        g.s.loginThrottle = self.singleton_get_login_throttle()
+        g.s.sessionStore = self.singleton_get_session_store()
 
     def singleton_get_yoer(self) -> Yoer:
         """
@@ -78,6 +120,27 @@ class Context(ShellContext):
         """
         self._yoer = yoer
 
+    def singleton_get_hasher(self) -> passwords.PasswordHasher:
+        """
+        Gets the password hasher for this application.
+        :return: The password hasher.
+        """
+        return self._hasher
+
+    def singleton_get_login_throttle(self) -> throttle.LoginThrottle:
+        """
+        Gets the login throttle for this application.
+        :return: The login throttle.
+        """
+        return self._login_throttle
+
+    def singleton_get_session_store(self) -> sessions.SessionStore:
+        """
+        Gets the server-side session store for this application.
+        :return: The session store, or None if sessions are kept in the cookie.
+        """
+        return self._session_store
+
     # endregion
 
     # region Global Flask handlers
@@ -92,6 +155,16 @@ class Context(ShellContext):
         """
         super().request_before_first()
 
+        if self._login_throttle_persist:
+            connection = self.db_sql_connect()
+            try:
+                self._login_throttle.load(connection)
+            finally:
+                self.db_sql_release(connection)
+
+        if self._session_store is not None:
+            self._session_store.prune()
+
         if self.singleton_get_zdb().root.globalSettings.yoApiKey:
             self.singleton_set_yoer(Yoer(self.singleton_get_zdb().root.globalSettings.yoApiKey))
 
@@ -100,7 +173,10 @@ class Context(ShellContext):
         Do any bringup for things that we need during a request.
         """
         super().request_before()
-        # TODO: Run before-request integrity checks.
+
+        # The session's user and household objects are looked up (and checked) on first use, not here.
+        g.dog = client.RequestContext(self.singleton_get_zdb())
+
         # TODO: Run before-request permission checks (e.g. checkLogin, checkAdmin) based on the route we are attempting.
 
     # endregion
@@ -11,26 +11,80 @@
 # TODO: This should not be here. We need to separate Flask from the database so our shell/context is independent.
 from flask import g, abort
 
+
+def getDb():
+    """
+    Gets the SQL connection for the current request. A connection is only checked out of the context's pool the first
+    time a request actually needs one, and the context returns it when the request ends.
+    :return: The SQL connection for this request.
+    """
+    db = getattr(g, 'db', None)
+    if db is None:
+        db = g.s.context.db_sql_connect()
+        g.db = db
+    return db
+
 def query_db(query, args=(), one=False):
     for s in args:
         if len(str(s)) == 0:
             return None # A blank parameter will always be "probably unsupported type" by sqlite3.
 
-    cur = g.db.execute(query, args)
-    rv = cur.fetchall()
-    ret = [make_dicts(cur, row) for row in rv]
-    cur.close()
-    return (ret[0] if ret else None) if one else ret
+    cur = getDb().execute(query, args)
+    try:
+        if one:
+            row = cur.fetchone()
+            return dict(zip(columns(cur), row)) if row is not None else None
 
-def make_dicts(cursor, row):
-    return dict((cursor.description[idx][0], value)
-                for idx, value in enumerate(row))
+        names = columns(cur)
+        return [dict(zip(names, row)) for row in cur.fetchall()]
+    finally:
+        cur.close()
+
+def columns(cursor):
+    """
+    Gets the column names of a query's results, in order.
+    :param cursor: The cursor the query ran on.
+    :return: A list of column names.
+    """
+    return [d[0] for d in cursor.description] if cursor.description is not None else []
 
 def post_db(query, args=()):
-    cur = g.db.execute(query, args)
-    g.db.commit()
+    """
+    Run a statement that changes the database, and commit it.
+    :param query: The statement to run.
+    :param args: The statement parameters.
+    :return: A tuple (lastrowid, rowcount): the id of the row inserted (if this was an insert), and the number of rows
+             the statement changed.
+    """
+    db = getDb()
+    cur = db.execute(query, args)
+    db.commit()
+    result = (cur.lastrowid, cur.rowcount)
+    cur.close()
+    return result
+
+def post_many_db(query, rows):
+    """
+    Run an insert once for each of many rows, and commit them all together.
+
+    The rows are inserted in one transaction on one connection, which holds SQLite's write lock throughout, so tables
+    whose ids are assigned by the database get consecutive ids for the batch.
+    :param query: The insert to run.
+    :param rows: An iterable of parameter sequences, one per row.
+    :return: A range of the ids of the inserted rows, in the order the rows were given.
+    """
+    db = getDb()
+    cur = db.executemany(query, rows)
+    count = cur.rowcount
     cur.close()
 
+    last = db.execute("SELECT last_insert_rowid()").fetchone()[0]
+    db.commit()
+
+    if count <= 0:
+        return range(0)
+    return range(last - count + 1, last + 1)
+
 
 ALLOWED_DYNAMIC_TABLES = ["users", "households", "household_memberships", "event_log"]
 
@@ -49,7 +103,7 @@ def cleanTable(table):
 
 def getLastRowId():
     """
-    Gets the last autoincremented rowid from an insert.
+    Gets the last autoincremented rowid from an insert. Prefer the id returned by post_db, which saves a query.
     :return: The last autoincremented row id from an insert.
     """
     return query_db("SELECT last_insert_rowid()", [], True)['last_insert_rowid()']
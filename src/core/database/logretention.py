@@ -0,0 +1,218 @@
+# ######################################################################################################################
+# Log retention
+#
+# The event log would otherwise grow forever, and every insert and log viewer page would slowly get more expensive.
+# Retention runs in the background and does two things:
+#
+#     * Rollups  - Counts events per hour, log type and level into event_log_rollup, for the admin dashboard. Rollups are
+#                  kept forever; they are one row per hour per type and level however busy the log is.
+#     * Pruning  - Moves events older than the retention period out of event_log and into compressed archive files,
+#                  one file per day (event_log-YYYY-MM-DD.jsonl.gz, one JSON object per event).
+#
+# Both work in small batches, each in its own short transaction, so that they never hold the database lock for long.
+# Events are only ever pruned after they have been counted.
+# ######################################################################################################################
+
+import datetime
+import gzip
+import json
+import os
+import threading
+
+from core.database import queries
+
+# How many days of events stay in event_log.
+DEFAULT_RETENTION_DAYS = 90
+
+# The number of events handled in one transaction.
+DEFAULT_BATCH_SIZE = 5000
+
+# How often retention runs, in seconds.
+DEFAULT_INTERVAL = 3600
+
+# The event_log_state key holding the id of the last event that was counted into the rollups.
+ROLLUP_WATERMARK = 'rollup_watermark'
+
+
+class LogRetention:
+    """
+    Rolls up, archives and prunes the event log.
+    """
+
+    def __init__(self, pool, archiveDir, retentionDays=DEFAULT_RETENTION_DAYS, batchSize=DEFAULT_BATCH_SIZE,
+                 interval=DEFAULT_INTERVAL):
+        """
+        Set up log retention. Nothing runs until it is started (or run is called).
+        :param pool: The SqlPool to check connections out of.
+        :param archiveDir: The directory to write archive files to. It is created if it does not exist.
+        :param retentionDays: How many days of events stay in event_log.
+        :param batchSize: The number of events handled in one transaction.
+        :param interval: How often retention runs in the background, in seconds.
+        """
+        if type(retentionDays) is not int or type(batchSize) is not int:
+            raise TypeError('Retention days and batch size must be integers.')
+        if retentionDays <= 0 or batchSize <= 0 or interval <= 0:
+            raise ValueError('Retention days, batch size and interval must be positive.')
+
+        self._pool = pool
+        self._archiveDir = archiveDir
+        self._retentionDays = retentionDays
+        self._batchSize = batchSize
+        self._interval = interval
+
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start running retention in the background.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._loop, name='LogRetention', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread. A batch in progress is finished first.
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+
+        if thread is None:
+            return
+
+        self._stopping.set()
+        thread.join()
+
+    def run(self, now=None):
+        """
+        Run retention once: bring the rollups up to date, then prune old events.
+        :param now: The current time, as a UTC datetime. Defaults to now.
+        :return: A tuple (counted, pruned) of the number of events rolled up and pruned.
+        """
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+        counted = self.rollup()
+        pruned = self.prune(now - datetime.timedelta(days=self._retentionDays))
+        return counted, pruned
+
+    def rollup(self):
+        """
+        Count every event that has not been counted yet into the hourly rollups.
+        :return: The number of events counted.
+        """
+        counted = 0
+        while not self._stopping.is_set():
+            connection = self._pool.checkout()
+            try:
+                watermark = _getState(connection, ROLLUP_WATERMARK)
+                last = connection.execute(queries.LOG_GET_ID_AFTER, [watermark, self._batchSize - 1]).fetchone()
+                if last is None:
+                    # Fewer than a full batch left; count up to the newest event.
+                    last = connection.execute(queries.LOG_GET_LAST_ID).fetchone()
+                if last is None or last[0] is None or last[0] <= watermark:
+                    return counted
+
+                counted += connection.execute(queries.LOG_COUNT_BETWEEN, [watermark, last[0]]).fetchone()[0]
+                connection.execute(queries.LOG_ROLLUP_ADD, [watermark, last[0]])
+                connection.execute(queries.LOG_STATE_SET, [ROLLUP_WATERMARK, last[0]])
+                connection.commit()
+            finally:
+                self._pool.checkin(connection)
+        return counted
+
+    def prune(self, cutoff):
+        """
+        Archive and delete events from before a cutoff time. Only events that have been counted are pruned.
+        :param cutoff: The UTC datetime before which events are pruned.
+        :return: The number of events pruned.
+        """
+        cutoff = cutoff.strftime('%Y-%m-%d %H:%M:%S')
+        pruned = 0
+        while not self._stopping.is_set():
+            connection = self._pool.checkout()
+            try:
+                watermark = _getState(connection, ROLLUP_WATERMARK)
+                cursor = connection.execute(queries.LOG_GET_OLDEST, [watermark, self._batchSize])
+                names = [d[0] for d in cursor.description]
+
+                # Events are stored in time order, so the oldest events up to the first one that is too new are the
+                # ones to prune.
+                events = []
+                for row in cursor:
+                    event = dict(zip(names, row))
+                    if event['timestamp'] is None or event['timestamp'] >= cutoff:
+                        break
+                    events.append(event)
+                cursor.close()
+
+                if len(events) == 0:
+                    return pruned
+
+                self._archive(events)
+                connection.execute(queries.LOG_DELETE_THROUGH, [events[-1]['id']])
+                connection.commit()
+                pruned += len(events)
+
+                if len(events) < self._batchSize:
+                    return pruned
+            finally:
+                self._pool.checkin(connection)
+        return pruned
+
+    def _archive(self, events):
+        """
+        Append events to the archive file for their day.
+        :param events: A list of event dictionaries, oldest first.
+        """
+        os.makedirs(self._archiveDir, exist_ok=True)
+
+        byDay = {}
+        for event in events:
+            byDay.setdefault(event['timestamp'][:10], []).append(event)
+
+        # Each append adds a new gzip member to the file, which gzip readers read straight through.
+        for day, dayEvents in byDay.items():
+            path = os.path.join(self._archiveDir, 'event_log-' + day + '.jsonl.gz')
+            with gzip.open(path, mode='at', encoding='utf-8') as f:
+                for event in dayEvents:
+                    f.write(json.dumps(event, sort_keys=True) + '\n')
+
+    def _loop(self):
+        """
+        The background thread. Runs retention, then waits for the interval (or until stopped).
+        """
+        while not self._stopping.is_set():
+            try:
+                self.run()
+            except Exception as e:
+                print('[critical][sys]: Event log retention failed: ' + str(e))
+            self._stopping.wait(self._interval)
+
+
+def readArchive(path):
+    """
+    Read the events back out of an archive file.
+    :param path: The path to the archive file.
+    :return: A generator of event dictionaries.
+    """
+    with gzip.open(path, mode='rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def _getState(connection, key):
+    """
+    Get a retention state value.
+    :param connection: The connection to read with.
+    :param key: The state key.
+    :return: The value, or 0 if it has never been set.
+    """
+    row = connection.execute(queries.LOG_STATE_GET, [key]).fetchone()
+    return row[0] if row is not None else 0
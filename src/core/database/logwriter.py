@@ -0,0 +1,260 @@
+# ######################################################################################################################
+# Log writer
+#
+# Writing each event to the event log in its own transaction puts a disk commit on the request path for every page that
+# logs something. The log writer queues events in memory instead, and a background thread writes them out in batches:
+# whenever enough events have queued up, or the oldest queued event has waited long enough.
+#
+# The queue is bounded. When it is full, routine events (info, warning) are dropped and counted, and the count is
+# written to the system log once there is room again. Critical and crash events wait for room instead, so that they are
+# never lost.
+# ######################################################################################################################
+
+import datetime
+import queue
+import sqlite3
+import threading
+import time
+
+from core import enums
+from core.database import queries
+
+# The number of events that can be waiting to be written.
+DEFAULT_QUEUE_SIZE = 10000
+
+# The number of events written in one transaction.
+DEFAULT_BATCH_SIZE = 200
+
+# The longest an event waits before it is written, in seconds.
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+# How long critical events wait for room in a full queue before they are written synchronously, in seconds.
+BLOCK_TIMEOUT = 5.0
+
+# How often stop and flush check that the writer thread is still alive while they wait on it, in seconds.
+WAIT_INTERVAL = 0.1
+
+# Queued to wake the writer thread up and tell it to stop.
+_STOP = object()
+
+
+class LogWriter:
+    """
+    Writes event log entries to the SQL database in batches on a background thread.
+    """
+
+    def __init__(self, pool, queueSize=DEFAULT_QUEUE_SIZE, batchSize=DEFAULT_BATCH_SIZE,
+                 flushInterval=DEFAULT_FLUSH_INTERVAL):
+        """
+        Create a log writer. Nothing is written until it is started.
+        :param pool: The SqlPool to check the writer's connection out of.
+        :param queueSize: The number of events that can be waiting to be written.
+        :param batchSize: The number of events written in one transaction.
+        :param flushInterval: The longest an event waits before it is written, in seconds.
+        """
+        if type(queueSize) is not int or type(batchSize) is not int:
+            raise TypeError('Queue and batch sizes must be integers.')
+        if queueSize <= 0 or batchSize <= 0 or flushInterval <= 0:
+            raise ValueError('Queue size, batch size and flush interval must be positive.')
+
+        self._pool = pool
+        self._batchSize = batchSize
+        self._flushInterval = flushInterval
+
+        self._queue = queue.Queue(queueSize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._dropped = 0
+        self._written = 0
+
+    def start(self):
+        """
+        Start the writer thread.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='LogWriter', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Write out everything that is queued, and stop the writer thread.
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+
+        if thread is None:
+            return
+
+        # Only wait for room in the queue while the thread is still there to make it.
+        while thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=WAIT_INTERVAL)
+                break
+            except queue.Full:
+                continue
+        thread.join()
+
+        # If the thread died, whatever it left behind is written here instead.
+        self._writeBatch(self._drain() + self._droppedEvent())
+
+    def isRunning(self):
+        """
+        Checks whether the writer thread is running.
+        :return: True if events written now will be picked up by the thread.
+        """
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    def write(self, blame, message, level, log):
+        """
+        Queue an event to be written to the event log. The event is timestamped now, not when it is written.
+        :param blame: The user ID that caused this event.
+        :param message: The message to log.
+        :param level: The event importance.
+        :param log: Which log to log the message to.
+        :return: True if the event was queued (or written), False if it was dropped because the queue was full.
+        """
+        event = (blame, message, int(level), int(log), _timestamp())
+
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            pass
+
+        if level < enums.e_log_event_level.critical:
+            with self._lock:
+                self._dropped += 1
+            return False
+
+        # Important events apply backpressure instead of being dropped. If the writer can't make room in time, write
+        # the event directly rather than lose it.
+        try:
+            self._queue.put(event, timeout=BLOCK_TIMEOUT)
+        except queue.Full:
+            self._writeBatch([event])
+        return True
+
+    def flush(self):
+        """
+        Block until every event queued so far has been written.
+        """
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks > 0 and self.isRunning():
+                self._queue.all_tasks_done.wait(WAIT_INTERVAL)
+
+    def getDroppedCount(self):
+        """
+        Gets the number of events that have been dropped because the queue was full.
+        :return: The number of dropped events.
+        """
+        return self._dropped
+
+    def getWrittenCount(self):
+        """
+        Gets the number of events that have been written to the database.
+        :return: The number of written events.
+        """
+        return self._written
+
+    def _run(self):
+        """
+        The writer thread. Collects queued events into batches and writes each batch in one transaction.
+        """
+        stopping = False
+        while not stopping:
+            batch = []
+
+            # Wait as long as it takes for the first event, then only as long as the flush interval for the rest.
+            item = self._queue.get()
+            deadline = time.monotonic() + self._flushInterval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+
+                if stopping or len(batch) >= self._batchSize:
+                    break
+
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+
+            # Anything still queued when stopping is written before the thread exits.
+            if stopping:
+                batch.extend(self._drain())
+
+            try:
+                self._writeBatch(batch + self._droppedEvent())
+            except Exception as e:
+                # Nothing may stop the thread, or events would quietly pile up in the queue with nobody to write them.
+                print('[critical][sys]: Event log writer failed: ' + repr(e))
+            finally:
+                for __ in range(len(batch) + (1 if stopping else 0)):
+                    self._queue.task_done()
+
+    def _drain(self):
+        """
+        Take everything left in the queue without waiting.
+        :return: A list of events.
+        """
+        events = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return events
+
+            if item is _STOP:
+                self._queue.task_done()
+            else:
+                events.append(item)
+
+    def _droppedEvent(self):
+        """
+        Builds a system event reporting the events dropped since the last report, if any were.
+        :return: A list with the event, or an empty list.
+        """
+        with self._lock:
+            dropped = self._dropped
+            self._dropped = 0
+
+        if dropped == 0:
+            return []
+
+        return [(None, 'Event log queue was full; ' + str(dropped) + ' event(s) dropped.',
+                 int(enums.e_log_event_level.warning), int(enums.e_log_event_type.system), _timestamp())]
+
+    def _writeBatch(self, events):
+        """
+        Write events to the database in one transaction. A batch that can't be written is printed instead, since there
+        is nowhere else to log the failure.
+        :param events: A list of event tuples.
+        """
+        if len(events) == 0:
+            return
+
+        connection = None
+        try:
+            connection = self._pool.checkout()
+            connection.executemany(queries.LOG_INSERT_TIMESTAMPED, events)
+            connection.commit()
+            self._written += len(events)
+        except sqlite3.Error as e:
+            print('[critical][sys]: Could not write ' + str(len(events)) + ' event(s) to the event log: ' + str(e))
+        finally:
+            if connection is not None:
+                self._pool.checkin(connection)
+
+
+def _timestamp():
+    """
+    Gets the current time in the format the event log uses.
+    :return: The UTC time as YYYY-MM-DD HH:MM:SS.
+    """
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
@@ -1,13 +1,27 @@
 CHECK_USERNAME = "SELECT COUNT(*) FROM users WHERE username=?"
-CHECK_LOGIN = "SELECT COUNT(*),id,email FROM users WHERE username=? AND password=? LIMIT 1"
+USER_GET_LOGIN = "SELECT id, password FROM users WHERE username=? LIMIT 1"
 
 REGISTER = "INSERT INTO users (username, password, email) VALUES (?, ?, ?)"
+USER_DELETE = "DELETE FROM users WHERE id=?"
+
+# Saved login throttling buckets (see core.user.throttle).
+LOGIN_THROTTLE_CLEAR = "DELETE FROM login_throttle"
+LOGIN_THROTTLE_SAVE = "INSERT INTO login_throttle (kind, key, tokens, updated) VALUES (?, ?, ?, ?)"
+LOGIN_THROTTLE_LOAD = "SELECT kind, key, tokens, updated FROM login_throttle"
+
+# Server-side sessions spilled out of memory (see core.web.sessions).
+SESSION_GET = "SELECT data, expires FROM sessions WHERE id=? AND expires>?"
+SESSION_SAVE = "INSERT INTO sessions (id, data, expires) VALUES (?, ?, ?)" \
+               " ON CONFLICT (id) DO UPDATE SET data=excluded.data, expires=excluded.expires"
+SESSION_DELETE = "DELETE FROM sessions WHERE id=?"
+SESSION_PRUNE = "DELETE FROM sessions WHERE expires<=?"
 
 # ######################################################################################################################
 # User profile queries
 # ######################################################################################################################
 
 USER_UPDATE_EMAIL = "UPDATE users SET email=? WHERE id=?"
+USER_UPDATE_PASSWORD = "UPDATE users SET password=? WHERE id=?"
 
 # ######################################################################################################################
 # Household profile queries
@@ -17,7 +31,9 @@ HOUSEHOLD_UPDATE_HOUSEHOLDNAME = "UPDATE households SET household_name=? WHERE i
 HOUSEHOLD_UPDATE_HOUSEHOLDTYPE = "UPDATE households SET e_household_type=? WHERE id=?"
 
 HOUSEHOLD_CREATE = "INSERT INTO households(household_name, e_household_type) VALUES (?, ?)"
-HOUSEHOLD_SEARCH = "SELECT id, household_name, e_household_type FROM households WHERE household_name LIKE ?"
+HOUSEHOLD_SEARCH = "SELECT households.id, households.household_name, households.e_household_type" \
+                   " FROM households_fts INNER JOIN households ON households.id=households_fts.rowid" \
+                   " WHERE households_fts MATCH ? ORDER BY households_fts.rank LIMIT ?"
 
 
 # #
@@ -45,7 +61,32 @@ HOUSEHOLD_GET_USERS = "SELECT users.id as id," \
 # ######################################################################################################################
 
 LOG_INSERT = "INSERT INTO event_log (blame, message, e_log_event_level, e_log_event_type) VALUES (?, ?, ?, ?)"
-LOG_GET = "SELECT * FROM event_log WHERE e_log_event_type = ? ORDER BY id DESC LIMIT ?, ?"
+LOG_INSERT_TIMESTAMPED = "INSERT INTO event_log (blame, message, e_log_event_level, e_log_event_type, timestamp) " \
+                         "VALUES (?, ?, ?, ?, ?)"
+# The log viewer pages by id (keyset pagination) rather than by offset, so that every page costs the same however deep it
+# is. LOG_GET is followed by any of the filters, then by one of the page clauses.
+LOG_GET = "SELECT * FROM event_log WHERE e_log_event_type = ?"
+LOG_GET_FILTER_LEVEL = " AND e_log_event_level = ?"
+LOG_GET_FILTER_BLAME = " AND blame = ?"
+LOG_GET_FILTER_SINCE = " AND timestamp >= ?"
+LOG_GET_FILTER_UNTIL = " AND timestamp < ?"
+LOG_GET_PAGE_OLDER = " AND id < ? ORDER BY id DESC LIMIT ?"
+LOG_GET_PAGE_NEWER = " AND id > ? ORDER BY id ASC LIMIT ?"
+
+# Log retention (see core.database.logretention).
+LOG_GET_ID_AFTER = "SELECT id FROM event_log WHERE id > ? ORDER BY id LIMIT 1 OFFSET ?"
+LOG_GET_LAST_ID = "SELECT MAX(id) FROM event_log"
+LOG_GET_OLDEST = "SELECT * FROM event_log WHERE id <= ? ORDER BY id LIMIT ?"
+LOG_COUNT_BETWEEN = "SELECT COUNT(*) FROM event_log WHERE id > ? AND id <= ?"
+LOG_DELETE_THROUGH = "DELETE FROM event_log WHERE id <= ?"
+LOG_ROLLUP_ADD = "INSERT INTO event_log_rollup (hour, e_log_event_type, e_log_event_level, count)" \
+                 " SELECT strftime('%Y-%m-%d %H:00:00', timestamp), e_log_event_type, e_log_event_level, COUNT(*)" \
+                 " FROM event_log WHERE id > ? AND id <= ? GROUP BY 1, 2, 3" \
+                 " ON CONFLICT (hour, e_log_event_type, e_log_event_level) DO UPDATE SET count = count + excluded.count"
+LOG_ROLLUP_GET = "SELECT hour, e_log_event_type, e_log_event_level, count FROM event_log_rollup WHERE hour >= ?" \
+                 " ORDER BY hour"
+LOG_STATE_GET = "SELECT value FROM event_log_state WHERE key = ?"
+LOG_STATE_SET = "INSERT OR REPLACE INTO event_log_state (key, value) VALUES (?, ?)"
 
 
 
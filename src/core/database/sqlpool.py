@@ -0,0 +1,110 @@
+# ######################################################################################################################
+# SQL connection pool
+#
+# Opening a SQLite connection (and re-reading the schema, and starting with a cold page cache) for every request is
+# wasteful. The pool keeps a few connections open and hands them out to requests as needed. Each connection is set up
+# with WAL journaling and tuned pragmas when it is first opened.
+# ######################################################################################################################
+
+import queue
+import sqlite3
+
+# The number of idle connections kept open.
+DEFAULT_POOL_SIZE = 5
+
+# The number of compiled statements each connection keeps. The app runs a fixed set of queries, so this comfortably
+# holds all of them and statements are only ever prepared once per connection.
+DEFAULT_STATEMENT_CACHE_SIZE = 256
+
+# Pragmas applied to each connection when it is opened, in order. Journal mode has to come first.
+DEFAULT_PRAGMAS = [
+    ('journal_mode', 'WAL'),    # Readers don't block the writer and vice versa.
+    ('synchronous', 'NORMAL'),  # Safe with WAL; only the checkpoint syncs, not every commit.
+    ('cache_size', -8000),      # Negative values are in KiB, so about 8 MB of page cache per connection.
+    ('mmap_size', 268435456),   # Read through up to 256 MB of memory-mapped I/O.
+    ('busy_timeout', 5000),     # Wait up to 5 seconds for a lock instead of failing right away.
+]
+
+
+class SqlPool:
+    """
+    A pool of SQLite connections to one database. Connections are checked out by one thread at a time, and checked back
+    in when that thread is done with them.
+    """
+
+    def __init__(self, path, size=DEFAULT_POOL_SIZE, pragmas=None, statementCacheSize=DEFAULT_STATEMENT_CACHE_SIZE):
+        """
+        Create a pool for a database. No connections are opened until one is checked out.
+        :param path: The path to the SQLite database.
+        :param size: The number of idle connections to keep open.
+        :param pragmas: Pragma overrides, as a dictionary of name => value, applied over the defaults.
+        :param statementCacheSize: The number of compiled statements each connection keeps.
+        """
+        if type(size) is not int:
+            raise TypeError('Pool size must be an integer.')
+        if size < 0:
+            raise ValueError('Pool size must not be negative.')
+
+        self._path = path
+        self._size = size
+        self._statementCacheSize = statementCacheSize
+        overrides = dict(pragmas or {})
+        self._pragmas = [(n, overrides.pop(n, v)) for n, v in DEFAULT_PRAGMAS] + list(overrides.items())
+
+        # Most recently used connections are handed out first, since their page caches are the warmest.
+        self._idle = queue.LifoQueue()
+
+    def connect(self):
+        """
+        Open a new connection to the database and apply the pragmas to it.
+        :return: The new connection.
+        """
+        connection = sqlite3.connect(self._path, check_same_thread=False, cached_statements=self._statementCacheSize)
+        for name, value in self._pragmas:
+            connection.execute('PRAGMA ' + name + '=' + str(value))
+        return connection
+
+    def checkout(self):
+        """
+        Check out a connection, reusing an idle one if there is one.
+        :return: A connection for the calling thread to use until it is checked back in.
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def checkin(self, connection):
+        """
+        Return a connection to the pool. Anything left uncommitted on it is rolled back. If the pool already has enough
+        idle connections (or the connection is no longer usable), it is closed instead.
+        :param connection: The connection to return.
+        """
+        try:
+            connection.rollback()
+        except sqlite3.Error:
+            return
+
+        if self._idle.qsize() >= self._size:
+            connection.close()
+            return
+
+        self._idle.put_nowait(connection)
+
+    def getIdleCount(self):
+        """
+        Gets the number of idle connections in the pool.
+        :return: The number of idle connections.
+        """
+        return self._idle.qsize()
+
+    def close(self):
+        """
+        Close every idle connection in the pool. Connections that are checked out are closed when they are checked in.
+        """
+        self._size = 0
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
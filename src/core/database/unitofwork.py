@@ -0,0 +1,86 @@
+# ######################################################################################################################
+# Unit of work
+#
+# Persistent objects commit their changes as soon as a setter runs. While a unit of work is open on a thread (like for
+# the duration of a request), those commits are deferred: setters only mark their objects as changed, and the whole
+# unit of work is committed once when it ends. Outside of a unit of work (scripts, the REPL, tests), commits happen
+# immediately as before.
+# ######################################################################################################################
+
+import threading
+from contextlib import contextmanager
+
+import transaction
+
+from core import enums, logger
+
+_local = threading.local()
+
+
+def isActive():
+    """
+    Checks whether a unit of work is open on the calling thread.
+    :return: True if commits are currently being deferred, False otherwise.
+    """
+    return getattr(_local, 'depth', 0) > 0 and not getattr(_local, 'immediate', False)
+
+
+def begin():
+    """
+    Open a unit of work on the calling thread. Commits will be deferred until the matching call to end.
+    """
+    _local.depth = getattr(_local, 'depth', 0) + 1
+
+
+def end(success=True):
+    """
+    Close the unit of work on the calling thread. The outermost call commits every deferred change in one transaction,
+    or discards them if the work did not succeed.
+    :param success: Whether the work completed successfully and should be committed.
+    :return: True if the changes were committed, False if they were discarded.
+    """
+    depth = getattr(_local, 'depth', 0)
+    if depth == 0:
+        return False
+
+    _local.depth = depth - 1
+    if _local.depth > 0:
+        return success
+
+    if not success:
+        transaction.abort()
+        return False
+
+    try:
+        transaction.commit()
+    except Exception as e:
+        transaction.abort()
+        logger.logSystem('Unit of work failed to commit: ' + str(e), enums.e_log_event_level.critical)
+        return False
+
+    return True
+
+
+def commit():
+    """
+    Commit the current transaction, unless a unit of work is open on the calling thread, in which case the changes stay
+    pending until the unit of work ends. Persistent objects should call this instead of transaction.commit().
+    """
+    if isActive():
+        return
+
+    transaction.commit()
+
+
+@contextmanager
+def immediate():
+    """
+    Opt out of the unit of work for a block: every commit inside the block is written right away, along with anything
+    the unit of work had pending.
+    """
+    previous = getattr(_local, 'immediate', False)
+    _local.immediate = True
+    try:
+        yield
+    finally:
+        _local.immediate = previous
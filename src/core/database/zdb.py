@@ -3,48 +3,93 @@
 #
 # ######################################################################################################################
 
+import threading
+
 import BTrees.OOBTree
 import ZODB
 import ZODB.FileStorage
 import transaction
 
 from core import enums, logger
+from core.database import unitofwork
 from core.globalSettings import GlobalSettings
 from core.household.household import Household
 from core.user.user import User
 from core.web import server
 
 
+# The number of connections kept in the pool, and the number of objects each pooled connection keeps in its cache.
+DEFAULT_POOL_SIZE = 7
+DEFAULT_CACHE_SIZE = 400
+
+
 class DuplicateRecordException(Exception):
     """Exception raised when attempting to create a duplicate record inside one of the ZDB b-trees."""
     pass
 
-# The zdb database reference and root element..
+# The zdb database reference. Each thread works through its own pooled connection, and so its own root element.
 class Zdb():
 
-    def __init__(self, dbPath):
+    def __init__(self, dbPath, poolSize=DEFAULT_POOL_SIZE, cacheSize=DEFAULT_CACHE_SIZE):
         self.zdb = None
-        self.root = None
-        self.bringup(dbPath)
+        self._local = threading.local()
+        self.bringup(dbPath, poolSize, cacheSize)
 
-    def bringup(self, dbPath):
+    def bringup(self, dbPath, poolSize=DEFAULT_POOL_SIZE, cacheSize=DEFAULT_CACHE_SIZE):
         """
         Initialize the object database.
-        :return:
+        :param dbPath: The path to the object database file.
+        :param poolSize: The number of connections to keep in the connection pool.
+        :param cacheSize: The number of objects each connection keeps in its object cache.
         """
         storage = ZODB.FileStorage.FileStorage(dbPath) # usually 'config/secret/cute.zdb'
-        self.zdb = ZODB.DB(storage)
-        connection = self.zdb.open()
-        self.root = connection.root
+        self.zdb = ZODB.DB(storage, pool_size=poolSize, cache_size=cacheSize)
 
         self.schemaCheckAndCreate()
+        self.close()
 
 
     def teardown(self):
         if not self.zdb is None:
+            self.close()
             self.zdb.close()
 
 
+    @property
+    def root(self):
+        """
+        The root element as seen by the calling thread's connection. A connection is checked out of the pool if the
+        calling thread does not already hold one.
+        """
+        if self.zdb is None:
+            return None
+        return self.open().root
+
+    def open(self):
+        """
+        Check out a connection from the pool for the calling thread. Each request thread should open a connection when
+        the request begins and close it when the request ends.
+        :return: The connection held by the calling thread.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self.zdb.open()
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        """
+        Return the calling thread's connection to the pool. Any uncommitted changes made through it are discarded.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            return
+
+        self._local.connection = None
+        connection.transaction_manager.abort()
+        connection.close()
+
+
     def schemaCheckAndCreate(self):
         """
         Checks the root object for the presence of the expected BTrees and creates them if they do not exist.
@@ -101,7 +146,7 @@ class Zdb():
 
         house = Household(householdId)
         self.root.households[str(householdId)] = house
-        transaction.commit()
+        unitofwork.commit()
 
         return house
 
@@ -132,6 +177,6 @@ class Zdb():
 
         user = User(userId, displayName)
         self.root.users[str(userId)] = user
-        transaction.commit()
+        unitofwork.commit()
 
         return user
\ No newline at end of file
@@ -1,4 +1,6 @@
-import transaction, persistent
+import persistent
+
+from core.database import unitofwork
 
 
 class GlobalSettings(persistent.Persistent):
@@ -15,7 +17,7 @@ class GlobalSettings(persistent.Persistent):
     @yoApiKey.setter
     def yoApiKey(self, yoApiKey):
         self._yoApiKey = yoApiKey
-        transaction.commit()
+        unitofwork.commit()
 
     @property
     def registrationEnabled(self):
@@ -27,4 +29,4 @@ class GlobalSettings(persistent.Persistent):
             raise TypeError('registrationEnabled is a boolean property.')
 
         self._registrationEnabled = value
-        transaction.commit()
\ No newline at end of file
+        unitofwork.commit()
\ No newline at end of file
@@ -1,7 +1,33 @@
+import re
+
+from core import cache
 from core.user import user
 from core.database import db, queries
+from core.web import sessions
+
+from flask import g, session
+
+# The most households returned by one search.
+HOUSEHOLD_SEARCH_LIMIT = 20
+
+# The number of recent searches kept, and how long their results are trusted, in seconds. The cache is cleared when a
+# household is created or renamed in this process; the time limit covers changes made by other processes.
+SEARCH_CACHE_SIZE = 500
+SEARCH_CACHE_TTL = 30
 
-from flask import session
+searchCache = cache.LruCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+
+# The number of households whose memberships are kept, and how long they are trusted, in seconds. A household's entry is
+# dropped whenever its memberships change through this module; the time limit covers changes made by other processes.
+MEMBERSHIP_CACHE_SIZE = 2000
+MEMBERSHIP_CACHE_TTL = 60
+
+membershipCache = cache.LruCache(MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_CACHE_TTL)
+
+# Searches made only of these words can be answered by filtering the results of a shorter search, because matching them
+# in Python gives the same answer as the full-text index.
+_SIMPLE_WORD = re.compile('^[a-z0-9]+$')
+_NAME_WORD = re.compile('[a-z0-9]+')
 
 
 def getHouseholdType(householdId):
@@ -19,8 +45,148 @@ def getHouseholdRelation(householdId, userId):
     :param userId: The user to check.
     :return: A relation from enums.e_household_relation.
     """
-    val = db.query_db(queries.HOUSEHOLD_MEMBERSHIP_GET_FOR_USER_AND_HOUSEHOLD, [userId, householdId], True)
-    return val['e_household_relation'] if val is not None else None
+    return getMemberships(householdId).get(str(userId))
+
+def getMemberships(householdId):
+    """
+    Returns every membership of a household (including requests to join), loading them all in one query the first time
+    and answering from the membership cache after that. The returned dictionary is shared and must not be changed.
+    :param householdId: The household to check.
+    :return: A dictionary of user id (as a string) => relation from enums.e_household_relation.
+    """
+    found, memberships = membershipCache.get(str(householdId))
+    if found:
+        return memberships
+
+    rows = db.query_db(queries.HOUSEHOLD_MEMBERSHIP_GET_FOR_HOUSEHOLD, [householdId, ]) or []
+    memberships = {str(r['user']): r['e_household_relation'] for r in rows}
+    membershipCache.put(str(householdId), memberships)
+    return memberships
+
+def addMembership(householdId, userId, relation):
+    """
+    Add a user to a household (or record their request to join it).
+    :param householdId: The household.
+    :param userId: The user.
+    :param relation: The relation from enums.e_household_relation.
+    """
+    db.post_db(queries.HOUSEHOLD_MEMBERSHIP_ADD, [userId, householdId, relation])
+    membershipCache.invalidate(str(householdId))
+    sessions.invalidateContexts(householdId=householdId)
+
+def updateMembership(householdId, userId, relation):
+    """
+    Change a user's relation to a household, like when their request to join is approved.
+    :param householdId: The household.
+    :param userId: The user.
+    :param relation: The new relation from enums.e_household_relation.
+    """
+    db.post_db(queries.HOUSEHOLD_MEMBERSHIP_UPDATE, [relation, householdId, userId])
+    membershipCache.invalidate(str(householdId))
+    sessions.invalidateContexts(householdId=householdId)
+
+def removeMembership(householdId, userId):
+    """
+    Remove a user from a household, or deny their request to join it.
+    :param householdId: The household.
+    :param userId: The user.
+    """
+    db.post_db(queries.HOUSEHOLD_MEMBERSHIP_REMOVE, [householdId, userId])
+    membershipCache.invalidate(str(householdId))
+    sessions.invalidateContexts(householdId=householdId)
+
+def searchHouseholds(partial, limit=HOUSEHOLD_SEARCH_LIMIT):
+    """
+    Search for households by name. Every word of the search must start a word of the household name, so "ma ho" finds
+    "Maple House". Results are ranked best match first. Keys in each dictionary within the returned list are:
+        * id
+        * household_name
+        * e_household_type
+    :param partial: The search, as typed so far.
+    :param limit: The most households to return.
+    :return: A list of matching households.
+    """
+    match = toMatchQuery(partial)
+    if match is None:
+        return []
+
+    words = partial.lower().split()
+    key = (' '.join(words), limit)
+    found, results = searchCache.get(key)
+    if found:
+        return results
+
+    results = _refineCachedSearch(words, limit)
+    if results is None:
+        results = db.query_db(queries.HOUSEHOLD_SEARCH, [match, limit])
+
+    searchCache.put(key, results)
+    return results
+
+def invalidateSearchCache():
+    """
+    Forget cached search results. Call this whenever a household is created, renamed or removed.
+    """
+    searchCache.invalidate()
+
+def _refineCachedSearch(words, limit):
+    """
+    Typeahead searches grow one letter at a time, so the results of a shorter search are often still cached. When they
+    are, and they were not cut short by the limit, the longer search's results are among them and can be found without
+    going to the database.
+    :param words: The lowercased words of the search.
+    :param limit: The most households to return.
+    :return: The matching households, or None if the search has to go to the database.
+    """
+    if not all(_SIMPLE_WORD.match(w) for w in words):
+        return None
+
+    for shorter in _shorterSearches(words):
+        found, results = searchCache.get((' '.join(shorter), limit))
+        if found and len(results) < limit:
+            # The index folds accented letters into plain ones, which simple matching does not, so leave those names to
+            # the database.
+            if not all(h['household_name'].isascii() for h in results):
+                return None
+            return [h for h in results if _matchesWords(h['household_name'], words)]
+
+    return None
+
+def _shorterSearches(words):
+    """
+    Lists the searches that a search could have been typed from, longest first: the same words with the last one cut
+    shorter, then the same without the last word, and so on.
+    :param words: The words of the search.
+    :return: A generator of lists of words.
+    """
+    for count in range(len(words), 0, -1):
+        last = words[count - 1]
+        start = len(last) - 1 if count == len(words) else len(last)
+        for length in range(start, 0, -1):
+            yield words[:count - 1] + [last[:length]]
+
+def _matchesWords(name, words):
+    """
+    Checks that every word of a search starts some word of a household name, as the full-text index does.
+    :param name: The household name.
+    :param words: The lowercased words of the search.
+    :return: True if the name matches the search.
+    """
+    nameWords = _NAME_WORD.findall(name.lower())
+    return all(any(n.startswith(w) for n in nameWords) for w in words)
+
+def toMatchQuery(partial):
+    """
+    Turns a search into a full-text prefix query. Each word is quoted, so nothing the user types is read as query
+    syntax.
+    :param partial: The search, as typed so far.
+    :return: The query, or None if there is nothing to search for.
+    """
+    words = [w.replace('"', '') for w in partial.split()]
+    words = [w for w in words if len(w) > 0]
+    if len(words) == 0:
+        return None
+    return ' '.join('"' + w + '"*' for w in words)
 
 def getHouseholdsForUser(userId):
     """
@@ -55,7 +221,8 @@ def getUsersForCurrentHousehold():
 def setHousehold(householdId):
     """
     Set the current household for this session. Checks the validity of the household as well as the membership of the
-    current user. Populates household session variables.
+    current user. Only the household id is kept in the session; the rest comes from getContext, which looks it up again
+    after the household is selected.
     :param householdId: The household id to switch to.
     :return: True if the household was successfully set, False otherwise.
     """
@@ -68,9 +235,7 @@ def setHousehold(householdId):
         return False
 
     session['householdId'] = house['id']
-    session['householdName'] = house['household_name']
-    session['householdType'] = house['e_household_type']
-    session['householdRelation'] = getHouseholdRelation(house['id'], session['id'])
+    sessions.dropContext()
     return True
 
 def unsetHousehold():
@@ -78,9 +243,62 @@ def unsetHousehold():
     Erase the current household data from the session, like when we go back to the household select screen.
     """
     session.pop('householdId')
-    session.pop('householdName')
-    session.pop('householdType')
-    session.pop('householdRelation')
+
+def getContext():
+    """
+    Gets the context of the current session: facts about its user and current household that pages show or check on
+    every request. The context is built once and cached with the session (in the store with server-side sessions, or in
+    the cookie without them), until the session switches user or household or the facts change. A context in a cookie
+    is also rebuilt once it is no longer current (see SessionContext.isCurrent).
+    :return: The session context.
+    """
+    userId = session.get('id')
+    householdId = session.get('householdId')
+
+    context = g.get('sessionContext')
+    if context is not None and context.describes(userId, householdId):
+        return context
+
+    if isinstance(session, sessions.ServerSession):
+        context = session.context
+    else:
+        cached = session.get('context')
+        context = sessions.SessionContext(**cached) if cached else None
+        if context is not None and not context.isCurrent():
+            context = None
+
+    if context is None or not context.describes(userId, householdId):
+        context = buildContext(userId, householdId)
+        if isinstance(session, sessions.ServerSession):
+            session.context = context
+        else:
+            session['context'] = context.asDict()
+
+    g.sessionContext = context
+    return context
+
+def buildContext(userId, householdId):
+    """
+    Looks up the facts for a session context.
+    :param userId: The user, or None if nobody is logged in.
+    :param householdId: The household, or None if none is selected.
+    :return: The session context.
+    """
+    context = sessions.SessionContext(userId, householdId)
+
+    if userId is not None:
+        row = user.getUserRow(userId)
+        if row is not None:
+            context.email = row['email']
+
+    if householdId is not None:
+        house = db.getRow('households', householdId)
+        if house is not None:
+            context.householdName = house['household_name']
+            context.householdType = house['e_household_type']
+            context.householdRelation = getHouseholdRelation(householdId, userId)
+
+    return context
 
 
 
@@ -88,7 +306,9 @@ def unsetHousehold():
 # Household object representation
 # ######################################################################################################################
 
-import persistent, transaction
+import persistent
+
+from core.database import unitofwork
 from core.household.shopping import ShoppingList
 
 class Household(persistent.Persistent):
@@ -129,4 +349,4 @@ class Household(persistent.Persistent):
     def addShoppingList(self, shoppingListTitle):
         self._shoppingLists.append(ShoppingList(shoppingListTitle))
         self._p_changed = True
-        transaction.commit()
\ No newline at end of file
+        unitofwork.commit()
\ No newline at end of file
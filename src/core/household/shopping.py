@@ -1,4 +1,6 @@
-import persistent, transaction
+import persistent
+
+from core.database import unitofwork
 
 class ShoppingListItem(persistent.Persistent):
     """
@@ -16,7 +18,7 @@ class ShoppingListItem(persistent.Persistent):
     @title.setter
     def title(self, value):
         self._title = value
-        transaction.commit()
+        unitofwork.commit()
 
     @property
     def checked(self):
@@ -25,7 +27,7 @@ class ShoppingListItem(persistent.Persistent):
     @checked.setter
     def checked(self, value):
         self._checked = value
-        transaction.commit()
+        unitofwork.commit()
 
     def toggle(self):
         self.checked = not self.checked
@@ -38,7 +40,7 @@ class ShoppingList(persistent.Persistent):
     def __init__(self, title):
         self._title = title
         self._items = []
-        transaction.commit()
+        unitofwork.commit()
 
     def getItems(self):
         return enumerate(self._items)
@@ -46,13 +48,13 @@ class ShoppingList(persistent.Persistent):
     def addItem(self, item):
         self._items.append(ShoppingListItem(item))
         self._p_changed = True
-        transaction.commit()
+        unitofwork.commit()
 
     def removeItem(self, itemIdx):
         # TODO: Check itemIdx
         del self._items[itemIdx]
         self._p_changed = True
-        transaction.commit()
+        unitofwork.commit()
 
     def toggleItem(self, itemIdx):
         # TODO: Check itemIdx
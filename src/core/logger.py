@@ -6,7 +6,7 @@
 
 from os import environ
 
-from flask import abort
+from flask import abort, g
 
 from core import enums
 from core.database import db, queries
@@ -47,7 +47,12 @@ def _log(message, log, level=enums.e_log_event_level, show=False, user=None):
     if show or level == enums.e_log_event_level.crash:
         print('[' + levelTag(level) + '][' + logTag(log) + ']: ' + message)
 
-    db.post_db(queries.LOG_INSERT, [user, message, level, log])
+    # Hand the event to the background writer when there is one, so that logging doesn't commit on the request path.
+    writer = getattr(getattr(g, 's', None), 'logWriter', None)
+    if writer is not None and writer.isRunning():
+        writer.write(user, message, level, log)
+    else:
+        db.post_db(queries.LOG_INSERT, [user, message, level, log])
 
 
 def logAdmin(message, user, level=enums.e_log_event_level.info):
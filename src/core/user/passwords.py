@@ -0,0 +1,293 @@
+# ######################################################################################################################
+# Password hashing
+#
+# Hashing a password takes a deliberately large amount of CPU. Done in the request thread, a burst of logins would tie
+# up every worker and stall ordinary page loads, so hashes are computed in a small pool of separate processes instead.
+#
+# The pool only accepts as much work as its processes plus a short queue can hold. Beyond that, hashing is refused with
+# HasherBusyException right away, so that the login can be answered with 503 Service Unavailable rather than piling up.
+#
+# Stored hashes record how they were made, as scheme$cost$salt$hash with the salt and hash in base64, e.g.
+#
+#     pbkdf2_sha512$100000$<salt>$<hash>
+#
+# so the scheme and cost can be changed per deployment without invalidating anyone's password: a hash that doesn't match
+# the current settings still verifies, and is replaced the next time its owner logs in. Hashes from before this format
+# (raw PBKDF2-SHA512 bytes, with the instance-wide SALT) are handled the same way.
+# ######################################################################################################################
+
+import base64
+import concurrent.futures
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+# Password hash schemes, by name, and the digest each uses with PBKDF2. New schemes can be added here.
+SCHEMES = {
+    'pbkdf2_sha512': 'sha512',
+    'pbkdf2_sha256': 'sha256',
+}
+
+# The scheme new hashes are made with.
+DEFAULT_SCHEME = 'pbkdf2_sha512'
+
+# The PBKDF2 iteration count for password hashes.
+ITERATIONS = 100000
+
+# The iteration count of hashes from before the versioned format.
+LEGACY_ITERATIONS = 100000
+
+# The length of each user's salt, in bytes.
+SALT_BYTES = 16
+
+# How the hashing processes are started. Forking the server itself would copy its threads' locks and its open database
+# connections into each process, so they are forked from a clean server process instead.
+START_METHOD = 'forkserver'
+
+# The number of hashing processes. Zero hashes in the calling thread instead.
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+# The number of hashes that can wait for a free process.
+DEFAULT_QUEUE_SIZE = 16
+
+# How long a hash can take, waiting included, before the caller gives up on it, in seconds.
+DEFAULT_TIMEOUT = 10.0
+
+
+class HasherBusyException(Exception):
+    """Exception raised when the password hasher is too busy to take on another hash."""
+    pass
+
+
+def pbkdf2(password, salt, iterations=ITERATIONS, digest='sha512'):
+    """
+    Compute a password hash.
+    :param password: The password.
+    :param salt: The salt, as bytes or a string.
+    :param iterations: The PBKDF2 iteration count.
+    :param digest: The hashlib digest to use.
+    :return: The hash, as bytes.
+    """
+    if isinstance(salt, str):
+        salt = bytearray(salt, 'utf-8')
+    return hashlib.pbkdf2_hmac(digest, bytearray(password, 'utf-8'), salt, iterations)
+
+
+def encode(scheme, iterations, salt, digest):
+    """
+    Encode a password hash for storage.
+    :param scheme: The scheme name, from SCHEMES.
+    :param iterations: The iteration count.
+    :param salt: The salt, as bytes.
+    :param digest: The hash, as bytes.
+    :return: The stored form of the hash.
+    """
+    return '$'.join([scheme, str(iterations), base64.b64encode(salt).decode('ascii'),
+                     base64.b64encode(digest).decode('ascii')])
+
+
+def decode(stored):
+    """
+    Decode a stored password hash.
+    :param stored: The stored form of the hash.
+    :return: A tuple (scheme, iterations, salt, hash), or None if this is not a hash in the versioned format.
+    """
+    if not isinstance(stored, str):
+        return None
+
+    parts = stored.split('$')
+    if len(parts) != 4 or parts[0] not in SCHEMES or not parts[1].isdigit():
+        return None
+
+    try:
+        return parts[0], int(parts[1]), base64.b64decode(parts[2], validate=True), base64.b64decode(parts[3], validate=True)
+    except ValueError:
+        return None
+
+
+class PasswordHasher:
+    """
+    Computes password hashes in a bounded pool of worker processes.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, queueSize=DEFAULT_QUEUE_SIZE, timeout=DEFAULT_TIMEOUT,
+                 scheme=DEFAULT_SCHEME, iterations=ITERATIONS):
+        """
+        Create a hasher. The worker processes are started the first time a password is hashed.
+        :param workers: The number of hashing processes. Zero hashes in the calling thread, without admission control.
+        :param queueSize: The number of hashes that can wait for a free process.
+        :param timeout: How long a hash can take, waiting included, in seconds.
+        :param scheme: The scheme new password hashes are made with, from SCHEMES.
+        :param iterations: The iteration count new password hashes are made with.
+        """
+        if type(workers) is not int or type(queueSize) is not int or type(iterations) is not int:
+            raise TypeError('Worker count, queue size and iterations must be integers.')
+        if workers < 0 or queueSize < 0 or timeout <= 0 or iterations <= 0:
+            raise ValueError('Worker count and queue size must not be negative, and the timeout and iterations must be '
+                             'positive.')
+        if scheme not in SCHEMES:
+            raise ValueError('Unknown password hash scheme ' + str(scheme) + '.')
+
+        self._scheme = scheme
+        self._iterations = iterations
+
+        self._workers = workers
+        self._capacity = workers + queueSize
+        self._timeout = timeout
+
+        self._pool = None
+        self._lock = threading.Lock()
+
+        self._inFlight = 0
+        self._hashed = 0
+        self._rejected = 0
+        self._timedOut = 0
+        self._totalTime = 0.0
+        self._maxTime = 0.0
+
+    def makeHash(self, password):
+        """
+        Hash a new password for storage, with a new random salt and the current scheme and cost.
+        :param password: The password.
+        :return: A tuple (stored, seconds): the stored form of the hash, and how long hashing took.
+        :raises HasherBusyException: If the pool is full, or the hash took too long.
+        """
+        salt = os.urandom(SALT_BYTES)
+        digest, elapsed = self.hash(password, salt, self._iterations, SCHEMES[self._scheme])
+        return encode(self._scheme, self._iterations, salt, digest), elapsed
+
+    def verify(self, password, stored, legacySalt):
+        """
+        Check a password against a stored hash, in constant time. When there is no stored hash (like for a username that
+        doesn't exist), a hash is still computed so that the check takes as long as a real one.
+        :param password: The password to check.
+        :param stored: The stored form of the hash, or None.
+        :param legacySalt: The instance-wide salt of hashes from before the versioned format.
+        :return: A tuple (matches, needsRehash, seconds). needsRehash is True when the password matches but the stored
+                 hash was not made with the current scheme and cost, and should be replaced using makeHash.
+        :raises HasherBusyException: If the pool is full, or the hash took too long.
+        """
+        decoded = decode(stored)
+        if decoded is not None:
+            scheme, iterations, salt, expected = decoded
+        elif isinstance(stored, (bytes, bytearray)):
+            scheme, iterations, salt, expected = DEFAULT_SCHEME, LEGACY_ITERATIONS, legacySalt, bytes(stored)
+        else:
+            scheme, iterations, salt, expected = self._scheme, self._iterations, os.urandom(SALT_BYTES), None
+
+        digest, elapsed = self.hash(password, salt, iterations, SCHEMES[scheme])
+        if expected is None:
+            return False, False, elapsed
+
+        matches = hmac.compare_digest(digest, expected)
+        current = decoded is not None and scheme == self._scheme and iterations == self._iterations
+        return matches, matches and not current, elapsed
+
+    def hash(self, password, salt, iterations=ITERATIONS, digest='sha512'):
+        """
+        Compute a password hash in the worker pool.
+        :param password: The password.
+        :param salt: The salt, as bytes or a string.
+        :param iterations: The PBKDF2 iteration count.
+        :param digest: The hashlib digest to use.
+        :return: A tuple (hash, seconds): the hash as bytes, and how long it took, waiting included.
+        :raises HasherBusyException: If the pool is full, or the hash took too long.
+        """
+        start = time.perf_counter()
+
+        if self._workers == 0:
+            return self._record(pbkdf2(password, salt, iterations, digest), start)
+
+        with self._lock:
+            if self._inFlight >= self._capacity:
+                self._rejected += 1
+                raise HasherBusyException('Too many passwords are being hashed.')
+            self._inFlight += 1
+            pool = self._getPool()
+
+        try:
+            future = pool.submit(pbkdf2, password, salt, iterations, digest)
+        except (BrokenProcessPool, RuntimeError):
+            self._release(pool, broken=True)
+            raise HasherBusyException('The password hashing pool is not running.')
+
+        # The slot is held until the work is actually done, even if this caller stops waiting for it, so the pool can't
+        # be overfilled by hashes that timed out.
+        future.add_done_callback(lambda f: self._release(pool, broken=isinstance(f.exception(), BrokenProcessPool)))
+
+        try:
+            digest = future.result(timeout=self._timeout)
+        except concurrent.futures.TimeoutError:
+            with self._lock:
+                self._timedOut += 1
+            raise HasherBusyException('Hashing the password took too long.')
+        except BrokenProcessPool:
+            raise HasherBusyException('A password hashing process died.')
+
+        return self._record(digest, start)
+
+    def getStats(self):
+        """
+        Gets timing and load figures for the hasher.
+        :return: A dictionary of statistics.
+        """
+        with self._lock:
+            return {
+                'inFlight': self._inFlight,
+                'capacity': self._capacity,
+                'hashed': self._hashed,
+                'rejected': self._rejected,
+                'timedOut': self._timedOut,
+                'meanMs': (self._totalTime / self._hashed * 1000) if self._hashed > 0 else 0.0,
+                'maxMs': self._maxTime * 1000,
+            }
+
+    def shutdown(self):
+        """
+        Stop the worker processes. Hashes that are already running are finished first.
+        """
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def _getPool(self):
+        """
+        Gets the worker pool, starting it if needed. Must be called holding the lock.
+        :return: The pool.
+        """
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self._workers,
+                                                                mp_context=multiprocessing.get_context(START_METHOD))
+        return self._pool
+
+    def _release(self, pool, broken=False):
+        """
+        Free a slot in the pool once a hash is done (or could not be started).
+        :param pool: The pool the hash was submitted to.
+        :param broken: Whether the pool turned out to be broken, in which case a new one is started next time.
+        """
+        with self._lock:
+            self._inFlight -= 1
+            if broken and self._pool is pool:
+                self._pool = None
+
+    def _record(self, digest, start):
+        """
+        Record how long a hash took.
+        :param digest: The hash.
+        :param start: When hashing was requested, from time.perf_counter.
+        :return: A tuple (hash, seconds).
+        """
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._hashed += 1
+            self._totalTime += elapsed
+            self._maxTime = max(self._maxTime, elapsed)
+        return digest, elapsed
@@ -0,0 +1,206 @@
+# ######################################################################################################################
+# Login throttling
+#
+# Every login attempt costs a full password hash, which makes guessing passwords (or stuffing leaked credentials) very
+# expensive for us. Login attempts are rationed per username and per client address with token buckets: each bucket
+# holds a few tokens, every attempt spends one, and tokens trickle back over time. An attempt with an empty bucket is
+# turned away before anything is hashed.
+#
+# Buckets live in memory, spread over several independently locked shards so that concurrent logins rarely contend.
+# Buckets that have refilled completely are no different from new ones, so they are swept away now and then. The
+# buckets that are still draining can optionally be saved to the SQL database at shutdown and loaded at startup, so
+# that restarting the server doesn't hand out fresh tokens.
+# ######################################################################################################################
+
+import threading
+import time
+
+from core.database import queries
+
+# Per username: a burst of 5 attempts, then one more every 20 seconds.
+USERNAME_CAPACITY = 5
+USERNAME_REFILL = 1 / 20
+
+# Per client address: a burst of 30 attempts, then one more every 2 seconds. Addresses can be shared (offices, NAT), so
+# this is looser than the per username limit.
+ADDRESS_CAPACITY = 30
+ADDRESS_REFILL = 1 / 2
+
+# The number of independently locked shards in a limiter.
+DEFAULT_SHARDS = 16
+
+# How often each shard sweeps out its refilled buckets, in seconds.
+SWEEP_INTERVAL = 60
+
+
+class TokenBucketLimiter:
+    """
+    Rations attempts per key with token buckets.
+    """
+
+    def __init__(self, capacity, refill, shards=DEFAULT_SHARDS):
+        """
+        Create a limiter.
+        :param capacity: The most tokens a bucket holds, i.e. the largest burst of attempts allowed.
+        :param refill: The number of tokens added back to a bucket per second.
+        :param shards: The number of independently locked shards.
+        """
+        if capacity <= 0 or refill <= 0 or shards <= 0:
+            raise ValueError('Capacity, refill rate and shard count must be positive.')
+
+        self._capacity = capacity
+        self._refill = refill
+        self._shards = [_Shard() for __ in range(shards)]
+
+    def allow(self, key, now=None):
+        """
+        Spend a token for an attempt.
+        :param key: What the attempt is counted against, e.g. a username.
+        :param now: The current time, from time.time. Defaults to now.
+        :return: True if the attempt is allowed, False if the bucket is empty.
+        """
+        if now is None:
+            now = time.time()
+
+        shard = self._shard(key)
+        with shard.lock:
+            if now - shard.swept >= SWEEP_INTERVAL:
+                self._sweep(shard, now)
+
+            tokens = self._tokens(shard.buckets.get(key), now)
+            if tokens < 1:
+                shard.buckets[key] = (tokens, now)
+                return False
+
+            shard.buckets[key] = (tokens - 1, now)
+            return True
+
+    def getTokens(self, key, now=None):
+        """
+        Gets the number of tokens left for a key.
+        :param key: The key.
+        :param now: The current time, from time.time. Defaults to now.
+        :return: The number of tokens, possibly fractional.
+        """
+        if now is None:
+            now = time.time()
+
+        shard = self._shard(key)
+        with shard.lock:
+            return self._tokens(shard.buckets.get(key), now)
+
+    def sweep(self, now=None):
+        """
+        Drop every bucket that has refilled completely.
+        :param now: The current time, from time.time. Defaults to now.
+        """
+        if now is None:
+            now = time.time()
+
+        for shard in self._shards:
+            with shard.lock:
+                self._sweep(shard, now)
+
+    def getBuckets(self, now=None):
+        """
+        Gets every bucket that has not refilled completely.
+        :param now: The current time, from time.time. Defaults to now.
+        :return: A list of (key, tokens, updated) tuples.
+        """
+        self.sweep(now)
+
+        buckets = []
+        for shard in self._shards:
+            with shard.lock:
+                buckets.extend((key, tokens, updated) for key, (tokens, updated) in shard.buckets.items())
+        return buckets
+
+    def setBucket(self, key, tokens, updated):
+        """
+        Restore a bucket, e.g. one saved before a restart.
+        :param key: The key.
+        :param tokens: The number of tokens it held.
+        :param updated: When it held that many, from time.time.
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            shard.buckets[key] = (min(tokens, self._capacity), updated)
+
+    def __len__(self):
+        return sum(len(shard.buckets) for shard in self._shards)
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _tokens(self, bucket, now):
+        """
+        Works out how many tokens a bucket holds now, including the ones that have trickled back since it was last used.
+        :param bucket: The bucket tuple (tokens, updated), or None for a new bucket.
+        :param now: The current time.
+        :return: The number of tokens.
+        """
+        if bucket is None:
+            return self._capacity
+        tokens, updated = bucket
+        return min(self._capacity, tokens + max(now - updated, 0) * self._refill)
+
+    def _sweep(self, shard, now):
+        """
+        Drop the buckets of a shard that have refilled completely. Must be called holding the shard's lock.
+        """
+        shard.buckets = {k: b for k, b in shard.buckets.items() if self._tokens(b, now) < self._capacity}
+        shard.swept = now
+
+
+class _Shard:
+    """One independently locked part of a limiter's buckets."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.swept = 0
+
+
+class LoginThrottle:
+    """
+    Rations login attempts per username and per client address.
+    """
+
+    def __init__(self, shards=DEFAULT_SHARDS):
+        self._usernames = TokenBucketLimiter(USERNAME_CAPACITY, USERNAME_REFILL, shards)
+        self._addresses = TokenBucketLimiter(ADDRESS_CAPACITY, ADDRESS_REFILL, shards)
+
+    def allow(self, username, address, now=None):
+        """
+        Spend tokens for a login attempt. Usernames are compared without case, so that varying the case of a username
+        doesn't get around the limit.
+        :param username: The username being logged in to.
+        :param address: The client's address.
+        :param now: The current time, from time.time. Defaults to now.
+        :return: True if the attempt may go ahead.
+        """
+        if not self._addresses.allow(address, now):
+            return False
+        return self._usernames.allow(username.lower(), now)
+
+    def save(self, connection, now=None):
+        """
+        Save the buckets that are still draining, replacing any saved before.
+        :param connection: The SQL connection to save with.
+        :param now: The current time, from time.time. Defaults to now.
+        """
+        connection.execute(queries.LOGIN_THROTTLE_CLEAR)
+        for kind, limiter in [('user', self._usernames), ('address', self._addresses)]:
+            connection.executemany(queries.LOGIN_THROTTLE_SAVE,
+                                   [(kind, key, tokens, updated) for key, tokens, updated in limiter.getBuckets(now)])
+        connection.commit()
+
+    def load(self, connection):
+        """
+        Restore the buckets saved by save.
+        :param connection: The SQL connection to load with.
+        """
+        limiters = {'user': self._usernames, 'address': self._addresses}
+        for kind, key, tokens, updated in connection.execute(queries.LOGIN_THROTTLE_LOAD):
+            if kind in limiters:
+                limiters[kind].setBucket(key, tokens, updated)
@@ -1,7 +1,16 @@
 from flask import abort, session, g
 
+from core import cache
 from core.database import db
 
+# The number of display names kept in the cache, and how long a cached name is trusted, in seconds. Names are dropped
+# from the cache when they change in this process; the time limit covers changes made elsewhere (like the shell).
+DISPLAYNAME_CACHE_SIZE = 1000
+DISPLAYNAME_CACHE_TTL = 60
+
+
+displaynameCache = cache.LruCache(DISPLAYNAME_CACHE_SIZE, DISPLAYNAME_CACHE_TTL)
+
 
 def getUserRow(userId):
     """
@@ -19,10 +28,49 @@ def getUserDisplayname(userId):
     :param userId: The user id to look up.
     :return: The display name for this user.
     """
-    u = g.dog.zdb.getUser(userId)
-    if u is None:
-        return None
-    return u.displayname
+    return getUserDisplaynames([userId])[userId]
+
+
+def getUserDisplaynames(userIds):
+    """
+    Convert many user ids into their display names at once, e.g. for every row of a page. Each distinct id is looked up
+    once, and only if its name is not already cached.
+    :param userIds: An iterable of user ids. May contain duplicates and None.
+    :return: A dictionary of user id => display name (None for ids that are not users).
+    """
+    return resolveDisplaynames(g.dog.zdb, userIds)
+
+
+def resolveDisplaynames(zdb, userIds, names=displaynameCache):
+    """
+    Resolve display names for a batch of user ids, going through the display name cache.
+    :param zdb: The object database to load uncached users from.
+    :param userIds: An iterable of user ids. May contain duplicates and None.
+    :param names: The display name cache to use.
+    :return: A dictionary of user id => display name (None for ids that are not users).
+    """
+    resolved = {}
+    missing = []
+    for userId in set(userIds):
+        if userId is None:
+            resolved[userId] = None
+            continue
+
+        found, name = names.get(str(userId))
+        if found:
+            resolved[userId] = name
+        else:
+            missing.append(userId)
+
+    if missing:
+        users = zdb.root.users
+        for userId in missing:
+            u = users.get(str(userId))
+            name = u.displayname if u is not None else None
+            names.put(str(userId), name)
+            resolved[userId] = name
+
+    return resolved
 
 
 def checkLogin():
@@ -52,7 +100,9 @@ def isCuteCasaAdmin(userId):
 # User object representation
 # ######################################################################################################################
 
-import persistent, transaction
+import persistent
+
+from core.database import unitofwork
 
 class User(persistent.Persistent):
 
@@ -83,7 +133,8 @@ class User(persistent.Persistent):
     @displayname.setter
     def displayname(self, displayname):
         self._displayname = displayname
-        transaction.commit()
+        displaynameCache.invalidate(str(self.id))
+        unitofwork.commit()
 
     @property
     def yoUsername(self):
@@ -91,7 +142,7 @@ class User(persistent.Persistent):
     @yoUsername.setter
     def yoUsername(self, yoUsername):
         self._yoUsername = yoUsername
-        transaction.commit()
+        unitofwork.commit()
 
 
     @property
@@ -100,7 +151,7 @@ class User(persistent.Persistent):
     @favoriteColor.setter
     def favoriteColor(self, favoriteColor):
         self._favoriteColor = favoriteColor
-        transaction.commit()
+        unitofwork.commit()
 
     @property
     def cellphone(self):
@@ -108,4 +159,4 @@ class User(persistent.Persistent):
     @cellphone.setter
     def cellphone(self, cellphone):
         self._cellphone = cellphone
-        transaction.commit()
\ No newline at end of file
+        unitofwork.commit()
\ No newline at end of file
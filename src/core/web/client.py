@@ -1,6 +1,14 @@
-from flask import request, redirect, url_for
+from flask import abort, flash, request, redirect, session, url_for
 
-from core import enums, logger
+from core import cache, enums, logger
+
+# The number of object lookups kept in the identity cache, and how long they are kept, in seconds. Entries are keyed by
+# the last transaction id of the object database, so any commit makes every entry stale; the time limit just keeps the
+# stale ones from lingering.
+IDENTITY_CACHE_SIZE = 2000
+IDENTITY_CACHE_TTL = 60
+
+identityCache = cache.LruCache(IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL)
 
 
 # Convenience methods to do things to the client request, like send a failure page, or format ajax json.
@@ -24,29 +32,83 @@ def failRequest(code, message):
         return redirect(url_for(message))
 
 
-def run_integrity_checks():
+class RequestContext:
+    """
+    The request's handle on the object database, kept on g.dog. The logged in user (me) and their current household (hh)
+    are only looked up the first time the request asks for them, so requests that never use them don't pay for them.
+    """
 
-    # TODO: We need to just force a logout here since the user probably doesn't exit
-    # TODO: Don't populate these items, have a cleaner API for getting useful items.
+    def __init__(self, zdb):
+        """
+        Create the request context.
+        :param zdb: The object database.
+        """
+        self.zdb = zdb
+        self._me = None
+        self._meLoaded = False
+        self._hh = None
+        self._hhLoaded = False
 
-    # Populate useful items
-    if 'id' in session:
-        g.dog.me = g.dog.zdb.getUser(session['id'])
+    @property
+    def me(self):
+        """
+        The user object of the logged in user, or None if nobody is logged in.
+        """
+        if not self._meLoaded:
+            self._me = self._materialize('user', session.get('id'), self.zdb.getUser)
+            self._meLoaded = True
+        return self._me
 
-        if g.dog.me is None:
-            logger.logSystem('Integrity error - user object lookup failed for user id ' + str(session['id']),
-                             enums.e_log_event_level.critical)
-            session.clear()
-            flash('Please log in again.', 'info')
-            return redirect(url_for('splash'))
+    @property
+    def hh(self):
+        """
+        The household object of the session's current household, or None if none is selected.
+        """
+        if not self._hhLoaded:
+            self._hh = self._materialize('household', session.get('householdId'), self.zdb.getHousehold)
+            self._hhLoaded = True
+        return self._hh
 
-    if 'householdId' in session:
-        g.dog.hh = g.dog.zdb.getHousehold(session['householdId'])
+    def _materialize(self, kind, objectId, lookup):
+        """
+        Look up an object the session refers to. If it doesn't exist, the session can't be trusted, so it is cleared
+        and the request is answered with a redirect to the splash page.
+        :param kind: What kind of object this is, for the identity cache and the log.
+        :param objectId: The object's id, or None.
+        :param lookup: The Zdb method that looks the object up by id.
+        :return: The object, or None if the id is None.
+        """
+        if objectId is None:
+            return None
 
-        if g.dog.hh is None:
-            logger.logSystem("Integrity error - household object lookup failed for household id " +
-                             str(session['householdId']),
+        found = getObject(self.zdb, kind, objectId, lookup)
+        if found is None:
+            logger.logSystem('Integrity error - ' + kind + ' object lookup failed for ' + kind + ' id ' + str(objectId),
                              enums.e_log_event_level.critical)
             session.clear()
             flash('Please log in again.', 'info')
-            return redirect(url_for('splash'))
\ No newline at end of file
+            abort(redirect(url_for('splash')))
+
+        return found
+
+
+def getObject(zdb, kind, objectId, lookup):
+    """
+    Look up an object by id, through the identity cache. The cache remembers where the object is stored, so that as long
+    as nothing has been committed since, it can be fetched straight from the connection without walking the collection.
+    :param zdb: The object database.
+    :param kind: What kind of object this is, e.g. 'user' or 'household'.
+    :param objectId: The object's id.
+    :param lookup: The Zdb method that looks the object up by id.
+    :return: The object, or None if there is no such object.
+    """
+    key = (kind, str(objectId), zdb.zdb.lastTransaction())
+    found, oid = identityCache.get(key)
+    if found:
+        return zdb.open().get(oid)
+
+    obj = lookup(objectId)
+    if obj is not None and obj._p_oid is not None:
+        identityCache.put(key, obj._p_oid)
+    return obj
+
@@ -0,0 +1,464 @@
+# ######################################################################################################################
+# Server-side sessions
+#
+# By default Flask keeps the whole session in a signed cookie, which the browser sends back with every request. With
+# server-side sessions, the cookie only holds a signed session id, and the session itself is kept here: in memory for the
+# most recently used sessions, and spilled to the SQL database when a session is pushed out of memory (or the server
+# shuts down). A session that isn't in memory is read back from the database the next time it is used.
+#
+# Each session in memory can also carry a context object: facts about the session's user and household that would
+# otherwise be looked up on every request (see core.household.household.getContext). Contexts are never written to the
+# database, and are dropped whenever the user or household they describe changes. Without server-side sessions, the
+# context is kept in the cookie instead. Other sessions' cookies can't be reached to drop their contexts, so a context
+# in a cookie is rebuilt when it is older than the last change this process made to its user or household, and in any
+# case once it is CONTEXT_TTL old, to pick up changes made by other processes.
+# ######################################################################################################################
+
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, has_app_context, has_request_context, session
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+from core import cache
+from core.database import queries
+
+# The number of sessions kept in memory. Less recently used sessions are spilled to the SQL database.
+DEFAULT_SIZE = 10000
+
+# How long an unused session is kept, in seconds.
+DEFAULT_LIFETIME = 14 * 24 * 60 * 60
+
+# Keeps the signed session ids apart from anything else signed with the secret key.
+SIGNER_SALT = 'cutecasa-session'
+
+# How long a context kept in a cookie is trusted, in seconds.
+CONTEXT_TTL = 60
+
+# When each user and household last changed in this process, for telling whether a context kept in a cookie is out of
+# date. Changes only need remembering for as long as a context is trusted.
+CONTEXT_CHANGES_SIZE = 10000
+
+contextChanges = cache.LruCache(CONTEXT_CHANGES_SIZE, CONTEXT_TTL)
+
+
+class SessionContext:
+    """
+    Facts about a session's user and household, cached with the session. Every field but the ids may be None when the
+    user or household has no such fact, or none is selected.
+    """
+
+    def __init__(self, userId=None, householdId=None, email=None, householdName=None, householdType=None,
+                 householdRelation=None, built=None):
+        self.userId = userId
+        self.householdId = householdId
+        self.email = email
+        self.householdName = householdName
+        self.householdType = householdType
+        self.householdRelation = householdRelation
+
+        # When the facts were looked up, from time.time.
+        self.built = time.time() if built is None else built
+
+    def describes(self, userId, householdId):
+        """
+        Checks whether this context is for a user and household.
+        :param userId: The user id.
+        :param householdId: The household id.
+        :return: True if this context describes that user and household.
+        """
+        return self.userId == userId and self.householdId == householdId
+
+    def isCurrent(self, now=None):
+        """
+        Checks whether this context can still be trusted: it isn't CONTEXT_TTL old yet, and its user and household
+        haven't changed in this process since it was built.
+        :param now: The current time, from time.time. Defaults to now.
+        :return: True if the context is current.
+        """
+        now = time.time() if now is None else now
+        if now - self.built >= CONTEXT_TTL:
+            return False
+
+        for key in [('user', str(self.userId)), ('household', str(self.householdId))]:
+            found, changed = contextChanges.get(key)
+            if found and changed >= self.built:
+                return False
+
+        return True
+
+    def asDict(self):
+        """
+        Gets the context as a dictionary, for keeping in a cookie session. SessionContext(**d) turns it back.
+        :return: A dictionary of field => value.
+        """
+        return dict(self.__dict__)
+
+
+class SessionStore:
+    """
+    Keeps sessions by id, in memory with the least recently used ones spilled to the SQL database. Safe to share between
+    threads.
+    """
+
+    def __init__(self, pool, size=DEFAULT_SIZE, lifetime=DEFAULT_LIFETIME):
+        """
+        Create a session store.
+        :param pool: The SQL connection pool to spill sessions to.
+        :param size: The number of sessions kept in memory.
+        :param lifetime: How long an unused session is kept, in seconds.
+        """
+        if type(size) is not int:
+            raise TypeError('Session store size must be an integer.')
+        if size <= 0 or lifetime <= 0:
+            raise ValueError('Session store size and lifetime must be positive.')
+
+        self._pool = pool
+        self._size = size
+        self._lifetime = lifetime
+
+        # Session id => [data as JSON, expiry, context].
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Bumped whenever contexts are invalidated, so that a request which built its context before that can't save it.
+        self._generation = 0
+
+        self._spilled = 0
+        self._restored = 0
+
+    def load(self, sid, now=None):
+        """
+        Look up a session.
+        :param sid: The session id.
+        :param now: The current time, from time.time. Defaults to now.
+        :return: A tuple (data, context, generation), or None if there is no such session (or it has expired). Pass
+                 the generation back to save.
+        """
+        now = time.time() if now is None else now
+
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(sid)
+                    return json.loads(entry[0]), entry[2], self._generation
+                del self._entries[sid]
+
+        connection = self._pool.checkout()
+        try:
+            row = connection.execute(queries.SESSION_GET, [sid, now]).fetchone()
+        finally:
+            self._pool.checkin(connection)
+        if row is None:
+            return None
+
+        with self._lock:
+            self._restored += 1
+            generation = self._generation
+        self._put(sid, [row[0], row[1], None])
+        return json.loads(row[0]), None, generation
+
+    def save(self, sid, data, context=None, generation=None, now=None):
+        """
+        Store a session, and push it back out to the full lifetime.
+        :param sid: The session id.
+        :param data: The session's data, as a dictionary that can be written as JSON. If None, the data stored before is
+                     kept and only the lifetime and context are updated.
+        :param context: The session's context object, or None.
+        :param generation: The generation load returned. The context is only kept if no contexts have been invalidated
+                           since.
+        :param now: The current time, from time.time. Defaults to now.
+        """
+        now = time.time() if now is None else now
+
+        with self._lock:
+            if generation != self._generation:
+                context = None
+            entry = self._entries.get(sid)
+
+        if data is not None:
+            text = json.dumps(data)
+        elif entry is not None:
+            text = entry[0]
+        else:
+            return
+
+        self._put(sid, [text, now + self._lifetime, context])
+
+    def delete(self, sid):
+        """
+        Forget a session, like when its user logs out.
+        :param sid: The session id.
+        """
+        with self._lock:
+            self._entries.pop(sid, None)
+
+        connection = self._pool.checkout()
+        try:
+            connection.execute(queries.SESSION_DELETE, [sid])
+            connection.commit()
+        finally:
+            self._pool.checkin(connection)
+
+    def getGeneration(self):
+        """
+        Gets the current context generation, for a session that is new rather than loaded.
+        :return: The generation.
+        """
+        with self._lock:
+            return self._generation
+
+    def invalidateContexts(self, userId=None, householdId=None):
+        """
+        Drop the contexts that describe a user or a household, after something about them changes.
+        :param userId: The user whose contexts to drop, or None.
+        :param householdId: The household whose contexts to drop, or None.
+        """
+        # Ids from URLs are strings, while the ones in sessions are integers.
+        userId = None if userId is None else str(userId)
+        householdId = None if householdId is None else str(householdId)
+
+        with self._lock:
+            self._generation += 1
+            for entry in self._entries.values():
+                context = entry[2]
+                if context is not None and (
+                        (userId is not None and str(context.userId) == userId) or
+                        (householdId is not None and str(context.householdId) == householdId)):
+                    entry[2] = None
+
+    def flush(self, now=None):
+        """
+        Spill every session in memory to the SQL database, like at shutdown. The sessions stay in memory as well.
+        :param now: The current time, from time.time. Defaults to now.
+        """
+        now = time.time() if now is None else now
+
+        with self._lock:
+            rows = [(sid, entry[0], entry[1]) for sid, entry in self._entries.items() if entry[1] > now]
+        self._spill(rows)
+
+    def prune(self, now=None):
+        """
+        Drop every expired session, from memory and from the SQL database.
+        :param now: The current time, from time.time. Defaults to now.
+        :return: The number of expired sessions dropped from the SQL database.
+        """
+        now = time.time() if now is None else now
+
+        with self._lock:
+            for sid in [sid for sid, entry in self._entries.items() if entry[1] <= now]:
+                del self._entries[sid]
+
+        connection = self._pool.checkout()
+        try:
+            pruned = connection.execute(queries.SESSION_PRUNE, [now]).rowcount
+            connection.commit()
+        finally:
+            self._pool.checkin(connection)
+        return pruned
+
+    def getStats(self):
+        """
+        Gets the session store's statistics.
+        :return: A dictionary with the sessions in memory, how many were spilled to the SQL database, and how many were
+                 read back from it.
+        """
+        with self._lock:
+            return {
+                'sessions': len(self._entries),
+                'spilled': self._spilled,
+                'restored': self._restored,
+            }
+
+    def _put(self, sid, entry):
+        """
+        Put a session in memory, spilling the least recently used ones if there are too many.
+        :param sid: The session id.
+        :param entry: The entry, as [data as JSON, expiry, context].
+        """
+        evicted = []
+        with self._lock:
+            self._entries[sid] = entry
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self._size:
+                evictedSid, evictedEntry = self._entries.popitem(last=False)
+                evicted.append((evictedSid, evictedEntry[0], evictedEntry[1]))
+
+        self._spill(evicted)
+
+    def _spill(self, rows):
+        """
+        Write sessions to the SQL database.
+        :param rows: A list of (session id, data as JSON, expiry) tuples.
+        """
+        if len(rows) == 0:
+            return
+
+        connection = self._pool.checkout()
+        try:
+            connection.executemany(queries.SESSION_SAVE, rows)
+            connection.commit()
+        finally:
+            self._pool.checkin(connection)
+
+        with self._lock:
+            self._spilled += len(rows)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """
+    A session kept in a SessionStore. Behaves like Flask's cookie session, and carries the session's cached context.
+    """
+
+    def __init__(self, initial=None, sid=None, new=False, context=None, generation=None):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.context = context
+        self.generation = generation
+
+        # The id this session had before regenerate, which is forgotten when the session is saved.
+        self.previousSid = None
+
+    def regenerate(self):
+        """
+        Move the session to a new id, so that an id handed out earlier (possibly to someone else) stops working.
+        """
+        if self.previousSid is None and not self.new:
+            self.previousSid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    """
+    Tells Flask to keep sessions in a SessionStore, with only a signed session id in the cookie.
+    """
+
+    def __init__(self, store):
+        """
+        Create the session interface.
+        :param store: The session store to keep sessions in.
+        """
+        self.store = store
+
+    def open_session(self, app, request):
+        signer = self._getSigner(app)
+        if signer is None:
+            return None
+
+        cookie = request.cookies.get(app.config['SESSION_COOKIE_NAME'])
+        if cookie:
+            try:
+                sid = signer.unsign(cookie).decode('ascii')
+            except BadSignature:
+                sid = None
+
+            loaded = self.store.load(sid) if sid else None
+            if loaded is not None:
+                data, context, generation = loaded
+                return ServerSession(data, sid, context=context, generation=generation)
+
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True, generation=self.store.getGeneration())
+
+    def save_session(self, app, session, response):
+        name = app.config['SESSION_COOKIE_NAME']
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if session.previousSid is not None:
+            self.store.delete(session.previousSid)
+
+        if not session:
+            # An empty session doesn't need storing. If it was emptied just now (like by logging out), forget it.
+            if not session.new and session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        self.store.save(session.sid, dict(session) if session.new or session.modified else None, session.context,
+                        session.generation)
+
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(name, self._getSigner(app).sign(session.sid).decode('ascii'),
+                                expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app),
+                                domain=domain,
+                                path=path,
+                                secure=self.get_cookie_secure(app),
+                                samesite=self.get_cookie_samesite(app))
+
+    def _getSigner(self, app):
+        """
+        Gets the signer for session ids.
+        :param app: The Flask application.
+        :return: The signer, or None if the application has no secret key.
+        """
+        if not app.secret_key:
+            return None
+        return Signer(app.secret_key, salt=SIGNER_SALT)
+
+
+def regenerate():
+    """
+    Give the current session a new id, like when its user logs in, so that a session id obtained before then can't be
+    used to ride along on the logged in session. Only server-side sessions have an id to change.
+    """
+    if has_request_context() and isinstance(session, ServerSession):
+        session.regenerate()
+
+
+def invalidateContexts(userId=None, householdId=None):
+    """
+    Drop the cached contexts that describe a user or a household, after something about them changes. Works whether or
+    not server-side sessions are in use.
+    :param userId: The user whose contexts to drop, or None.
+    :param householdId: The household whose contexts to drop, or None.
+    """
+    # Other sessions' cookies can't be reached from here, so note the change for when they are next used.
+    now = time.time()
+    if userId is not None:
+        contextChanges.put(('user', str(userId)), now)
+    if householdId is not None:
+        contextChanges.put(('household', str(householdId)), now)
+
+    if not has_app_context():
+        return
+
+    store = getattr(getattr(g, 's', None), 'sessionStore', None)
+    if store is not None:
+        store.invalidateContexts(userId, householdId)
+
+    dropContext()
+
+
+def dropContext():
+    """
+    Drop the current session's cached context, so that the next call to getContext builds it again.
+    """
+    if not has_app_context():
+        return
+
+    g.pop('sessionContext', None)
+    if has_request_context():
+        if isinstance(session, ServerSession):
+            store = getattr(getattr(g, 's', None), 'sessionStore', None)
+            session.context = None
+            session.generation = store.getGeneration() if store is not None else None
+        elif 'context' in session:
+            session.pop('context')
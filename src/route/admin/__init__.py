@@ -6,7 +6,7 @@ from . import admin
 def init_routes(flask_app: Flask):
     flask_app.add_url_rule("/admin/dashboard", "admin_dashboard", methods=["GET"], view_func=admin.dashboard)
 
-    flask_app.add_url_rule("/admin/view/log/<logname>/<after>",
+    flask_app.add_url_rule("/admin/view/log/<logname>",
                            "admin_logviewer",
                            methods=["GET"],
                            view_func=admin.view_log)
@@ -1,22 +1,34 @@
+import datetime
+
 from flask import flash, render_template, request, session, g, redirect, url_for
 
 from core import enums, logger
 from core.user import user
 from core.database import db, queries
 
+# Larger than any event id, for the first page of the log.
+SQLITE_MAX_ID = 2 ** 63 - 1
+
 
 def dashboard():
     """
-    The admin dashboard has links to other admin pages. Render the dashboard view.
+    The admin dashboard has links to other admin pages, and shows how busy the password hasher is. Render the dashboard
+    view.
     :return: The render template.
     """
     logger.logAdmin("Admin dashboard accessed.", session['id'], enums.e_log_event_level.warning)
-    return render_template('admin/dashboard.html')
+    return render_template('admin/dashboard.html', eventCounts=getEventCounts(24),
+                           levels=enums.e_log_event_level, logs=enums.e_log_event_type,
+                           hasherStats=g.s.hasher.getStats())
 
 
-def view_log(logname, after):
+def view_log(logname):
     """
     The admin log viewer shows administrative events. Render the logviewer.
+
+    Pages are found by event id rather than by offset: ?before=<id> shows the page of events older than that event, and
+    ?after=<id> shows the page newer than it. The log can be filtered by ?level=, ?blame= (user id), and ?since= and
+    ?until= (YYYY-MM-DD, or YYYY-MM-DD HH:MM:SS).
     :return: The render template.
     """
     logger.logAdmin('Logviewer (' + logname + ') accessed.', session['id'], enums.e_log_event_level.warning)
@@ -30,12 +42,34 @@ def view_log(logname, after):
 
     log = nameToLog(logname)
 
-    return render_template('admin/logviewer.html', events=getEvents(log, after, 50),
-                           getUserDisplayname=lambda n: user.getUserDisplayname(n),
+    filters = {}
+    for key in ['level', 'blame']:
+        value = request.args.get(key, '')
+        if value.isdigit():
+            filters[key] = int(value)
+        elif value != '':
+            flash('Ignored the ' + key + ' filter; it must be a number.', 'warning')
+    for key in ['since', 'until']:
+        value = request.args.get(key, '')
+        if isTimestamp(value):
+            filters[key] = value
+        elif value != '':
+            flash('Ignored the ' + key + ' filter; it must be a date.', 'warning')
+
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+    events, older, newer = getEvents(log, before, after, LOG_PAGE_SIZE, **filters)
+
+    # Resolve the name of everyone blamed on this page in one batch, rather than once per row as the page renders.
+    displaynames = user.getUserDisplaynames([e['blame'] for e in events or []])
+
+    return render_template('admin/logviewer.html', events=events,
+                           displaynames=displaynames,
                            logname=logname,
-                           after=int(after),
-                           next=int(after)+50,
-                           prev=max(int(after)-50, 0))
+                           levels=enums.e_log_event_level,
+                           filters=filters,
+                           older=older,
+                           newer=newer)
 
 def view_node(node, index):
     """
@@ -96,18 +130,81 @@ def settings():
 
 
 
-def getEvents(log, after, count):
+LOG_PAGE_SIZE = 50
+
+
+def getEvents(log, before=None, after=None, count=LOG_PAGE_SIZE, level=None, blame=None, since=None, until=None):
     """
-    Return the events after a certain index.
+    Return a page of events, newest first. With neither before nor after, this is the newest page.
     :param log: The log type to get events for.
-    :param after: Index to start events (descending)
+    :param before: Only get events older than this event id.
+    :param after: Only get events newer than this event id. Ignored if before is given.
     :param count: How many events to pull.
-    :return: An array of events.
+    :param level: Only get events of this level.
+    :param blame: Only get events caused by this user id.
+    :param since: Only get events at or after this timestamp.
+    :param until: Only get events before this timestamp.
+    :return: A tuple (events, older, newer), where events is an array of events, and older and newer are the cursors for
+             the neighbouring pages (None if there is no such page). Events is None if the log type is not allowed.
     """
     if not enums.contains(enums.e_log_event_type, log):
-        return None
+        return None, None, None
+
+    query = queries.LOG_GET
+    args = [log]
+    for value, clause in [(level, queries.LOG_GET_FILTER_LEVEL),
+                          (blame, queries.LOG_GET_FILTER_BLAME),
+                          (since, queries.LOG_GET_FILTER_SINCE),
+                          (until, queries.LOG_GET_FILTER_UNTIL)]:
+        if value is not None:
+            query += clause
+            args.append(value)
+
+    # One extra event is pulled to find out whether there is another page in the direction being paged.
+    if before is None and after is not None:
+        events = db.query_db(query + queries.LOG_GET_PAGE_NEWER, args + [after, count + 1])
+        more = len(events) > count
+        events = list(reversed(events[:count]))
+        newer = events[0]['id'] if more else None
+        older = events[-1]['id'] if events else after + 1
+    else:
+        events = db.query_db(query + queries.LOG_GET_PAGE_OLDER,
+                             args + [before if before is not None else SQLITE_MAX_ID, count + 1])
+        more = len(events) > count
+        events = events[:count]
+        older = events[-1]['id'] if more else None
+        newer = (events[0]['id'] if events else before - 1) if before is not None else None
 
-    return db.query_db(queries.LOG_GET, [log, after, count])
+    return events, older, newer
 
 
+def isTimestamp(value):
+    """
+    Checks that a value looks like an event log timestamp (or a prefix of one, like a date).
+    :param value: The value to check.
+    :return: True if the value is a valid date or date and time.
+    """
+    for timestampFormat in ['%Y-%m-%d', '%Y-%m-%d %H:%M:%S']:
+        try:
+            datetime.datetime.strptime(value, timestampFormat)
+            return True
+        except ValueError:
+            continue
+    return False
 
+
+def getEventCounts(hours):
+    """
+    Count the events raised recently, from the hourly rollups. Events from the last hour or so may not be counted yet.
+    :param hours: How many hours back to count.
+    :return: A dictionary of log type => level => count.
+    """
+    since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=hours)
+
+    counts = {log: {level: 0 for level in enums.e_log_event_level} for log in enums.e_log_event_type}
+    for row in db.query_db(queries.LOG_ROLLUP_GET, [since.strftime('%Y-%m-%d %H:00:00')]):
+        if enums.contains(enums.e_log_event_type, row['e_log_event_type']) \
+                and enums.contains(enums.e_log_event_level, row['e_log_event_level']):
+            counts[enums.e_log_event_type(row['e_log_event_type'])][enums.e_log_event_level(row['e_log_event_level'])] \
+                += row['count']
+    return counts
@@ -3,6 +3,53 @@
 # user session here.
 # ######################################################################################################################
 
+from flask import abort, after_this_request, flash, g, redirect, render_template, request, session, url_for
+
+from core import enums, logger
+from core.database import db, queries, unitofwork
+from core.user import user, passwords
+from core.web import sessions
+
+
+def runHasher(f, *args):
+    """
+    Run a password hasher operation in the context's hashing pool. If the pool is saturated, the request is answered
+    with 503 right away. How long hashing took is reported to the client in a Server-Timing header.
+    :param f: The hasher method to call. It must return how long it took as the last item of its result.
+    :return: The rest of the result.
+    """
+    try:
+        *result, elapsed = f(*args)
+    except passwords.HasherBusyException as e:
+        logger.logSystem('Password hashing refused: ' + str(e), enums.e_log_event_level.warning)
+        abort(503, 'The server is busy. Please try again in a moment.')
+
+    @after_this_request
+    def timing(response):
+        response.headers.add('Server-Timing', 'pbkdf2;dur=' + format(elapsed * 1000, '.1f'))
+        return response
+
+    return result[0] if len(result) == 1 else result
+
+
+def hashPassword(password):
+    """
+    Hash a new password for storage, with the current hash scheme and cost.
+    :param password: The password to hash.
+    :return: The stored form of the password hash.
+    """
+    return runHasher(g.s.hasher.makeHash, password)
+
+
+def verifyPassword(password, stored):
+    """
+    Check a password against a stored password hash.
+    :param password: The password to check.
+    :param stored: The stored password hash, or None if there is no such user.
+    :return: A tuple (matches, needsRehash), as in PasswordHasher.verify.
+    """
+    return runHasher(g.s.hasher.verify, password, stored, g.s.context.SALT)
+
 
 # noinspection PyUnresolvedReferences
 def login():
@@ -16,22 +63,34 @@ def login():
             flash('Please fill in all fields.', 'danger')
             return render_template('login.html')
 
-        hash = hashlib.pbkdf2_hmac('sha512',
-                                   bytearray(request.form['inputPassword'], 'utf-8'),
-                                   bytearray(context.get_env('SALT'), 'utf-8'),
-                                   100000)
-
-        res = db.query_db(queries.CHECK_LOGIN, [request.form['inputUsername'], hash], True)
-
-        if res['COUNT(*)'] > 0:
-            # User is now logged in - set session variables and direct to dashboard.
+        # Turn away excess attempts before spending anything on hashing the password.
+        if not g.s.loginThrottle.allow(request.form['inputUsername'], request.remote_addr):
+            flash('Too many login attempts. Please wait a minute and try again.', 'danger')
+            return render_template('login.html'), 429
+
+        res = db.query_db(queries.USER_GET_LOGIN, [request.form['inputUsername'], ], True)
+
+        # Unknown usernames are still hashed against, so that they take as long to turn away as a wrong password.
+        matches, needsRehash = verifyPassword(request.form['inputPassword'], res['password'] if res else None)
+
+        if matches:
+            if needsRehash:
+                # Upgrade the hash to the current scheme and cost while we have the password. This is optional, so if the
+                # hashing pool is busy, it waits for a later login rather than failing this one.
+                try:
+                    stored = g.s.hasher.makeHash(request.form['inputPassword'])[0]
+                    db.post_db(queries.USER_UPDATE_PASSWORD, [stored, res['id']])
+                except passwords.HasherBusyException as e:
+                    logger.logSystem('Password hash upgrade skipped: ' + str(e), enums.e_log_event_level.info)
+
+            # User is now logged in - set session variables and direct to dashboard. The session gets a new id first, so
+            # that one handed out before logging in (like with a failed attempt's flash message) can't be fixed on them.
+            sessions.regenerate()
             session['logged_in'] = True
 
             session['username'] = request.form['inputUsername']
             session['id'] = res['id']
 
-            session['email'] = res['email']
-
             session['admin'] = user.isCuteCasaAdmin(session['id'])
             logger.logAdmin("User logged in.", session['id'])
 
@@ -75,10 +134,7 @@ def register():
             flash("Each item must each be at least 3 characters long.", 'danger')
             return render_template('register.html')
 
-        pwHash = hashlib.pbkdf2_hmac('sha512',
-                                   bytearray(request.form['inputPassword'], 'utf-8'),
-                                   bytearray(context.get_env('SALT'), 'utf-8'),
-                                   100000)
+        pwHash = hashPassword(request.form['inputPassword'])
 
         res = db.query_db(queries.CHECK_USERNAME, [request.form['inputUsername'], ], True)
 
@@ -89,11 +145,18 @@ def register():
         # Unique email is not a requirement.
 
         # Registration checks out, create ZDB object and DB entry.
-        db.post_db(queries.REGISTER, [request.form['inputUsername'],
-                                      pwHash,
-                                      request.form['registerEmail']])
-
-        g.dog.zdb.createUser(str(db.getLastRowId()), str(request.form['inputUsername']))
+        userId = db.post_db(queries.REGISTER, [request.form['inputUsername'],
+                                               pwHash,
+                                               request.form['registerEmail']])[0]
+
+        # Write the user object right away rather than with the rest of the request, so that if it can't be written,
+        # the SQL user is removed again instead of being left without one.
+        try:
+            with unitofwork.immediate():
+                g.dog.zdb.createUser(str(userId), str(request.form['inputUsername']))
+        except Exception:
+            db.post_db(queries.USER_DELETE, [userId])
+            raise
 
         flash("Successfully registered!", 'info')
 
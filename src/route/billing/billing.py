@@ -1,7 +1,8 @@
-from flask import flash, render_template, session, abort, redirect, url_for
+from flask import flash, render_template, session, abort, redirect, url_for, g
 
 from core import enums
 from core.household import household
+from core.user import user
 
 
 def billsplit():
@@ -11,7 +12,16 @@ def billsplit():
     Render the billsplit view.
     :return: The render template.
     """
-    return render_template('billing/billsplit.html')
+    # Work out each bill group's transfers up front, so that everyone's display name can be looked up in one go.
+    settlements = {}
+    if g.dog.hh is not None:
+        for idx, billgroup in g.dog.hh.getSharedBills():
+            settlements[idx] = billgroup.calculateSettlement()
+
+    displaynames = user.getUserDisplaynames(
+        userId for transfers in settlements.values() for payer, payee, __ in transfers for userId in (payer, payee))
+
+    return render_template('billing/billsplit.html', settlements=settlements, displaynames=displaynames)
 
 def utilities():
     """
@@ -35,7 +45,7 @@ def admin():
     if not session.get('householdId'):
         abort(400, "householdId missing")
 
-    if not household.getHouseholdRelation(session['householdId'], session['id']) == enums.e_household_relation.admin:
+    if not household.getContext().householdRelation == enums.e_household_relation.admin:
         abort(403, 'not authorized as an admin for this household')
 
     return render_template('billing/admin.html')
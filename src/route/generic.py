@@ -4,6 +4,7 @@
 
 from flask import session, redirect, url_for, render_template
 
+from core.billing import settlement
 from core.household import household
 
 
@@ -27,6 +28,23 @@ def dashboard():
     return render_template('dashboard.html', members=household.getUsersForCurrentHousehold())
 
 
+def inject_context():
+    """
+    Makes the session context (see core.household.household.getContext) available to every template as context.
+    :return: The template variables.
+    """
+    return dict(context=household.getContext())
+
+
+def format_cents(cents):
+    """
+    Template filter that formats an amount in cents as dollars (see core.billing.settlement.formatCents).
+    :param cents: The amount in cents.
+    :return: The formatted amount.
+    """
+    return settlement.formatCents(cents)
+
+
 def generic_path_render(file):
     """
     A generic renderer for a static page.
@@ -3,6 +3,7 @@ from flask import flash, render_template, request, session, abort, redirect, url
 from core import enums, logger
 from core.database import db, queries
 from core.household import household
+from core.web import sessions
 
 
 def profile():
@@ -51,11 +52,11 @@ def profile():
                 return render_template('household/profile.html')
 
             # Create the household!
-            db.post_db(queries.HOUSEHOLD_CREATE, [houseName, houseType])
-            houseId = db.getLastRowId()
+            houseId = db.post_db(queries.HOUSEHOLD_CREATE, [houseName, houseType])[0]
+            household.invalidateSearchCache()
 
             # Associate this user with the household, as an admin.
-            db.post_db(queries.HOUSEHOLD_MEMBERSHIP_ADD, [session['id'], houseId, enums.e_household_relation.admin])
+            household.addMembership(houseId, session['id'], enums.e_household_relation.admin)
 
 
             logger.logAdmin('Created household. Id: ' + str(houseId) + ' Name: ' + houseName, session['id'])
@@ -69,7 +70,7 @@ def profile():
         # TODO: Check if we are an admin of this household and are allowed to make changes to it.
 
         # Updating an existing household - household name.
-        if houseName != session['householdName']:
+        if houseName != household.getContext().householdName:
             if len(houseName) == 0:
                 flash("Household name must not be blank.", 'danger')
                 return render_template('household/profile.html')
@@ -78,19 +79,21 @@ def profile():
                 return render_template('household/profile.html')
 
             db.post_db(queries.HOUSEHOLD_UPDATE_HOUSEHOLDNAME, [houseName, session['householdId']])
+            household.invalidateSearchCache()
+            sessions.invalidateContexts(householdId=session['householdId'])
 
-            session['householdName'] = houseName
             flash("Household name updated.", 'info')
 
         # Household type.
-        if int(houseType) != session['householdType']:
+        if int(houseType) != household.getContext().householdType:
             if not enums.contains(enums.e_household_type, houseType):
                 flash(str(houseType) + ' is not a valid house type.', 'danger')
                 return render_template('household/profile.html')
 
             db.post_db(queries.HOUSEHOLD_UPDATE_HOUSEHOLDTYPE, [houseType, session['householdId']])
+            household.invalidateSearchCache()
+            sessions.invalidateContexts(householdId=session['householdId'])
 
-            session['householdType'] = int(houseType)
             flash("Household type updated.", 'info')
 
         return redirect(url_for('dashboard'))
@@ -141,7 +144,11 @@ def search(partial):
     :param partial:  The string to search for.
     :return: The households JSON.
     """
-    return jsonify(result=db.query_db(queries.HOUSEHOLD_SEARCH, ['%' + partial + '%', ]))
+    response = jsonify(result=household.searchHouseholds(partial))
+
+    # Let the browser answer repeats of the same search (like backspacing over a letter) itself for a little while.
+    response.headers['Cache-Control'] = 'private, max-age=' + str(household.SEARCH_CACHE_TTL)
+    return response
 
 def request_join(householdId):
     """
@@ -158,7 +165,7 @@ def request_join(householdId):
 
 
     flash('Requested to join household!', 'info')
-    db.post_db(queries.HOUSEHOLD_MEMBERSHIP_ADD, [session['id'], householdId, enums.e_household_relation.request])
+    household.addMembership(householdId, session['id'], enums.e_household_relation.request)
 
     return redirect(url_for('household_select'))
 
@@ -173,7 +180,7 @@ def request_approve(householdId, userId):
     #TODO: Check that the logged in user is an admin of this household and that the target user actually requested this,
     #TODO: That is, the target user must be in the memberships db with the correct relation (3)
 
-    db.post_db(queries.HOUSEHOLD_MEMBERSHIP_UPDATE, [enums.e_household_relation.member, householdId, userId])
+    household.updateMembership(householdId, userId, enums.e_household_relation.member)
 
     flash('Approved user to join household.', 'info')
     return redirect(url_for('household_profile'))
@@ -188,7 +195,7 @@ def request_deny(householdId, userId):
     #TODO: Check that the logged in user is an admin of this household
     #TODO: Check that we're not removing ourselves
 
-    db.post_db(queries.HOUSEHOLD_MEMBERSHIP_REMOVE, [householdId, userId])
+    household.removeMembership(householdId, userId)
 
     flash('Removed user from household.', 'info')
     return redirect(url_for('household_profile'))
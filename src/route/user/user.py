@@ -1,6 +1,8 @@
 from flask import flash, render_template, request, session, g, redirect, url_for, abort
 
 from core.database import db, queries
+from core.household import household
+from core.web import sessions
 
 
 
@@ -36,12 +38,12 @@ def profile():
 
         # Email.
         if request.form['emailInput'] is not None:
-            if request.form['emailInput'] != session['email']:
+            if request.form['emailInput'] != household.getContext().email:
 
                 # TODO: Sanity check on length
 
                 db.post_db(queries.USER_UPDATE_EMAIL, [request.form['emailInput'], session['id']])
-                session['email'] = request.form['emailInput']
+                sessions.invalidateContexts(userId=session['id'])
                 flash("Email updated.", 'info')
 
         # Cellphone
@@ -6,15 +6,18 @@
 import os
 import random
 import math
+import signal
 import sqlite3
+import sys
 
 from multiprocessing import Process
 from threading import Thread
 from typing import Type, List, Union
 
-from flask import Flask, g
+from flask import Flask, abort, g, got_request_exception
 
-from core.database.zdb import Zdb
+from core.database import unitofwork, sqlpool, logwriter, logretention
+from core.database.zdb import Zdb, DEFAULT_POOL_SIZE, DEFAULT_CACHE_SIZE
 from shell.repl import Repl
 from shell.manifest import Manifest
 
@@ -37,6 +40,8 @@ ENV_SENSITIVE_VARIABLES = [
 # These variables should be interpreted as booleans if they are set as an environment variable.
 ENV_BOOLEANS = [
     "DEBUG",
+    "LOGIN_THROTTLE_PERSIST",
+    "SERVER_SESSIONS",
 ]
 
 # The environment variables that we expect to see set by the run script (at least at this point in the setup; we
@@ -210,6 +215,19 @@ class Shell:
             return None
         return self._env[key]
 
+    def env_get_default(self, key: str, default: str) -> str:
+        """
+        Gets an optional application environment variable, falling back to a default if it is not set.
+        :param key: The name of the application environment variable to return.
+        :param default: The value to return if the variable is not set.
+        :return: The value of the environment variable, or the default if no such variable is set.
+        """
+        if key not in self._env:
+            return default
+
+        self._env_expected.add(key)
+        return self._env[key]
+
     def env_expect(self, keys: Union[str, List[str]]) -> bool:
         """
         Checks if a list of keys or a single key exists in the environment.
@@ -340,6 +358,32 @@ class ShellContext:
         self._db_sql = db_sql
         self._db_object = db_object
 
+        # SQL connection pool tuning. These are optional and fall back to the pool defaults.
+        self._db_sql_pool = sqlpool.SqlPool(self._db_sql,
+                                            int(self.shell.env_get_default("SQL_DATABASE_POOL_SIZE",
+                                                                           sqlpool.DEFAULT_POOL_SIZE)),
+                                            self.init_sql_pragmas())
+
+        # Event log writer tuning. These are optional and fall back to the writer defaults.
+        self._log_writer = logwriter.LogWriter(
+            self._db_sql_pool,
+            int(self.shell.env_get_default("LOG_QUEUE_SIZE", logwriter.DEFAULT_QUEUE_SIZE)),
+            int(self.shell.env_get_default("LOG_BATCH_SIZE", logwriter.DEFAULT_BATCH_SIZE)),
+            float(self.shell.env_get_default("LOG_FLUSH_INTERVAL", logwriter.DEFAULT_FLUSH_INTERVAL)))
+
+        # Event log retention. Archives go next to the SQL database unless configured otherwise.
+        self._log_retention = logretention.LogRetention(
+            self._db_sql_pool,
+            self.shell.env_get_default("LOG_ARCHIVE_DIRECTORY",
+                                       os.path.join(os.path.dirname(os.path.abspath(self._db_sql)), "log-archive")),
+            int(self.shell.env_get_default("LOG_RETENTION_DAYS", logretention.DEFAULT_RETENTION_DAYS)),
+            int(self.shell.env_get_default("LOG_RETENTION_BATCH_SIZE", logretention.DEFAULT_BATCH_SIZE)),
+            float(self.shell.env_get_default("LOG_RETENTION_INTERVAL", logretention.DEFAULT_INTERVAL)))
+
+        # Object database connection pool tuning. These are optional and fall back to the Zdb defaults.
+        self._db_object_pool_size = int(self.shell.env_get_default("OBJECT_DATABASE_POOL_SIZE", DEFAULT_POOL_SIZE))
+        self._db_object_cache_size = int(self.shell.env_get_default("OBJECT_DATABASE_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+
         # Set Flask variables on this object for configuration, set up a reference to the Flask application, set
         # instance variables for Flask, and create the Flask object based on the configuration variables we set on this
         # object.
@@ -354,6 +398,8 @@ class ShellContext:
         self._flask_app.config.from_object(self)
         self._flask_app.before_first_request(self.request_before_first)
         self._flask_app.before_request(self.request_before)
+        self._flask_app.after_request(self.request_after)
+        got_request_exception.connect(self.request_exception, self._flask_app)
         self._flask_app.teardown_request(self.request_teardown)
 
         # Set up singleton fields.
@@ -377,6 +423,20 @@ class ShellContext:
             "DEFAULT_OBJECT_DATABASE",
         ])
 
+    def init_sql_pragmas(self) -> dict:
+        """
+        Reads any SQL connection pragma overrides from the environment. Unset pragmas keep the pool defaults.
+        :return: A dictionary of pragma name => value.
+        """
+        pragmas = {}
+        for key, pragma in [("SQL_DATABASE_SYNCHRONOUS", "synchronous"),
+                            ("SQL_DATABASE_CACHE_SIZE", "cache_size"),
+                            ("SQL_DATABASE_MMAP_SIZE", "mmap_size")]:
+            value = self.shell.env_get_default(key, None)
+            if value is not None:
+                pragmas[pragma] = value
+        return pragmas
+
     def init_routes(self, flask_app: Flask) -> None:
         """
         Initializes the default routes for the application with the specified Flask application object. The specific
@@ -421,15 +481,36 @@ class ShellContext:
         Flask application.
         """
         self.running = True
-        self._process = Process(target=self._start_impl)
+        self._process = Process(target=self._process_main)
         self._process.start()
 
+    def _process_main(self) -> None:
+        """
+        The entry point of the process hosting this context. Runs _start_impl, and makes sure the process shuts down
+        cleanly when it is terminated.
+        """
+        # Turn termination into a normal exit, so that the shutdown below still runs.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            self._start_impl()
+        finally:
+            self._shutdown()
+
     def _start_impl(self) -> None:
         """
         The target for the context's start method. Should be implemented by the application context object.
         """
         pass
 
+    def _shutdown(self) -> None:
+        """
+        Shutdown requirements of the process hosting this context. Stops log retention, writes out any queued events, and
+        closes the idle SQL connections.
+        """
+        self._log_retention.stop()
+        self._log_writer.stop()
+        self._db_sql_pool.close()
+
     def stop(self) -> None:
         """
         Trigger any shutdown requirements and terminate the process hosting this context.
@@ -453,6 +534,7 @@ class ShellContext:
         # The context object (this one) should have methods to get the following singletons. We'll expose them on g.s
         # for ease of access.
         g.s.zdb = self.singleton_get_zdb()
+        g.s.logWriter = self.singleton_get_log_writer()
 
     def singleton_get_zdb(self) -> Zdb:
         """
@@ -468,6 +550,13 @@ class ShellContext:
         """
         self._zdb = zdb
 
+    def singleton_get_log_writer(self) -> logwriter.LogWriter:
+        """
+        Gets the event log writer associated with the context.
+        :return: The event log writer associated with the context.
+        """
+        return self._log_writer
+
     # endregion
 
     # region Global Flask handlers
@@ -480,8 +569,14 @@ class ShellContext:
         At this point, the database connection is not yet open, so we don't want to attempt any accesses to the DB.
         """
 
+        # Start writing (and pruning) the event log in the background, and expose the singletons early so that anything
+        # logged while bringing up the object database can find the SQL connection pool and the log writer.
+        self._log_writer.start()
+        self._log_retention.start()
+        self.singleton_request_init()
+
         # Initialize the object database.
-        self.singleton_set_zdb(Zdb(self._db_object))
+        self.singleton_set_zdb(Zdb(self._db_object, self._db_object_pool_size, self._db_object_cache_size))
 
     def request_before(self) -> sqlite3.Connection:
         """
@@ -490,17 +585,59 @@ class ShellContext:
         self._requests_issued += 1
         self._requests_in_flight += 1
 
-        g.db = self.db_sql_connect()
+        # The SQL connection is checked out lazily by db.getDb, so requests that never touch it (like static files)
+        # don't need one.
+
+        # Check out an object database connection for this request's thread, and defer object commits until the
+        # request is finished so that the whole request is written in one transaction.
+        self.singleton_get_zdb().open()
+        unitofwork.begin()
         self.singleton_request_init()
 
+    def request_exception(self, sender, exception: BaseException, **extra) -> None:
+        """
+        Note that the request raised. Flask still runs the after request handlers on the error response it builds, and
+        they must not commit what the request changed before it raised.
+        :param sender: The Flask application.
+        :param exception: The exception the request raised.
+        """
+        g.requestFailed = True
+
+    def request_after(self, response):
+        """
+        Commit the request's object changes in one go, before the response is sent. If the commit fails, the request is
+        answered with 500 instead, so that the client isn't told about changes that were never written. Requests that
+        raised or are answered with a server error have their changes thrown away instead.
+        :param response: The response to the request.
+        :return: The response.
+        """
+        if not unitofwork.isActive():
+            return response
+
+        if getattr(g, 'requestFailed', False) or response.status_code >= 500:
+            unitofwork.end(False)
+        elif not unitofwork.end():
+            abort(500, 'Your changes could not be saved. Please try again.')
+        return response
+
     def request_teardown(self, exception: BaseException) -> None:
         """
         Take care of any teardown after a request.
         :param exception: Any exception that occurred during the processing of this request.
         """
+        # The changes were committed in request_after, unless the request raised before getting there. Throw away
+        # whatever is left, while the SQL connection is still around for any logging.
+        unitofwork.end(False)
+
         db = getattr(g, 'db', None)
         if db is not None:
-            db.close()
+            self.db_sql_release(db)
+            g.db = None
+
+        # Return this thread's object database connection to the pool.
+        zdb = self.singleton_get_zdb()
+        if zdb is not None:
+            zdb.close()
 
         self._requests_in_flight -= 1
         if exception:
@@ -514,10 +651,17 @@ class ShellContext:
 
     def db_sql_connect(self) -> sqlite3.Connection:
         """
-        Connect to the SQL database in order to insert the schema.
+        Check out a connection to the SQL database from the pool. It should be returned with db_sql_release.
         :return: The connection object.
         """
-        return sqlite3.connect(self._db_sql)
+        return self._db_sql_pool.checkout()
+
+    def db_sql_release(self, connection: sqlite3.Connection) -> None:
+        """
+        Return a connection to the SQL database pool.
+        :param connection: The connection to return.
+        """
+        self._db_sql_pool.checkin(connection)
 
     # endregion
 
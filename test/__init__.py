@@ -1 +1,6 @@
+import os
+
 __author__ = 'akersten'
+
+# The tests keep their databases here. It isn't checked in, so make sure it exists on a fresh checkout.
+os.makedirs(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'secret'), exist_ok=True)
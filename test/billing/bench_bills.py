@@ -0,0 +1,157 @@
+# ######################################################################################################################
+# Billing benchmarks
+#
+# Generates a synthetic household bill group in a throwaway object database and times the core.billing.bills operations
+# that run on every billsplit page view or bill change. Results are printed (or written) as JSON so that runs can be
+# compared to catch regressions. Run from the project root, the same way as the tests:
+#
+#     python3 -m test.billing.bench_bills --payors 12 --bills 2000 --adjustments 2
+#
+# ######################################################################################################################
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import transaction
+
+from core.billing.bills import Bill, BillGroup
+from core.database.zdb import Zdb
+
+
+def summarize(samples):
+    """
+    Summarize timing samples.
+    :param samples: A list of durations in seconds.
+    :return: A dictionary of statistics, in milliseconds.
+    """
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'total_ms': sum(ordered) * 1000,
+        'mean_ms': statistics.mean(ordered) * 1000,
+        'median_ms': statistics.median(ordered) * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def timed(samples, f, *args):
+    """
+    Call a function and record how long it took.
+    :param samples: The list to append the duration to.
+    :param f: The function to call.
+    :return: Whatever the function returned.
+    """
+    start = time.perf_counter()
+    result = f(*args)
+    samples.append(time.perf_counter() - start)
+    return result
+
+
+def run(payors, bills, adjustments, cycles, repeat, seed):
+    """
+    Generate a synthetic household and time the billing operations against it.
+    :param payors: The number of payors in the bill group.
+    :param bills: The number of bills added in each cycle.
+    :param adjustments: The number of adjustments on each bill.
+    :param cycles: The number of cycles to fill and end.
+    :param repeat: How many times to repeat each read operation per cycle.
+    :param seed: The random seed, so that runs are reproducible.
+    :return: A dictionary of results.
+    """
+    rng = random.Random(seed)
+    directory = tempfile.mkdtemp(prefix='cutecasa-bench-')
+    z = Zdb(os.path.join(directory, 'bench.zdb'))
+
+    samples = {
+        'addBill': [],
+        'getContributionTotal': [],
+        'calculateLiabilityFor': [],
+        'calculateAllLiabilities': [],
+        'calculateSettlement': [],
+        'endCycle': [],
+        'commit': [],
+    }
+
+    try:
+        group = BillGroup()
+        z.root.bench = group
+        transaction.commit()
+
+        for payor in range(payors):
+            group.addOrUpdatePayor(payor, rng.randint(1, 10))
+
+        for cycle in range(cycles):
+            for __ in range(bills):
+                bill = Bill()
+                bill.charge = rng.randint(100, 50000)
+                for __ in range(adjustments):
+                    bill.addAdjustment(-rng.randint(0, 50), 'Synthetic adjustment')
+                timed(samples['addBill'], group.addBill, bill, rng.randrange(payors))
+
+            for __ in range(repeat):
+                timed(samples['getContributionTotal'], group.getContributionTotal)
+                timed(samples['calculateLiabilityFor'],
+                      lambda: [group.calculateLiabilityFor(p) for p in group.getPayors()])
+                timed(samples['calculateAllLiabilities'], group.calculateAllLiabilities)
+                timed(samples['calculateSettlement'], group.calculateSettlement)
+
+                # Commit latency for a single small change to an existing object. Set the field directly, since the
+                # setter would commit by itself.
+                group._name = 'Cycle ' + str(cycle) + '.' + str(rng.random())
+                timed(samples['commit'], transaction.commit)
+
+            timed(samples['endCycle'], group.endCycle)
+    finally:
+        z.teardown()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        'parameters': {
+            'payors': payors,
+            'bills': bills,
+            'adjustments': adjustments,
+            'cycles': cycles,
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'python': platform.python_version(),
+        'timestamp': time.time(),
+        'results': {name: summarize(s) for name, s in samples.items() if len(s) > 0},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark core.billing.bills against a synthetic household.')
+    parser.add_argument('--payors', type=int, default=8, help='Payors in the bill group.')
+    parser.add_argument('--bills', type=int, default=500, help='Bills added in each cycle.')
+    parser.add_argument('--adjustments', type=int, default=1, help='Adjustments on each bill.')
+    parser.add_argument('--cycles', type=int, default=3, help='Cycles to fill and end.')
+    parser.add_argument('--repeat', type=int, default=20, help='Repetitions of each read operation per cycle.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    parser.add_argument('--output', default=None, help='Write the JSON results to this file instead of stdout.')
+    args = parser.parse_args(argv)
+
+    if args.payors <= 0 or args.bills < 0 or args.adjustments < 0 or args.cycles <= 0 or args.repeat <= 0:
+        parser.error('Counts must be positive.')
+
+    results = run(args.payors, args.bills, args.adjustments, args.cycles, args.repeat, args.seed)
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
 import datetime
 import unittest
 
+import transaction
+
 from core.billing.bills import Bill, BillGroup
 from core.database.zdb import Zdb
 
@@ -487,6 +489,75 @@ class Tests_BillGroup(unittest.TestCase):
                         'Liability sum did not persist.')
 
 
+    def test_calculateAllLiabilities(self):
+        """
+        Calculating everyone's liability at once should agree with calculating it per payor.
+        """
+        g = BillGroup()
+        self.z.root.g = g
+
+        self.assertTrue(g.calculateAllLiabilities() == {}, 'No payors should mean no liabilities.')
+
+        g.addOrUpdatePayor(1, 50)
+        g.addOrUpdatePayor(2, 150)
+        g.addOrUpdatePayor(3, 25)
+
+        b1 = Bill()
+        b1.charge = 500
+        g.addBill(b1, 1)
+
+        b2 = Bill()
+        b2.charge = 0
+        b2.addAdjustment(750, 'Adjustment')
+        g.addBill(b2, 2)
+
+        liabilities = g.calculateAllLiabilities()
+
+        self.assertTrue(len(liabilities) == 3, 'Every payor should have a liability.')
+        for payor in g.getPayors():
+            responsibility, contribution, liability = liabilities[payor]
+            self.assertTrue(contribution == g.getContributionFor(payor), 'Contribution is wrong.')
+            self.assertTrue(liability == g.calculateLiabilityFor(payor), 'Liability is wrong.')
+            self.assertTrue(responsibility - contribution == liability, 'Responsibility is wrong.')
+
+        self.assertTrue(liabilities[3][1] == 0, 'A payor without bills should not have contributed.')
+        self.assertTrue(abs(sum(l for __, __, l in liabilities.values())) < 1e-9, 'Liability sum did not zero out.')
+
+        g.endCycle()
+        for payor, (responsibility, contribution, liability) in g.calculateAllLiabilities().items():
+            self.assertTrue(liability == 0, 'Liability is wrong after ending cycle.')
+
+        self.cycleDb()
+
+        self.assertTrue(self.z.root.g.calculateAllLiabilities()[1][2] == self.z.root.g.calculateLiabilityFor(1),
+                        'Liability did not persist.')
+
+
+    def test_calculateSettlement(self):
+        """
+        The settlement for a bill group should pay off everyone's liability.
+        """
+        g = BillGroup()
+        self.z.root.g = g
+
+        self.assertTrue(g.calculateSettlement() == [], 'An empty bill group needs no transfers.')
+
+        g.addOrUpdatePayor(1, 1)
+        g.addOrUpdatePayor(2, 1)
+        g.addOrUpdatePayor(3, 2)
+
+        b1 = Bill()
+        b1.charge = 400
+        g.addBill(b1, 1)
+
+        # Responsibilities are 100, 100 and 200; payor 1 is owed 300.
+        transfers = g.calculateSettlement()
+        self.assertTrue(sorted(transfers) == [(2, 1, 100), (3, 1, 200)], 'Settlement is wrong.')
+
+        g.endCycle()
+        self.assertTrue(g.calculateSettlement() == [], 'An ended cycle needs no transfers.')
+
+
     def test_getContributionFor(self):
         """
         Contributions for everyone should add up to the total contribution.
@@ -655,6 +726,286 @@ class Tests_BillGroup(unittest.TestCase):
         self.assertTrue(self.z.root.g.calculateLiabilityFor(4) == 10, 'Liability did not persist after new cycle.')
 
 
+    def test_cycles(self):
+        """
+        Ending a cycle should archive its bills and a summary of them, and start a new, empty cycle. Bills in closed
+        cycles can no longer be changed.
+        """
+        g = BillGroup()
+        self.z.root.g = g
+
+        self.assertTrue(g.getCurrentCycle() == 0, 'A new bill group should start on the first cycle.')
+        self.assertTrue(g.getCycles() == [0], 'A new bill group should have one cycle.')
+        self.assertTrue(g.getCycleSummary(0) is None, 'An open cycle should not have a summary.')
+
+        g.addOrUpdatePayor(1, 1)
+        g.addOrUpdatePayor(2, 3)
+
+        b1 = Bill()
+        b1.charge = 40
+        g.addBill(b1, 1)
+
+        b2 = Bill()
+        b2.charge = 60
+        g.addBill(b2, 2)
+
+        g.endCycle()
+
+        self.assertTrue(g.getCurrentCycle() == 1, 'Ending a cycle should start a new one.')
+        self.assertTrue(g.getCycles() == [0, 1], 'Closed cycles should be kept.')
+        self.assertTrue(len(g.getBills()) == 0, 'The new cycle should have no bills.')
+        self.assertTrue(list(g.getBills(0)) == [b1, b2], 'Closed cycle bills should be kept.')
+        self.assertTrue(len(g.getBills(5)) == 0, 'A cycle that does not exist should have no bills.')
+
+        summary = g.getCycleSummary(0)
+        self.assertTrue(summary.billCount == 2, 'Summary bill count is wrong.')
+        self.assertTrue(summary.contributionTotal == 100, 'Summary total is wrong.')
+        self.assertTrue(summary.contributions[1] == 40, 'Summary contribution is wrong.')
+        self.assertTrue(summary.contributions[2] == 60, 'Summary contribution is wrong.')
+        self.assertTrue(summary.weights == {1: 1, 2: 3}, 'Summary weights are wrong.')
+        self.assertTrue(summary.liabilities == {1: -15, 2: 15}, 'Summary liabilities are wrong.')
+        self.assertTrue(summary.transfers == [(2, 1, 15)], 'Summary settlement is wrong.')
+
+        with self.assertRaises(ValueError):
+            b1.charge = 10
+        with self.assertRaises(ValueError):
+            b1.addAdjustment(5, 'Late fee')
+        with self.assertRaises(ValueError):
+            b1.active = True
+        with self.assertRaises(ValueError):
+            b1.owner = 2
+        with self.assertRaises(ValueError):
+            g.addBill(b1, 1)
+        self.assertTrue(g.getContributionTotal() == 0, 'Closed cycle bills should not count.')
+
+        b3 = Bill()
+        b3.charge = 20
+        g.addBill(b3, 1)
+        self.assertTrue(list(g.getBills()) == [b3], 'New bills should go into the current cycle.')
+        self.assertTrue(len(list(g.getAllBills())) == 3, 'All bills should include closed cycles.')
+
+        with self.assertRaises(ValueError):
+            g.removePayor(2)    # Payor 2 has bills in a closed cycle.
+
+        self.cycleDb()
+
+        self.assertTrue(self.z.root.g.getCurrentCycle() == 1, 'Current cycle did not persist.')
+        self.assertTrue(self.z.root.g.getCycleSummary(0).contributionTotal == 100, 'Summary did not persist.')
+        self.assertTrue(len(self.z.root.g.getBills(0)) == 2, 'Closed cycle did not persist.')
+        self.assertTrue(self.z.root.g.getContributionTotal() == 20, 'Current cycle did not persist.')
+
+    def test_endCycle_singleCommit(self):
+        """
+        Ending a cycle should be a single transaction, however many bills are in it.
+        """
+        g = BillGroup()
+        self.z.root.g = g
+
+        g.addOrUpdatePayor(1, 1)
+        for i in range(10):
+            b = Bill()
+            b.charge = 10
+            g.addBill(b, 1)
+
+        storage = self.z.zdb.storage
+        before = len(list(storage.iterator()))
+        g.endCycle()
+        self.assertTrue(len(list(storage.iterator())) == before + 1, 'Ending a cycle should commit exactly once.')
+
+        self.cycleDb()
+
+        g = self.z.root.g
+        self.assertTrue(all(not b.active for b in g.getBills(0)), 'Deactivated bills did not persist.')
+        self.assertTrue(g.getCycleSummary(0).contributionTotal == 100, 'Snapshot did not persist.')
+
+    def test_cycles_legacy(self):
+        """
+        A bill group persisted with a flat list of bills should be split into a closed cycle and a current cycle.
+        """
+        g = BillGroup()
+        self.z.root.g = g
+
+        g.addOrUpdatePayor(1, 1)
+
+        old = Bill()
+        old.charge = 30
+        old.owner = 1
+        old.active = False
+
+        new = Bill()
+        new.charge = 70
+        new.owner = 1
+
+        del g._cycles
+        del g._archives
+        del g._cycle
+        g._bills = [old, new]
+        g._contributions = None
+        transaction.commit()
+        self.cycleDb()
+
+        g = self.z.root.g
+        self.assertTrue(g.getCycles() == [0, 1], 'Legacy bills should be split into two cycles.')
+        self.assertTrue(g.getCurrentCycle() == 1, 'Legacy active bills should be in the current cycle.')
+        self.assertTrue(g.getCycleSummary(0).contributionTotal == 30, 'Legacy closed bills should be summarized.')
+        self.assertTrue(g.getContributionFor(1) == 70, 'Legacy active bills should count.')
+        self.assertFalse(hasattr(g, '_bills'), 'The legacy bill list should be removed.')
+
+    def test_ownerIndex(self):
+        """
+        The owner index should follow bills being added, removed and reassigned, across cycles.
+        """
+        g = BillGroup()
+        self.z.root.g = g
+
+        g.addOrUpdatePayor(1, 1)
+        g.addOrUpdatePayor(2, 1)
+
+        self.assertTrue(g.getBillCountFor(1) == 0, 'A new payor should own no bills.')
+
+        b1 = Bill()
+        b1.charge = 10
+        g.addBill(b1, 1)
+
+        b2 = Bill()
+        b2.charge = 20
+        g.addBill(b2, 1)
+
+        self.assertTrue(g.getBillCountFor(1) == 2, 'Owner index is wrong after adding bills.')
+
+        b2.owner = 2
+        self.assertTrue(g.getBillCountFor(1) == 1, 'Owner index is wrong after reassigning a bill.')
+        self.assertTrue(g.getBillCountFor(2) == 1, 'Owner index is wrong after reassigning a bill.')
+
+        g.endCycle()
+        self.assertTrue(g.getBillCountFor(1) == 1, 'Closed cycle bills should stay in the owner index.')
+
+        b3 = Bill()
+        b3.charge = 30
+        g.addBill(b3, 2)
+        self.assertTrue(g.getBillCountFor(2) == 2, 'Owner index is wrong after adding bills to a new cycle.')
+
+        self.cycleDb()
+
+        self.assertTrue(self.z.root.g.getBillCountFor(2) == 2, 'Owner index did not persist.')
+
+    def test_removeBill(self):
+        """
+        Removing a bill should take it out of the current cycle, the running totals and the owner index. Bills in closed
+        cycles or other bill groups cannot be removed.
+        """
+        g = BillGroup()
+        self.z.root.g = g
+
+        g.addOrUpdatePayor(1, 1)
+        g.addOrUpdatePayor(2, 1)
+
+        with self.assertRaises(ValueError):
+            g.removeBill(None)
+        with self.assertRaises(ValueError):
+            g.removeBill(Bill())
+
+        b1 = Bill()
+        b1.charge = 10
+        g.addBill(b1, 1)
+        g.endCycle()
+
+        with self.assertRaises(ValueError):
+            g.removeBill(b1)
+
+        b2 = Bill()
+        b2.charge = 25
+        g.addBill(b2, 2)
+        g.removeBill(b2)
+
+        self.assertTrue(len(g.getBills()) == 0, 'Removed bill should leave the current cycle.')
+        self.assertTrue(g.getContributionTotal() == 0, 'Removed bill should not count.')
+        self.assertTrue(g.getBillCountFor(2) == 0, 'Removed bill should leave the owner index.')
+
+        g.removePayor(2)
+        with self.assertRaises(ValueError):
+            g.removePayor(1)
+
+        g.addBill(b2, 1)
+        self.assertTrue(g.getContributionFor(1) == 25, 'A removed bill should be able to be added again.')
+
+    def test_runningTotals(self):
+        """
+        Changing bills after they have been added to a bill group should keep the group's running totals in line with
+        the bills themselves.
+        """
+        g = BillGroup()
+        self.z.root.g = g
+
+        g.addOrUpdatePayor(1, 1)
+        g.addOrUpdatePayor(2, 1)
+
+        b1 = Bill()
+        b1.charge = 100
+        g.addBill(b1, 1)
+
+        b2 = Bill()
+        b2.charge = 50
+        g.addBill(b2, 2)
+
+        b1.addAdjustment(-20, 'Personal items')
+        self.assertTrue(g.getContributionFor(1) == 80, 'Adjustment did not update the running total.')
+
+        b2.charge = 70
+        self.assertTrue(g.getContributionFor(2) == 70, 'Charge change did not update the running total.')
+        self.assertTrue(g.getContributionTotal() == 150, 'Charge change did not update the group total.')
+
+        b2.active = False
+        self.assertTrue(g.getContributionFor(2) == 0, 'Deactivating a bill did not update the running total.')
+        self.assertTrue(g.getContributionTotal() == 80, 'Deactivating a bill did not update the group total.')
+
+        b2.charge = 10
+        self.assertTrue(g.getContributionTotal() == 80, 'Inactive bills should not affect the running total.')
+
+        b2.active = True
+        self.assertTrue(g.getContributionFor(2) == 10, 'Reactivating a bill did not update the running total.')
+
+        b1.owner = 2
+        self.assertTrue(g.getContributionFor(1) == 0, 'Changing owner did not update the running total.')
+        self.assertTrue(g.getContributionFor(2) == 90, 'Changing owner did not update the running total.')
+        self.assertTrue(g.getContributionTotal() == 90, 'Changing owner should not change the group total.')
+
+        with self.assertRaises(ValueError):
+            BillGroup().addBill(b1, 1)  # Already part of g.
+
+        self.assertTrue(g.verifyTotals(), 'Running totals should be consistent.')
+
+        self.cycleDb()
+
+        self.assertTrue(self.z.root.g.getContributionFor(2) == 90, 'Running totals did not persist.')
+        self.assertTrue(self.z.root.g.verifyTotals(), 'Running totals should be consistent after persisting.')
+
+    def test_verifyTotals(self):
+        """
+        Running totals that have drifted from the bills should be rebuilt.
+        """
+        g = BillGroup()
+        self.z.root.g = g
+
+        self.assertTrue(g.verifyTotals(), 'An empty bill group should be consistent.')
+
+        g.addOrUpdatePayor(1, 1)
+
+        b1 = Bill()
+        b1.charge = 100
+        b1.addAdjustment(5, 'Tip')
+        g.addBill(b1, 1)
+
+        g._contributions[1] = 3
+        g._contributionTotal = 3
+        b1._adjustmentTotal = 0
+
+        self.assertFalse(g.verifyTotals(), 'Drifted totals should be reported.')
+        self.assertTrue(g.getContributionFor(1) == 105, 'Drifted totals should be rebuilt.')
+        self.assertTrue(g.getContributionTotal() == 105, 'Drifted totals should be rebuilt.')
+        self.assertTrue(b1.getTotal() == 105, 'Drifted bill totals should be rebuilt.')
+        self.assertTrue(g.verifyTotals(), 'Rebuilt totals should be consistent.')
+
     def test_setName(self):
         """
         Test setting the name of a bill.
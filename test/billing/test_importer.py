@@ -0,0 +1,115 @@
+import io
+import os
+import unittest
+
+from core.billing import importer
+from core.billing.bills import BillGroup
+from core.database import unitofwork
+from core.database.zdb import Zdb
+
+
+class Tests_importer(unittest.TestCase):
+    """Tests importing bills in bulk."""
+
+    def setUp(self):
+        self.z = Zdb('test/secret/tests.zdb')
+
+        self.g = BillGroup()
+        self.z.root.g = self.g
+        self.g.addOrUpdatePayor(1, 1)
+        self.g.addOrUpdatePayor(2, 1)
+
+    def tearDown(self):
+        self.z.teardown()
+
+    def cycleDb(self):
+        self.tearDown()
+        self.z = Zdb('test/secret/tests.zdb')
+
+    def test_importBills_csv(self):
+        """Bills in a CSV export should be added to the bill group with their adjustments, names and dates."""
+        f = io.StringIO('owner,charge,name,date,adjustments\n'
+                        '1,500,Groceries,2016-01-13,-100:Personal items;20:Bag fee\n'
+                        '2,250,Power,2016-01-14 08:30:00,\n')
+
+        imported, errors = importer.importBills(self.g, importer.readCsv(f))
+
+        self.assertTrue(imported == 2, 'Both bills should be imported.')
+        self.assertTrue(errors == [], 'No rows should fail.')
+        self.assertTrue(self.g.getContributionFor(1) == 420, 'Adjustments were not applied.')
+        self.assertTrue(self.g.getContributionFor(2) == 250, 'Bill was not imported.')
+
+        bills = list(self.g.getBills())
+        self.assertTrue(bills[0].name == 'Groceries', 'Name was not imported.')
+        self.assertTrue(bills[0].date.day == 13, 'Date was not imported.')
+        self.assertTrue(bills[0].getAdjustments()[0] == (-100, 'Personal items'), 'Adjustment was not imported.')
+        self.assertTrue(bills[1].date.hour == 8, 'Date and time was not imported.')
+
+        self.cycleDb()
+        self.assertTrue(self.z.root.g.getContributionTotal() == 670, 'Imported bills did not persist.')
+
+    def test_importBills_jsonLines(self):
+        """Bills in a JSON Lines export should be added to the bill group."""
+        f = io.StringIO('{"owner": 1, "charge": 300, "adjustments": [[-50, "Coupon"]]}\n'
+                        '\n'
+                        '{"owner": 2, "charge": 100}\n')
+
+        imported, errors = importer.importBills(self.g, importer.readJsonLines(f))
+
+        self.assertTrue(imported == 2, 'Both bills should be imported.')
+        self.assertTrue(self.g.getContributionFor(1) == 250, 'Adjustments were not applied.')
+
+    def test_importBills_invalidRows(self):
+        """Invalid rows should be skipped and reported without stopping the import."""
+        f = io.StringIO('{"owner": 1, "charge": 100}\n'
+                        'not json\n'
+                        '{"owner": 3, "charge": 100}\n'
+                        '{"charge": 100}\n'
+                        '{"owner": 1, "charge": "12.50"}\n'
+                        '{"owner": 1, "charge": -5}\n'
+                        '{"owner": 1, "charge": 10, "adjustments": [[-20, "Too much"]]}\n'
+                        '{"owner": 1, "charge": 10, "date": "yesterday"}\n'
+                        '{"owner": 2, "charge": 200}\n')
+
+        imported, errors = importer.importBills(self.g, importer.readJsonLines(f))
+
+        self.assertTrue(imported == 2, 'Only the valid rows should be imported.')
+        self.assertTrue([n for n, __ in errors] == [2, 3, 4, 5, 6, 7, 8], 'Wrong rows reported: ' + str(errors))
+        self.assertTrue(self.g.getContributionTotal() == 300, 'Invalid rows should not count.')
+        self.assertTrue(len(self.g.getBills()) == 2, 'Invalid rows should not be added.')
+
+    def test_importBills_chunks(self):
+        """Bills should be committed a chunk at a time, with progress reported after each chunk."""
+        rows = ({'owner': 1 + i % 2, 'charge': 10} for i in range(25))
+        reports = []
+
+        imported, errors = importer.importBills(self.g, rows, chunkSize=10,
+                                                progress=lambda n, row: reports.append((n, row)))
+
+        self.assertTrue(imported == 25)
+        self.assertTrue(reports == [(10, 10), (20, 20), (25, 25)], 'Progress was not reported per chunk.')
+        self.assertFalse(unitofwork.isActive(), 'The import should not leave a unit of work open.')
+        self.assertTrue(self.g.getContributionTotal() == 250)
+
+        with self.assertRaises(ValueError):
+            importer.importBills(self.g, [], chunkSize=0)
+
+    def test_importFile(self):
+        """Files should be read according to their extension."""
+        path = 'test/secret/bills.csv'
+        with open(path, 'w') as f:
+            f.write('owner,charge\n1,100\n2,50\n')
+
+        try:
+            imported, errors = importer.importFile(self.g, path)
+        finally:
+            os.remove(path)
+
+        self.assertTrue(imported == 2)
+
+        with self.assertRaises(ValueError):
+            importer.importFile(self.g, 'bills.xls')
+
+
+if __name__ == '__main__':
+    unittest.main()
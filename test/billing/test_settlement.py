@@ -0,0 +1,66 @@
+import unittest
+
+from core.billing import settlement
+
+
+class Tests_settlement(unittest.TestCase):
+    """Tests settling bill group liabilities with transfers."""
+
+    def assertSettles(self, liabilities, transfers):
+        """Check that the transfers pay off every (rounded) liability exactly."""
+        balances = settlement.roundToCents(liabilities)
+        for payer, payee, amount in transfers:
+            self.assertTrue(amount > 0, 'Transfers must be for a positive amount.')
+            balances[payer] -= amount
+            balances[payee] += amount
+        self.assertTrue(all(b == 0 for b in balances.values()), 'Transfers did not settle everyone: ' + str(balances))
+
+    def test_settle_empty(self):
+        """Nobody owes anything, so nothing needs to be transferred."""
+        self.assertTrue(settlement.settle({}) == [])
+        self.assertTrue(settlement.settle({1: 0, 2: 0}) == [])
+
+    def test_settle_pair(self):
+        """Two payors settle in one transfer from the debtor to the creditor."""
+        self.assertTrue(settlement.settle({1: -250, 2: 250}) == [(2, 1, 250)])
+
+    def test_settle_matching(self):
+        """Payors owing exactly what another is owed should settle directly with each other."""
+        liabilities = {1: 10, 2: -10, 3: 5, 4: -5}
+        transfers = settlement.settle(liabilities)
+        self.assertSettles(liabilities, transfers)
+        self.assertTrue(len(transfers) == 2, 'Matching balances should take one transfer each.')
+
+    def test_settle_exact(self):
+        """Balances that split into zero-sum groups should take fewer transfers than settling them all together."""
+        liabilities = {1: 3, 2: 4, 3: -7, 4: 5, 5: -2, 6: -3}
+        transfers = settlement.settle(liabilities)
+        self.assertSettles(liabilities, transfers)
+        self.assertTrue(len(transfers) == 4, 'Expected two zero-sum groups of three, settled in 4 transfers.')
+
+    def test_settle_large(self):
+        """Groups too big for the exact solver should still settle in at most one fewer transfer than payors."""
+        liabilities = {p: (p * 37) % 101 - 50 for p in range(40)}
+        liabilities[40] = -sum(liabilities.values())
+        transfers = settlement.settle(liabilities)
+        self.assertSettles(liabilities, transfers)
+        self.assertTrue(len(transfers) < len(liabilities))
+
+    def test_roundToCents(self):
+        """Rounding fractional liabilities should keep them summing to zero."""
+        cents = settlement.roundToCents({1: 33.34, 2: 33.33, 3: -66.67})
+        self.assertTrue(all(type(c) is int for c in cents.values()), 'Rounded amounts should be integers.')
+        self.assertTrue(sum(cents.values()) == 0, 'Rounded amounts should still sum to zero.')
+
+        transfers = settlement.settle({1: -187.5, 2: 187.5})
+        self.assertTrue(len(transfers) == 1 and transfers[0][2] in (187, 188), 'Half cents should round.')
+
+    def test_formatCents(self):
+        self.assertTrue(settlement.formatCents(0) == '$0.00')
+        self.assertTrue(settlement.formatCents(5) == '$0.05')
+        self.assertTrue(settlement.formatCents(123456) == '$1,234.56')
+        self.assertTrue(settlement.formatCents(-21249.999999999997) == '-$212.50')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,14 @@
+import os
+import sqlite3
 import unittest
 
+from flask import Flask, g, session
+
+from core import enums
+from core.database import db, queries
+from core.household import household
 from core.household.household import Household
+from core.web import sessions
 
 
 class Tests_Household(unittest.TestCase):
@@ -19,3 +27,233 @@ class Tests_Household(unittest.TestCase):
             Household('')
 
         Household('householdId')
+
+
+class Tests_HouseholdSearch(unittest.TestCase):
+    """Tests searching households through the full-text index."""
+
+    def setUp(self):
+        if os.path.exists('test/secret/search.db'):
+            os.remove('test/secret/search.db')
+
+        self.ctx = Flask(__name__).app_context()
+        self.ctx.push()
+
+        g.db = sqlite3.connect('test/secret/search.db')
+        with open('config/schema.sql', mode='r') as f:
+            g.db.executescript(f.read())
+        g.db.executemany(queries.HOUSEHOLD_CREATE, [('Maple House', 1), ('Maple Court Apartments', 2),
+                                                     ('The Oak House', 2), ('Mapleton', 1)])
+        g.db.commit()
+        household.invalidateSearchCache()
+
+    def tearDown(self):
+        household.invalidateSearchCache()
+        g.db.close()
+        self.ctx.pop()
+
+    def names(self, partial):
+        return [h['household_name'] for h in household.searchHouseholds(partial)]
+
+    def test_prefix(self):
+        self.assertTrue(sorted(self.names('map')) == ['Maple Court Apartments', 'Maple House', 'Mapleton'])
+        self.assertTrue(sorted(self.names('ma ho')) == ['Maple House'])
+        self.assertTrue(self.names('oak') == ['The Oak House'])
+        self.assertTrue(self.names('ouse') == [], 'Only word prefixes should match.')
+
+    def test_syncedOnUpdate(self):
+        """The index should follow renames and deletes."""
+        db.post_db(queries.HOUSEHOLD_UPDATE_HOUSEHOLDNAME, ['Birch House', 1])
+        g.db.execute('DELETE FROM households WHERE id = 4')
+        g.db.commit()
+        household.invalidateSearchCache()
+
+        self.assertTrue(sorted(self.names('map')) == ['Maple Court Apartments'])
+        self.assertTrue(self.names('birch') == ['Birch House'])
+
+    def test_limit(self):
+        self.assertTrue(len(household.searchHouseholds('map', 2)) == 2)
+
+    def test_syntax(self):
+        """Nothing typed should be read as query syntax."""
+        self.assertTrue(self.names('"') == [])
+        self.assertTrue(self.names('   ') == [])
+        self.assertTrue(sorted(self.names('map*')) == sorted(self.names('map')))
+        self.assertTrue(sorted(self.names('maple OR oak')) == [])
+        self.assertTrue(household.toMatchQuery('a "b" c-d') == '"a"* "b"* "c-d"*')
+
+    def test_cached(self):
+        """Repeated searches should be answered from the cache until it is invalidated."""
+        self.assertTrue(self.names('oak') == ['The Oak House'])
+        db.post_db(queries.HOUSEHOLD_UPDATE_HOUSEHOLDNAME, ['The Elm House', 3])
+        self.assertTrue(self.names('oak') == ['The Oak House'], 'Search should have been cached.')
+
+        household.invalidateSearchCache()
+        self.assertTrue(self.names('oak') == [])
+
+    def test_cached_refine(self):
+        """A longer search should be answered by filtering the cached results of a shorter one."""
+        self.assertTrue(len(self.names('m')) == 3)
+        g.db.execute('DELETE FROM households')
+        g.db.commit()
+
+        self.assertTrue(sorted(self.names('mapl')) == ['Maple Court Apartments', 'Maple House', 'Mapleton'])
+        self.assertTrue(self.names('maple ho') == ['Maple House'])
+        self.assertTrue(self.names('oak') == [], 'Unrelated search should go to the database.')
+
+    def test_cached_refine_limited(self):
+        """Results cut short by the limit can't be refined, since matches may be missing from them."""
+        self.assertTrue(len(household.searchHouseholds('m', 2)) == 2)
+        g.db.execute('DELETE FROM households')
+        g.db.commit()
+        self.assertTrue(household.searchHouseholds('mapleton', 2) == [], 'Search should have gone to the database.')
+
+
+class Tests_HouseholdMemberships(unittest.TestCase):
+    """Tests looking up household memberships through the membership cache."""
+
+    def setUp(self):
+        if os.path.exists('test/secret/memberships.db'):
+            os.remove('test/secret/memberships.db')
+
+        self.ctx = Flask(__name__).app_context()
+        self.ctx.push()
+
+        g.db = sqlite3.connect('test/secret/memberships.db')
+        with open('config/schema.sql', mode='r') as f:
+            g.db.executescript(f.read())
+        household.membershipCache.invalidate()
+
+    def tearDown(self):
+        household.membershipCache.invalidate()
+        g.db.close()
+        self.ctx.pop()
+
+    def test_relations(self):
+        household.addMembership(1, 10, enums.e_household_relation.admin)
+        household.addMembership('1', '11', enums.e_household_relation.request)
+
+        self.assertTrue(household.getHouseholdRelation(1, 10) == enums.e_household_relation.admin)
+        self.assertTrue(household.getHouseholdRelation('1', 11) == enums.e_household_relation.request)
+        self.assertTrue(household.getHouseholdRelation(1, 12) is None)
+        self.assertTrue(household.getHouseholdRelation(2, 10) is None)
+
+    def test_cached(self):
+        """Lookups should come from the cache, and changes made through this module should invalidate it."""
+        household.addMembership(1, 10, enums.e_household_relation.request)
+        self.assertTrue(household.getHouseholdRelation(1, 10) == enums.e_household_relation.request)
+
+        g.db.execute('DELETE FROM household_memberships')
+        g.db.commit()
+        self.assertTrue(household.getHouseholdRelation(1, 10) == enums.e_household_relation.request,
+                        'Relation should have been cached.')
+
+        household.addMembership(1, 10, enums.e_household_relation.request)
+        household.updateMembership(1, 10, enums.e_household_relation.member)
+        self.assertTrue(household.getHouseholdRelation(1, 10) == enums.e_household_relation.member)
+
+        household.removeMembership(1, 10)
+        self.assertTrue(household.getHouseholdRelation(1, 10) is None)
+
+
+class Tests_HouseholdContext(unittest.TestCase):
+    """Tests building and caching the session context."""
+
+    def setUp(self):
+        if os.path.exists('test/secret/context.db'):
+            os.remove('test/secret/context.db')
+
+        self.app = Flask(__name__)
+        self.app.secret_key = 'test'
+        self.ctx = self.app.test_request_context()
+        self.ctx.push()
+
+        g.db = sqlite3.connect('test/secret/context.db')
+        with open('config/schema.sql', mode='r') as f:
+            g.db.executescript(f.read())
+        g.db.execute(queries.REGISTER, ['user', 'hash', 'user@example.com'])
+        g.db.execute(queries.HOUSEHOLD_CREATE, ['Maple House', 2])
+        g.db.commit()
+        household.membershipCache.invalidate()
+        household.addMembership(1, 1, enums.e_household_relation.admin)
+        sessions.contextChanges.invalidate()
+
+    def tearDown(self):
+        household.membershipCache.invalidate()
+        sessions.contextChanges.invalidate()
+        g.db.close()
+        self.ctx.pop()
+
+    def test_build(self):
+        context = household.buildContext(1, 1)
+        self.assertTrue(context.email == 'user@example.com')
+        self.assertTrue(context.householdName == 'Maple House' and context.householdType == 2)
+        self.assertTrue(context.householdRelation == enums.e_household_relation.admin)
+
+        context = household.buildContext(None, None)
+        self.assertTrue(context.email is None and context.householdName is None)
+
+    def test_getContext(self):
+        """The context should follow the session, and be rebuilt when what it describes changes."""
+        session['id'] = 1
+        self.assertTrue(household.getContext().householdName is None)
+
+        session['householdId'] = 1
+        self.assertTrue(household.getContext().householdName == 'Maple House')
+
+        g.db.execute(queries.HOUSEHOLD_UPDATE_HOUSEHOLDNAME, ['Oak House', 1])
+        g.db.commit()
+        self.assertTrue(household.getContext().householdName == 'Maple House', 'Context should have been cached.')
+
+        # Without server-side sessions, the context is kept in the cookie for later requests.
+        g.pop('sessionContext')
+        self.assertTrue(session['context']['householdName'] == 'Maple House')
+        self.assertTrue(household.getContext().householdName == 'Maple House', 'Context should have been cached.')
+
+        household.updateMembership(1, 1, enums.e_household_relation.member)
+        context = household.getContext()
+        self.assertTrue(context.householdName == 'Oak House')
+        self.assertTrue(context.householdRelation == enums.e_household_relation.member)
+
+    def cookieContext(self):
+        """Gets the context as a later request from this cookie would."""
+        g.pop('sessionContext', None)
+        return household.getContext()
+
+    def test_getContext_otherSession(self):
+        """A context kept in another session's cookie should be rebuilt when what it describes has changed."""
+        session['id'] = 1
+        session['householdId'] = 1
+        self.assertTrue(self.cookieContext().householdRelation == enums.e_household_relation.admin)
+        cookie = dict(session['context'])
+
+        # Another session demotes this user, which can only drop its own cookie's context.
+        household.updateMembership(1, 1, enums.e_household_relation.member)
+        session['context'] = cookie
+        self.assertTrue(self.cookieContext().householdRelation == enums.e_household_relation.member)
+
+    def test_getContext_expired(self):
+        """A context kept in a cookie should be rebuilt once it is old, to pick up changes made by other processes."""
+        session['id'] = 1
+        session['householdId'] = 1
+        self.cookieContext()
+
+        g.db.execute(queries.HOUSEHOLD_UPDATE_HOUSEHOLDNAME, ['Oak House', 1])
+        g.db.commit()
+        self.assertTrue(self.cookieContext().householdName == 'Maple House', 'Context should have been cached.')
+
+        session['context']['built'] -= sessions.CONTEXT_TTL
+        self.assertTrue(self.cookieContext().householdName == 'Oak House')
+
+    def test_setHousehold(self):
+        """Selecting the household again should look its facts up again."""
+        session['logged_in'] = True
+        session['id'] = 1
+        self.assertTrue(household.setHousehold(1))
+        self.assertTrue(self.cookieContext().householdName == 'Maple House')
+
+        g.db.execute(queries.HOUSEHOLD_UPDATE_HOUSEHOLDNAME, ['Oak House', 1])
+        g.db.commit()
+        self.assertTrue(household.setHousehold(1))
+        self.assertTrue('context' not in session)
+        self.assertTrue(self.cookieContext().householdName == 'Oak House')
@@ -0,0 +1,96 @@
+import sqlite3
+import unittest
+
+from flask import Flask, g
+
+from core import enums
+from core.database import queries
+from route.admin import admin
+
+
+class Tests_AdminGetEvents(unittest.TestCase):
+    """Tests paging through the event log with keyset cursors."""
+
+    def setUp(self):
+        self.ctx = Flask(__name__).app_context()
+        self.ctx.push()
+
+        g.db = sqlite3.connect(':memory:')
+        with open('config/schema.sql', mode='r') as f:
+            g.db.executescript(f.read())
+
+        # 25 system events, one a day, alternating info and warning and blamed on users 1 to 5, plus some noise in
+        # another log that must never show up.
+        events = []
+        for i in range(1, 26):
+            events.append((i % 5 + 1, 'Event ' + str(i), 1 + i % 2, int(enums.e_log_event_type.system),
+                           '2020-01-' + format(i, '02d') + ' 12:00:00'))
+            events.append((None, 'Noise', 1, int(enums.e_log_event_type.user), '2020-01-01 00:00:00'))
+        g.db.executemany(queries.LOG_INSERT_TIMESTAMPED, events)
+        g.db.commit()
+
+    def tearDown(self):
+        g.db.close()
+        self.ctx.pop()
+
+    def page(self, **kwargs):
+        events, older, newer = admin.getEvents(enums.e_log_event_type.system, count=10, **kwargs)
+        return [e['message'] for e in events], older, newer
+
+    def messages(self, numbers):
+        return ['Event ' + str(n) for n in numbers]
+
+    def test_firstPage(self):
+        """The first page should be the newest events, with only an older page."""
+        events, older, newer = self.page()
+        self.assertTrue(events == self.messages(range(25, 15, -1)))
+        self.assertTrue(newer is None)
+        self.assertTrue(admin.getEvents(enums.e_log_event_type.system, before=older, count=10)[0][0]['message']
+                        == 'Event 15')
+
+    def test_olderThenNewer(self):
+        """Paging older to the end and then newer should come back to the same pages."""
+        first, older1, __ = self.page()
+        second, older2, newer2 = self.page(before=older1)
+        self.assertTrue(second == self.messages(range(15, 5, -1)))
+
+        third, older3, newer3 = self.page(before=older2)
+        self.assertTrue(third == self.messages(range(5, 0, -1)))
+        self.assertTrue(older3 is None, 'The oldest page should have no older page.')
+
+        back, olderBack, newerBack = self.page(after=newer3)
+        self.assertTrue(back == second and olderBack == older2 and newerBack == newer2)
+
+        front, olderFront, newerFront = self.page(after=newerBack)
+        self.assertTrue(front == first and olderFront == older1 and newerFront is None)
+
+    def test_pastOldest(self):
+        """An empty page past the oldest event should link newer to the oldest page."""
+        events, older, newer = self.page(before=1)
+        self.assertTrue(events == [] and older is None)
+        self.assertTrue(self.page(after=newer)[0] == self.messages(range(10, 0, -1)))
+
+    def test_pastNewest(self):
+        """An empty page past the newest event should link older to the newest page."""
+        lastId = g.db.execute('SELECT MAX(id) FROM event_log').fetchone()[0]
+        events, older, newer = self.page(after=lastId)
+        self.assertTrue(events == [] and newer is None)
+        self.assertTrue(self.page(before=older)[0][0] == 'Event 25')
+
+    def test_filtered(self):
+        """Filters should narrow every page, and the cursors should only count matching events."""
+        events, older, newer = self.page(level=2, since='2020-01-02', until='2020-01-24')
+        self.assertTrue(events == self.messages(range(23, 3, -2)))
+        self.assertTrue(self.page(level=2, since='2020-01-02', until='2020-01-24', before=older)[0]
+                        == self.messages([3]))
+
+        events, older, newer = self.page(blame=1)
+        self.assertTrue(events == self.messages([25, 20, 15, 10, 5]))
+        self.assertTrue(older is None and newer is None)
+
+    def test_logNotAllowed(self):
+        self.assertTrue(admin.getEvents(99) == (None, None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
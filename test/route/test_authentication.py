@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import tempfile
+import types
+import unittest
+
+from flask import Flask, g
+
+from core.database import queries
+from core.user import passwords, throttle
+from core.user.passwords import PasswordHasher, HasherBusyException
+from route.authentication import authentication
+
+
+class Tests_Login(unittest.TestCase):
+    """Tests the login route's admission control, throttling and password hash upgrades."""
+
+    SALT = 'instance salt'
+
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        with open('config/schema.sql', mode='r') as f:
+            self.db.executescript(f.read())
+        self.db.execute(queries.REGISTER, ['user', PasswordHasher(0, iterations=1000).makeHash('hunter22')[0],
+                                           'user@example.com'])
+        self.db.commit()
+
+        self.hasher = PasswordHasher(0, iterations=1000)
+        self.throttle = throttle.LoginThrottle()
+
+        # The login page only needs to show its flashed messages here.
+        self.templates = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.templates.name, 'login.html'), mode='w') as f:
+            f.write("{{ get_flashed_messages() | join(' ') }}")
+
+        self.app = Flask(__name__, template_folder=self.templates.name)
+        self.app.secret_key = 'test'
+        self.app.add_url_rule('/login', 'login', authentication.login, methods=['GET', 'POST'])
+        self.app.add_url_rule('/select', 'household_select', lambda: '')
+
+        @self.app.before_request
+        def singletons():
+            g.db = self.db
+            g.s = types.SimpleNamespace(hasher=self.hasher, loginThrottle=self.throttle,
+                                        context=types.SimpleNamespace(SALT=self.SALT))
+
+    def tearDown(self):
+        self.db.close()
+        self.templates.cleanup()
+
+    def login(self, password='hunter22', username='user'):
+        return self.app.test_client().post('/login', data={'inputUsername': username, 'inputPassword': password})
+
+    def storedHash(self):
+        return self.db.execute("SELECT password FROM users WHERE username='user'").fetchone()[0]
+
+    def test_login(self):
+        response = self.login()
+        self.assertTrue(response.status_code == 302 and response.headers['Location'].endswith('/select'))
+        self.assertTrue('pbkdf2;dur=' in response.headers['Server-Timing'])
+
+        self.assertTrue(self.login('wrong').status_code == 200)
+
+    def test_busy(self):
+        """When the hasher is saturated, the login should be turned away with 503 rather than wait."""
+        def busy(*args):
+            raise HasherBusyException('Too many passwords are being hashed.')
+        self.hasher.hash = busy
+
+        self.assertTrue(self.login().status_code == 503)
+
+    def test_throttled(self):
+        """Attempts beyond the throttle should be turned away with 429, without hashing the password."""
+        for __ in range(throttle.USERNAME_CAPACITY):
+            self.assertTrue(self.login('wrong').status_code == 200)
+        hashed = self.hasher.getStats()['hashed']
+
+        response = self.login()
+        self.assertTrue(response.status_code == 429)
+        self.assertTrue(self.hasher.getStats()['hashed'] == hashed, 'A throttled attempt should not be hashed.')
+
+    def test_rehash(self):
+        """Logging in with a hash from before the versioned format should replace it with a current one."""
+        legacy = passwords.pbkdf2('hunter22', self.SALT, passwords.LEGACY_ITERATIONS)
+        self.db.execute(queries.USER_UPDATE_PASSWORD, [legacy, 1])
+        self.db.commit()
+
+        self.assertTrue(self.login().status_code == 302)
+        self.assertTrue(passwords.decode(self.storedHash()) is not None, 'The legacy hash should have been replaced.')
+        self.assertTrue(self.hasher.verify('hunter22', self.storedHash(), self.SALT)[:2] == (True, False))
+
+    def test_rehash_busy(self):
+        """If the hasher is busy when the hash would be upgraded, the login should still go ahead."""
+        legacy = passwords.pbkdf2('hunter22', self.SALT, passwords.LEGACY_ITERATIONS)
+        self.db.execute(queries.USER_UPDATE_PASSWORD, [legacy, 1])
+        self.db.commit()
+
+        def busy(password):
+            raise HasherBusyException('Too many passwords are being hashed.')
+        self.hasher.makeHash = busy
+
+        self.assertTrue(self.login().status_code == 302)
+        self.assertTrue(self.storedHash() == legacy)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+from flask import Flask, got_request_exception
+
+from core.billing.bills import Bill
+from core.database import unitofwork
+from core.database.zdb import Zdb
+from shell.shell import ShellContext
+
+
+class Tests_ShellContextRequests(unittest.TestCase):
+    """Tests committing a request's object changes when the request is finished."""
+
+    def setUp(self):
+        self.z = Zdb('test/secret/tests.zdb')
+        b = Bill()
+        self.z.root.shell = b
+        b.charge = 10
+
+        # Only the request handlers are under test, so the context's environment and databases aren't set up.
+        context = ShellContext.__new__(ShellContext)
+
+        self.app = Flask(__name__)
+        self.app.logger.disabled = True
+        self.app.before_request(unitofwork.begin)
+        self.app.after_request(context.request_after)
+        self.app.teardown_request(lambda exception: unitofwork.end(False))
+        got_request_exception.connect(context.request_exception, self.app)
+
+        @self.app.route('/change')
+        def change():
+            self.z.root.shell.charge = 20
+            return ''
+
+        @self.app.route('/crash')
+        def crash():
+            self.z.root.shell.charge = 30
+            raise RuntimeError('Crashed after changing the bill.')
+
+        @self.app.route('/error')
+        def error():
+            self.z.root.shell.charge = 40
+            return '', 500
+
+    def tearDown(self):
+        while unitofwork.isActive():
+            unitofwork.end(False)
+        self.z.teardown()
+
+    def charge(self):
+        """The bill's charge as stored, read through a fresh connection."""
+        self.z.teardown()
+        self.z = Zdb('test/secret/tests.zdb')
+        return self.z.root.shell.charge
+
+    def test_commit(self):
+        self.assertTrue(self.app.test_client().get('/change').status_code == 200)
+        self.assertTrue(self.charge() == 20)
+
+    def test_raised(self):
+        """A request that raised should not commit what it changed before raising."""
+        self.assertTrue(self.app.test_client().get('/crash').status_code == 500)
+        self.assertTrue(self.charge() == 10, 'Changes from a request that raised should be thrown away.')
+
+    def test_serverError(self):
+        self.assertTrue(self.app.test_client().get('/error').status_code == 500)
+        self.assertTrue(self.charge() == 10, 'Changes from a request answered with 500 should be thrown away.')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from core.cache import LruCache
+
+
+class Tests_cache(unittest.TestCase):
+    """Tests the least recently used cache."""
+
+    def test_bounds(self):
+        cache = LruCache(2, 60)
+        cache.put(1, 'a')
+        cache.put(2, 'b')
+        cache.get(1)
+        cache.put(3, 'c')
+        self.assertTrue(len(cache) == 2)
+        self.assertTrue(cache.get(1) == (True, 'a'))
+        self.assertTrue(cache.get(2) == (False, None), 'Least recently used entry should be evicted.')
+
+    def test_expiry(self):
+        cache = LruCache(2, -1)
+        cache.put(1, 'a')
+        self.assertTrue(cache.get(1) == (False, None), 'Expired entry should not be returned.')
+
+    def test_invalidate(self):
+        cache = LruCache(5, 60)
+        cache.put(1, None)
+        cache.put(2, 'b')
+        self.assertTrue(cache.get(1) == (True, None), 'None should be cached like any other value.')
+
+        cache.invalidate(1)
+        self.assertTrue(cache.get(1) == (False, None))
+        cache.invalidate()
+        self.assertTrue(len(cache) == 0)
+
+    def test_init_invalid(self):
+        self.assertRaises(TypeError, LruCache, '2', 60)
+        self.assertRaises(ValueError, LruCache, 0, 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
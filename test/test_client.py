@@ -0,0 +1,85 @@
+import unittest
+
+from flask import Flask, session
+from werkzeug.exceptions import HTTPException
+
+from core.database.zdb import Zdb
+from core.web import client
+from core.web.client import RequestContext
+
+
+class Tests_RequestContext(unittest.TestCase):
+    """Tests looking up the session's user and household objects lazily."""
+
+    def setUp(self):
+        self.z = Zdb('test/secret/tests.zdb')
+        if self.z.getUser('1') is None:
+            self.z.createUser('1', 'User')
+        if self.z.getHousehold('1') is None:
+            self.z.createHousehold('1')
+
+        self.app = Flask(__name__)
+        self.app.secret_key = 'test'
+        self.app.add_url_rule('/', 'splash', lambda: '')
+        self.ctx = self.app.test_request_context()
+        self.ctx.push()
+
+        client.identityCache.invalidate()
+        self.lookups = []
+
+    def tearDown(self):
+        client.identityCache.invalidate()
+        self.ctx.pop()
+        self.z.teardown()
+
+    def countingContext(self):
+        """A request context that records every lookup that goes to the object database."""
+        dog = RequestContext(self.z)
+        getUser = self.z.getUser
+        dog.zdb = lambda: None
+        dog.zdb.open = self.z.open
+        dog.zdb.zdb = self.z.zdb
+        dog.zdb.getUser = lambda userId: self.lookups.append(userId) or getUser(userId)
+        dog.zdb.getHousehold = self.z.getHousehold
+        return dog
+
+    def test_lazy(self):
+        """Nothing should be looked up until it is asked for, and then only once."""
+        session['id'] = 1
+        dog = self.countingContext()
+        self.assertTrue(self.lookups == [])
+
+        self.assertTrue(dog.me is self.z.getUser('1'))
+        self.assertTrue(dog.me is self.z.getUser('1'))
+        self.assertTrue(self.lookups == [1])
+
+    def test_noSession(self):
+        dog = RequestContext(self.z)
+        self.assertTrue(dog.me is None and dog.hh is None)
+
+    def test_identityCache(self):
+        """Later requests should find the object through the identity cache, until something is committed."""
+        session['id'] = 1
+        self.countingContext().me
+        self.assertTrue(self.countingContext().me is self.z.getUser('1'))
+        self.assertTrue(self.lookups == [1], 'Second lookup should have come from the identity cache.')
+
+        self.z.getUser('1').displayname = 'Renamed'
+        self.countingContext().me
+        self.assertTrue(self.lookups == [1, 1], 'A commit should have made the cached lookup stale.')
+
+    def test_integrity(self):
+        """A session that refers to a missing object should be cleared, and the request redirected."""
+        session['id'] = 1
+        session['householdId'] = 'missing'
+        dog = RequestContext(self.z)
+
+        self.assertTrue(dog.me is not None)
+        with self.assertRaises(HTTPException) as e:
+            dog.hh
+        self.assertTrue(e.exception.response.status_code == 302)
+        self.assertTrue('id' not in session)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+from flask import Flask, g
+
+from core.database import db
+from core.database.sqlpool import SqlPool
+
+
+class Tests_db(unittest.TestCase):
+    """Tests the common SQL access patterns."""
+
+    def setUp(self):
+        self.pool = SqlPool('test/secret/tests.db', 1)
+        self.ctx = Flask(__name__).app_context()
+        self.ctx.push()
+
+        g.db = self.pool.checkout()
+        g.db.execute('DROP TABLE IF EXISTS db_test')
+        g.db.execute('CREATE TABLE db_test (id INTEGER PRIMARY KEY, name TEXT)')
+        g.db.executemany('INSERT INTO db_test (name) VALUES (?)', [('row' + str(i),) for i in range(25)])
+        g.db.commit()
+
+    def tearDown(self):
+        self.pool.checkin(g.db)
+        self.ctx.pop()
+        self.pool.close()
+
+    def test_query_db(self):
+        rows = db.query_db('SELECT id, name FROM db_test ORDER BY id')
+        self.assertTrue(len(rows) == 25)
+        self.assertTrue(rows[0] == {'id': 1, 'name': 'row0'})
+
+        self.assertTrue(db.query_db('SELECT name FROM db_test WHERE id = ?', [3], True) == {'name': 'row2'})
+        self.assertTrue(db.query_db('SELECT name FROM db_test WHERE id = ?', [99], True) is None)
+        self.assertTrue(db.query_db('SELECT name FROM db_test WHERE name = ?', ['']) is None)
+
+    def test_post_db(self):
+        """Posting should return the inserted row id and the number of rows changed."""
+        rowId, count = db.post_db('INSERT INTO db_test (name) VALUES (?)', ['inserted'])
+        self.assertTrue(rowId == 26 and count == 1)
+        self.assertTrue(db.query_db('SELECT name FROM db_test WHERE id = ?', [rowId], True) == {'name': 'inserted'})
+
+        count = db.post_db('UPDATE db_test SET name = ? WHERE id <= ?', ['updated', 10])[1]
+        self.assertTrue(count == 10)
+
+    def test_post_many_db(self):
+        """Bulk inserts should return the range of ids they were given, in order."""
+        ids = db.post_many_db('INSERT INTO db_test (name) VALUES (?)', [('bulk' + str(i),) for i in range(5)])
+        self.assertTrue(ids == range(26, 31))
+        self.assertTrue(db.query_db('SELECT name FROM db_test WHERE id = ?', [ids[3]], True) == {'name': 'bulk3'})
+
+        self.assertTrue(db.post_many_db('INSERT INTO db_test (name) VALUES (?)', []) == range(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import datetime
+import os
+import shutil
+import unittest
+
+from core.database import logretention
+from core.database.logretention import LogRetention
+from core.database.sqlpool import SqlPool
+
+
+class Tests_logretention(unittest.TestCase):
+    """Tests rolling up, archiving and pruning the event log."""
+
+    archiveDir = 'test/secret/log-archive'
+
+    def setUp(self):
+        shutil.rmtree(self.archiveDir, ignore_errors=True)
+        if os.path.exists('test/secret/retention.db'):
+            os.remove('test/secret/retention.db')
+
+        self.pool = SqlPool('test/secret/retention.db', 2)
+        c = self.pool.checkout()
+        with open('config/schema.sql', mode='r') as f:
+            c.executescript(f.read())
+
+        # Three days of events, two per hour, alternating log types.
+        start = datetime.datetime(2020, 1, 1)
+        events = []
+        for i in range(144):
+            timestamp = (start + datetime.timedelta(minutes=30 * i)).strftime('%Y-%m-%d %H:%M:%S')
+            events.append((None, 'Event ' + str(i), 1, 1 + i % 2, timestamp))
+        c.executemany("INSERT INTO event_log (blame, message, e_log_event_level, e_log_event_type, timestamp)"
+                      " VALUES (?, ?, ?, ?, ?)", events)
+        c.commit()
+        self.pool.checkin(c)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.archiveDir, ignore_errors=True)
+
+    def query(self, q, args=()):
+        c = self.pool.checkout()
+        rows = c.execute(q, args).fetchall()
+        self.pool.checkin(c)
+        return rows
+
+    def test_rollup(self):
+        """Every event should be counted once, into its hour, even across several runs and batches."""
+        retention = LogRetention(self.pool, self.archiveDir, batchSize=10)
+        self.assertTrue(retention.rollup() == 144)
+        self.assertTrue(retention.rollup() == 0, 'Events should not be counted twice.')
+
+        rows = self.query('SELECT hour, e_log_event_type, count FROM event_log_rollup ORDER BY hour, e_log_event_type')
+        self.assertTrue(len(rows) == 144)
+        self.assertTrue(rows[0] == ('2020-01-01 00:00:00', 1, 1))
+        self.assertTrue(sum(r[2] for r in rows) == 144)
+
+    def test_run(self):
+        """Events older than the retention period should be archived by day and deleted."""
+        retention = LogRetention(self.pool, self.archiveDir, retentionDays=1, batchSize=25)
+        counted, pruned = retention.run(datetime.datetime(2020, 1, 3, 12))
+
+        self.assertTrue(counted == 144)
+        self.assertTrue(pruned == 72)
+        self.assertTrue(self.query('SELECT MIN(timestamp) FROM event_log')[0][0] == '2020-01-02 12:00:00')
+
+        day1 = list(logretention.readArchive(os.path.join(self.archiveDir, 'event_log-2020-01-01.jsonl.gz')))
+        day2 = list(logretention.readArchive(os.path.join(self.archiveDir, 'event_log-2020-01-02.jsonl.gz')))
+        self.assertTrue(len(day1) == 48 and len(day2) == 24)
+        self.assertTrue(day1[0]['message'] == 'Event 0')
+
+        self.assertTrue(self.query('SELECT SUM(count) FROM event_log_rollup')[0][0] == 144,
+                        'Rollups should outlive the events.')
+
+    def test_prune_uncounted(self):
+        """Events that have not been rolled up should never be pruned."""
+        retention = LogRetention(self.pool, self.archiveDir, retentionDays=1)
+        self.assertTrue(retention.prune(datetime.datetime(2030, 1, 1)) == 0)
+        self.assertTrue(self.query('SELECT COUNT(*) FROM event_log')[0][0] == 144)
+
+    def test_init_invalid(self):
+        self.assertRaises(TypeError, LogRetention, self.pool, self.archiveDir, '90')
+        self.assertRaises(ValueError, LogRetention, self.pool, self.archiveDir, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
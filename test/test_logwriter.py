@@ -0,0 +1,122 @@
+import contextlib
+import io
+import threading
+import unittest
+
+from core import enums
+from core.database import logwriter
+from core.database.logwriter import LogWriter
+from core.database.sqlpool import SqlPool
+
+
+class Tests_logwriter(unittest.TestCase):
+    """Tests writing the event log in batches."""
+
+    def setUp(self):
+        self.pool = SqlPool('test/secret/tests.db', 2)
+        c = self.pool.checkout()
+        c.execute('DROP TABLE IF EXISTS event_log')
+        c.execute("CREATE TABLE event_log (id INTEGER PRIMARY KEY AUTOINCREMENT, blame INTEGER,"
+                  " timestamp INTEGER DEFAULT (DATETIME('now')), e_log_event_level INTEGER NOT NULL,"
+                  " e_log_event_type INTEGER NOT NULL, message TEXT NOT NULL)")
+        c.commit()
+        self.pool.checkin(c)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def events(self):
+        c = self.pool.checkout()
+        rows = c.execute('SELECT blame, message, e_log_event_level, timestamp FROM event_log ORDER BY id').fetchall()
+        self.pool.checkin(c)
+        return rows
+
+    def test_batched(self):
+        """Every queued event should be written, in order, with its timestamp."""
+        writer = LogWriter(self.pool, batchSize=7, flushInterval=0.05)
+        writer.start()
+        for i in range(50):
+            writer.write(i, 'Event ' + str(i), enums.e_log_event_level.info, enums.e_log_event_type.user)
+        writer.flush()
+
+        events = self.events()
+        self.assertTrue(len(events) == 50)
+        self.assertTrue([e[0] for e in events] == list(range(50)))
+        self.assertTrue(events[0][3] is not None and len(events[0][3]) == 19)
+        self.assertTrue(writer.getWrittenCount() == 50)
+        writer.stop()
+
+    def test_stop_flushes(self):
+        """Stopping should write out whatever is still queued."""
+        writer = LogWriter(self.pool, flushInterval=60)
+        writer.start()
+        writer.write(None, 'Last words', enums.e_log_event_level.info, enums.e_log_event_type.system)
+        writer.stop()
+
+        self.assertFalse(writer.isRunning())
+        self.assertTrue(len(self.events()) == 1)
+
+    def test_full_drop(self):
+        """Routine events should be dropped when the queue is full, and the drop reported later."""
+        writer = LogWriter(self.pool, queueSize=2)
+        for i in range(3):
+            queued = writer.write(i, 'Event', enums.e_log_event_level.info, enums.e_log_event_type.user)
+            self.assertTrue(queued == (i < 2))
+        self.assertTrue(writer.getDroppedCount() == 1)
+
+        writer.start()
+        writer.stop()
+        events = self.events()
+        self.assertTrue(len(events) == 3, 'Queued events and a drop report should be written.')
+        self.assertTrue('1 event(s) dropped' in events[2][1])
+
+    def test_full_critical(self):
+        """Critical events should never be dropped, even when the queue stays full."""
+        timeout = logwriter.BLOCK_TIMEOUT
+        logwriter.BLOCK_TIMEOUT = 0.01
+        try:
+            writer = LogWriter(self.pool, queueSize=1)
+            writer.write(1, 'Routine', enums.e_log_event_level.info, enums.e_log_event_type.user)
+            self.assertTrue(writer.write(2, 'Critical', enums.e_log_event_level.critical,
+                                         enums.e_log_event_type.system))
+        finally:
+            logwriter.BLOCK_TIMEOUT = timeout
+
+        self.assertTrue(self.events() == [(2, 'Critical', int(enums.e_log_event_level.critical), self.events()[0][3])])
+        writer.start()
+        writer.stop()
+        self.assertTrue(len(self.events()) == 2)
+
+    def test_unopenable(self):
+        """A database that can't be opened should cost the events, but not the writer thread."""
+        pool = SqlPool('test/secret/missing/events.db', 1)
+        writer = LogWriter(pool, flushInterval=0.01)
+        writer.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(3):
+                writer.write(i, 'Event', enums.e_log_event_level.info, enums.e_log_event_type.user)
+            writer.flush()
+            self.assertTrue(writer.isRunning())
+            writer.stop()
+        self.assertTrue(writer.getWrittenCount() == 0)
+
+    def test_threadDied(self):
+        """If the writer thread is gone, it should not count as running, and stopping should not wait on it."""
+        writer = LogWriter(self.pool, queueSize=1)
+        writer._thread = threading.Thread(target=lambda: None)
+        writer._thread.start()
+        writer._thread.join()
+
+        self.assertFalse(writer.isRunning())
+        writer.write(1, 'Stranded', enums.e_log_event_level.info, enums.e_log_event_type.user)
+        writer.flush()
+        writer.stop()
+        self.assertTrue(len(self.events()) == 1, 'Stopping should write what the dead thread left behind.')
+
+    def test_init_invalid(self):
+        self.assertRaises(TypeError, LogWriter, self.pool, '10')
+        self.assertRaises(ValueError, LogWriter, self.pool, 10, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+import os
+import unittest
+
+from flask import Flask, session
+
+from core.database.sqlpool import SqlPool
+from core.web import sessions
+from core.web.sessions import SessionContext, SessionStore, ServerSessionInterface
+
+
+class Tests_SessionStore(unittest.TestCase):
+    """Tests keeping sessions in memory with a SQL spill."""
+
+    def setUp(self):
+        if os.path.exists('test/secret/sessions.db'):
+            os.remove('test/secret/sessions.db')
+
+        self.pool = SqlPool('test/secret/sessions.db', 2)
+        c = self.pool.checkout()
+        with open('config/schema.sql', mode='r') as f:
+            c.executescript(f.read())
+        self.pool.checkin(c)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def spilledIds(self):
+        c = self.pool.checkout()
+        try:
+            return sorted(r[0] for r in c.execute("SELECT id FROM sessions"))
+        finally:
+            self.pool.checkin(c)
+
+    def test_saveLoad(self):
+        store = SessionStore(self.pool, 10, 100)
+        self.assertTrue(store.load('a', 0) is None)
+
+        store.save('a', {'id': 1, 'logged_in': True}, now=0)
+        data, context, generation = store.load('a', 50)
+        self.assertTrue(data == {'id': 1, 'logged_in': True})
+
+        # Loaded data is a copy, and saving without data only pushes the expiry back.
+        data['id'] = 2
+        store.save('a', None, now=90)
+        self.assertTrue(store.load('a', 150)[0] == {'id': 1, 'logged_in': True})
+        self.assertTrue(store.load('a', 300) is None)
+
+    def test_spill(self):
+        """Sessions pushed out of memory should be spilled to the database and read back when used."""
+        store = SessionStore(self.pool, 2, 100)
+        for sid in ['a', 'b', 'c']:
+            store.save(sid, {'sid': sid}, now=0)
+
+        self.assertTrue(store.getStats()['sessions'] == 2)
+        self.assertTrue(self.spilledIds() == ['a'])
+
+        self.assertTrue(store.load('a', 10)[0] == {'sid': 'a'})
+        stats = store.getStats()
+        self.assertTrue(stats['spilled'] == 2 and stats['restored'] == 1)
+        self.assertTrue(self.spilledIds() == ['a', 'b'])
+
+    def test_delete(self):
+        store = SessionStore(self.pool, 1, 100)
+        store.save('a', {'sid': 'a'}, now=0)
+        store.save('b', {'sid': 'b'}, now=0)
+        store.delete('a')
+        store.delete('b')
+        self.assertTrue(store.load('a', 0) is None and store.load('b', 0) is None)
+
+    def test_flushPrune(self):
+        store = SessionStore(self.pool, 10, 100)
+        store.save('a', {'sid': 'a'}, now=0)
+        store.save('b', {'sid': 'b'}, now=50)
+        store.flush(10)
+        self.assertTrue(self.spilledIds() == ['a', 'b'])
+
+        self.assertTrue(store.prune(120) == 1)
+        self.assertTrue(self.spilledIds() == ['b'])
+        self.assertTrue(store.getStats()['sessions'] == 1)
+
+    def test_context(self):
+        """Contexts should be kept with their session until something they describe changes."""
+        store = SessionStore(self.pool, 10, 100)
+        store.save('a', {'id': 1}, SessionContext(1, 5), store.getGeneration(), 0)
+        store.save('b', {'id': 2}, SessionContext(2, 6), store.getGeneration(), 0)
+
+        self.assertTrue(store.load('a', 0)[1].describes(1, 5))
+
+        store.invalidateContexts(householdId='5')
+        self.assertTrue(store.load('a', 0)[1] is None)
+        self.assertTrue(store.load('b', 0)[1].describes(2, 6))
+
+        store.invalidateContexts(userId=2)
+        self.assertTrue(store.load('b', 0)[1] is None)
+
+    def test_context_stale(self):
+        """A context built before an invalidation should not be saved."""
+        store = SessionStore(self.pool, 10, 100)
+        store.save('a', {'id': 1}, now=0)
+        generation = store.load('a', 0)[2]
+
+        store.invalidateContexts(householdId=5)
+        store.save('a', None, SessionContext(1, 5), generation, 0)
+        self.assertTrue(store.load('a', 0)[1] is None)
+
+    def test_init_invalid(self):
+        self.assertRaises(TypeError, SessionStore, self.pool, '1')
+        self.assertRaises(ValueError, SessionStore, self.pool, 0)
+        self.assertRaises(ValueError, SessionStore, self.pool, 1, 0)
+
+
+class Tests_ServerSessionInterface(unittest.TestCase):
+    """Tests Flask sessions kept in a session store."""
+
+    def setUp(self):
+        if os.path.exists('test/secret/sessions.db'):
+            os.remove('test/secret/sessions.db')
+
+        self.pool = SqlPool('test/secret/sessions.db', 2)
+        c = self.pool.checkout()
+        with open('config/schema.sql', mode='r') as f:
+            c.executescript(f.read())
+        self.pool.checkin(c)
+
+        self.store = SessionStore(self.pool)
+        self.app = Flask(__name__)
+        self.app.secret_key = 'test'
+        self.app.session_interface = ServerSessionInterface(self.store)
+
+        @self.app.route('/set/<value>')
+        def set(value):
+            session['value'] = value
+            return ''
+
+        @self.app.route('/get')
+        def get():
+            return session.get('value', '')
+
+        @self.app.route('/clear')
+        def clear():
+            session.clear()
+            return ''
+
+        @self.app.route('/login')
+        def login():
+            sessions.regenerate()
+            session['logged_in'] = True
+            return ''
+
+        @self.app.route('/invalidate')
+        def invalidate():
+            session.context = SessionContext(None, None)
+            sessions.invalidateContexts(householdId=1)
+            return str(session.context)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_roundTrip(self):
+        """Only a signed session id should be sent to the client, and the data kept in the store."""
+        client = self.app.test_client()
+        self.assertTrue(client.get('/get').headers.get('Set-Cookie') is None, 'Empty sessions should not be stored.')
+
+        response = client.get('/set/hello')
+        self.assertTrue('hello' not in response.headers['Set-Cookie'])
+        self.assertTrue(self.store.getStats()['sessions'] == 1)
+        self.assertTrue(client.get('/get').data == b'hello')
+
+        client.get('/clear')
+        self.assertTrue(self.store.getStats()['sessions'] == 0)
+        self.assertTrue(client.get('/get').data == b'')
+
+    def test_forged(self):
+        """A session id that wasn't signed with the secret key should get a new, empty session."""
+        client = self.app.test_client()
+        client.get('/set/hello')
+        sid = next(iter(self.store._entries))
+
+        forged = self.app.test_client()
+        forged.set_cookie(self.app.config['SESSION_COOKIE_NAME'], sid + '.forged')
+        self.assertTrue(forged.get('/get').data == b'')
+
+    def test_regenerate(self):
+        """Logging in should move the session to a new id, and forget the old one."""
+        client = self.app.test_client()
+        client.get('/set/hello')
+        before = set(self.store._entries)
+
+        response = client.get('/login')
+        after = set(self.store._entries)
+        self.assertTrue(len(before) == 1 and len(after) == 1 and before != after)
+        self.assertTrue('Set-Cookie' in response.headers)
+        self.assertTrue(client.get('/get').data == b'hello', 'The session data should have moved to the new id.')
+
+        # The id from before logging in should no longer work.
+        stale = self.app.test_client()
+        stale.set_cookie(self.app.config['SESSION_COOKIE_NAME'],
+                         self.app.session_interface._getSigner(self.app).sign(before.pop()).decode('ascii'))
+        self.assertTrue(stale.get('/get').data == b'')
+
+    def test_invalidate(self):
+        """Invalidating contexts should drop the current request's context."""
+        client = self.app.test_client()
+        client.get('/set/hello')
+        self.assertTrue(client.get('/invalidate').data == b'None')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from core.database.sqlpool import SqlPool
+
+
+class Tests_sqlpool(unittest.TestCase):
+    """Tests pooling SQL connections."""
+
+    def setUp(self):
+        self.pool = SqlPool('test/secret/tests.db', 2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_pragmas(self):
+        """New connections should use WAL journaling and the tuned pragmas."""
+        c = self.pool.checkout()
+        self.assertTrue(c.execute('PRAGMA journal_mode').fetchone()[0].lower() == 'wal')
+        self.assertTrue(c.execute('PRAGMA synchronous').fetchone()[0] == 1, 'Synchronous should be NORMAL.')
+        self.assertTrue(c.execute('PRAGMA cache_size').fetchone()[0] == -8000)
+        self.pool.checkin(c)
+
+    def test_pragmas_override(self):
+        """Pragma overrides should replace the defaults."""
+        pool = SqlPool('test/secret/tests.db', 1, {'cache_size': -100})
+        c = pool.checkout()
+        self.assertTrue(c.execute('PRAGMA cache_size').fetchone()[0] == -100)
+        pool.checkin(c)
+        pool.close()
+
+    def test_reuse(self):
+        """A connection checked back in should be handed out again."""
+        c = self.pool.checkout()
+        self.pool.checkin(c)
+        self.assertTrue(self.pool.getIdleCount() == 1)
+        self.assertTrue(self.pool.checkout() is c, 'Idle connection should be reused.')
+
+    def test_overflow(self):
+        """Connections beyond the pool size should be closed when checked in."""
+        connections = [self.pool.checkout() for __ in range(3)]
+        for c in connections:
+            self.pool.checkin(c)
+        self.assertTrue(self.pool.getIdleCount() == 2)
+
+    def test_checkin_rollback(self):
+        """Uncommitted changes should be rolled back when a connection is checked in."""
+        c = self.pool.checkout()
+        c.execute('CREATE TABLE IF NOT EXISTS pool_test (n INTEGER)')
+        c.commit()
+        c.execute('INSERT INTO pool_test VALUES (1)')
+        self.pool.checkin(c)
+
+        c = self.pool.checkout()
+        self.assertTrue(c.execute('SELECT COUNT(*) FROM pool_test').fetchone()[0] == 0)
+        self.pool.checkin(c)
+
+    def test_size_invalid(self):
+        self.assertRaises(TypeError, SqlPool, 'test/secret/tests.db', '2')
+        self.assertRaises(ValueError, SqlPool, 'test/secret/tests.db', -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
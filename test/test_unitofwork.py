@@ -0,0 +1,110 @@
+import unittest
+
+from core.billing.bills import Bill
+from core.database import unitofwork
+from core.database.zdb import Zdb
+
+
+class Tests_unitofwork(unittest.TestCase):
+    """Tests deferring object commits with a unit of work."""
+
+    def setUp(self):
+        self.z = Zdb('test/secret/tests.zdb')
+
+    def tearDown(self):
+        while unitofwork.isActive():
+            unitofwork.end(False)
+        self.z.teardown()
+
+    def cycleDb(self):
+        self.z.teardown()
+        self.z = Zdb('test/secret/tests.zdb')
+
+    def lastTransaction(self):
+        return self.z.zdb.lastTransaction()
+
+    def test_commit_noUnitOfWork(self):
+        """Outside of a unit of work, setters should commit right away."""
+        self.assertFalse(unitofwork.isActive())
+
+        b = Bill()
+        self.z.root.uow = b
+        b.charge = 10
+
+        before = self.lastTransaction()
+        b.name = 'Immediate'
+        self.assertTrue(self.lastTransaction() != before, 'Setter should have committed.')
+
+    def test_end_singleCommit(self):
+        """Inside a unit of work, setters should not commit until the unit of work ends, and then commit once."""
+        b = Bill()
+        self.z.root.uow = b
+        b.charge = 10
+
+        before = self.lastTransaction()
+        unitofwork.begin()
+        self.assertTrue(unitofwork.isActive())
+
+        b.charge = 20
+        b.name = 'Deferred'
+        b.addAdjustment(-5, 'Deferred adjustment')
+        self.assertTrue(self.lastTransaction() == before, 'Setters should not commit inside a unit of work.')
+
+        self.assertTrue(unitofwork.end())
+        self.assertFalse(unitofwork.isActive())
+        self.assertTrue(self.lastTransaction() != before, 'Ending the unit of work should commit.')
+
+        self.cycleDb()
+        self.assertTrue(self.z.root.uow.getTotal() == 15, 'Deferred changes did not persist.')
+        self.assertTrue(self.z.root.uow.name == 'Deferred', 'Deferred changes did not persist.')
+
+    def test_end_failure(self):
+        """A unit of work that did not succeed should discard its changes."""
+        b = Bill()
+        self.z.root.uow = b
+        b.charge = 10
+
+        unitofwork.begin()
+        b.charge = 99
+        self.assertFalse(unitofwork.end(False))
+
+        self.cycleDb()
+        self.assertTrue(self.z.root.uow.charge == 10, 'Failed unit of work should not persist.')
+
+    def test_end_nested(self):
+        """Only the outermost unit of work should commit."""
+        b = Bill()
+        self.z.root.uow = b
+
+        before = self.lastTransaction()
+        unitofwork.begin()
+        unitofwork.begin()
+        b.charge = 30
+        unitofwork.end()
+        self.assertTrue(unitofwork.isActive(), 'Inner end should leave the unit of work open.')
+        self.assertTrue(self.lastTransaction() == before, 'Inner end should not commit.')
+
+        unitofwork.end()
+        self.assertTrue(self.lastTransaction() != before, 'Outer end should commit.')
+
+    def test_end_withoutBegin(self):
+        """Ending without a unit of work open should do nothing."""
+        self.assertFalse(unitofwork.end())
+
+    def test_immediate(self):
+        """Commits inside an immediate block should be written even while a unit of work is open."""
+        b = Bill()
+        self.z.root.uow = b
+        b.charge = 10
+
+        unitofwork.begin()
+        before = self.lastTransaction()
+        with unitofwork.immediate():
+            self.assertFalse(unitofwork.isActive())
+            b.charge = 40
+        self.assertTrue(unitofwork.isActive())
+        self.assertTrue(self.lastTransaction() != before, 'Immediate block should commit.')
+
+
+if __name__ == '__main__':
+    unittest.main()
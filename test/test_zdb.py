@@ -1,3 +1,4 @@
+import threading
 import unittest
 
 from core.database import zdb
@@ -78,5 +79,64 @@ class Tests_zdb_user(unittest.TestCase):
         """Tests creating a User and getting it back from the database."""
         #TODO: this and other tests
 
+class Tests_zdb_connections(unittest.TestCase):
+    """Tests the per-thread connection pool of the object database."""
+
+    def setUp(self):
+        self.z = zdb.Zdb('test/secret/tests.zdb', poolSize=3, cacheSize=50)
+
+    def tearDown(self):
+        self.z.teardown()
+
+    def test_pool_configuration(self):
+        """The pool size and per-connection cache size should be passed through to the database."""
+        self.assertTrue(self.z.zdb.getPoolSize() == 3, 'Pool size was not configured.')
+        self.assertTrue(self.z.zdb.getCacheSize() == 50, 'Cache size was not configured.')
+
+    def test_open_sameThread(self):
+        """A thread should keep the same connection until it closes it."""
+        c1 = self.z.open()
+        c2 = self.z.open()
+        self.assertTrue(c1 is c2, 'A thread should reuse its open connection.')
+        self.assertTrue(self.z.root.globalSettings is c1.root.globalSettings, 'Root should come from the connection.')
+
+    def test_open_separateThreads(self):
+        """Different threads should be handed different connections."""
+        mine = self.z.open()
+        theirs = []
+
+        def work():
+            theirs.append(self.z.open())
+            self.z.close()
+
+        t = threading.Thread(target=work)
+        t.start()
+        t.join()
+
+        self.assertTrue(len(theirs) == 1)
+        self.assertTrue(theirs[0] is not mine, 'Threads should not share a connection.')
+
+    def test_close_seesOtherCommits(self):
+        """A connection checked out after another thread commits should see that commit."""
+        self.z.open()
+
+        def work():
+            self.z.createHousehold('fromThread')
+            self.z.close()
+
+        t = threading.Thread(target=work)
+        t.start()
+        t.join()
+
+        self.z.close()
+        self.assertTrue(self.z.getHousehold('fromThread') is not None, 'Commit from another thread was not seen.')
+
+    def test_close_discardsUncommitted(self):
+        """Closing a connection should discard changes that were never committed."""
+        self.z.root.uncommitted = True
+        self.z.close()
+        self.assertFalse(hasattr(self.z.root, 'uncommitted'), 'Uncommitted changes should be discarded on close.')
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,121 @@
+import hashlib
+import unittest
+
+from core.user import passwords
+from core.user.passwords import PasswordHasher, HasherBusyException
+
+
+class Tests_PasswordHasher(unittest.TestCase):
+    """Tests hashing passwords in a bounded worker pool."""
+
+    expected = hashlib.pbkdf2_hmac('sha512', b'hunter22', b'salt', 1000)
+
+    def test_inline(self):
+        hasher = PasswordHasher(0)
+        digest, elapsed = hasher.hash('hunter22', 'salt', 1000)
+        self.assertTrue(digest == self.expected)
+        self.assertTrue(elapsed >= 0)
+        self.assertTrue(hasher.getStats()['hashed'] == 1)
+
+    def test_pool(self):
+        """Hashes from the pool should match hashes computed in place, and free their slot when done."""
+        hasher = PasswordHasher(1, 1)
+        try:
+            for __ in range(3):
+                self.assertTrue(hasher.hash('hunter22', 'salt', 1000)[0] == self.expected)
+
+            stats = hasher.getStats()
+            self.assertTrue(stats['hashed'] == 3 and stats['inFlight'] == 0 and stats['rejected'] == 0)
+            self.assertTrue(stats['maxMs'] >= stats['meanMs'] > 0)
+            self.assertTrue(hasher._pool._mp_context.get_start_method() == passwords.START_METHOD)
+        finally:
+            hasher.shutdown()
+
+    def test_saturated(self):
+        """When every slot is taken, hashing should be refused without waiting."""
+        hasher = PasswordHasher(1, 0)
+        try:
+            hasher._inFlight = 1
+            self.assertRaises(HasherBusyException, hasher.hash, 'hunter22', 'salt', 1000)
+            self.assertTrue(hasher.getStats()['rejected'] == 1)
+
+            hasher._inFlight = 0
+            self.assertTrue(hasher.hash('hunter22', 'salt', 1000)[0] == self.expected)
+        finally:
+            hasher.shutdown()
+
+    def test_timeout(self):
+        """A hash that takes too long should be given up on, but keep its slot until it finishes."""
+        hasher = PasswordHasher(1, 0, timeout=0.001)
+        try:
+            self.assertRaises(HasherBusyException, hasher.hash, 'hunter22', 'salt', passwords.ITERATIONS * 5)
+            self.assertTrue(hasher.getStats()['timedOut'] == 1)
+        finally:
+            hasher.shutdown()
+        self.assertTrue(hasher.getStats()['inFlight'] == 0)
+
+    def test_init_invalid(self):
+        self.assertRaises(TypeError, PasswordHasher, '1')
+        self.assertRaises(ValueError, PasswordHasher, -1)
+        self.assertRaises(ValueError, PasswordHasher, 1, 1, 0)
+        self.assertRaises(ValueError, PasswordHasher, 0, scheme='md5')
+        self.assertRaises(ValueError, PasswordHasher, 0, iterations=0)
+
+
+class Tests_PasswordScheme(unittest.TestCase):
+    """Tests the versioned password hash format and upgrading old hashes."""
+
+    def test_encode_decode(self):
+        stored = passwords.encode('pbkdf2_sha256', 1000, b'salt', b'digest')
+        self.assertTrue(stored.startswith('pbkdf2_sha256$1000$'))
+        self.assertTrue(passwords.decode(stored) == ('pbkdf2_sha256', 1000, b'salt', b'digest'))
+
+        self.assertTrue(passwords.decode(b'raw digest') is None)
+        self.assertTrue(passwords.decode('md5$1000$c2FsdA==$ZGlnZXN0') is None)
+        self.assertTrue(passwords.decode('pbkdf2_sha256$many$c2FsdA==$ZGlnZXN0') is None)
+        self.assertTrue(passwords.decode('pbkdf2_sha256$1000$not base64$ZGlnZXN0') is None)
+
+    def test_makeHash(self):
+        """New hashes should use the current settings, with a different salt every time."""
+        hasher = PasswordHasher(0, scheme='pbkdf2_sha256', iterations=1000)
+        first = hasher.makeHash('hunter22')[0]
+        second = hasher.makeHash('hunter22')[0]
+        self.assertTrue(first != second)
+
+        scheme, iterations, salt, digest = passwords.decode(first)
+        self.assertTrue(scheme == 'pbkdf2_sha256' and iterations == 1000 and len(salt) == passwords.SALT_BYTES)
+        self.assertTrue(digest == hashlib.pbkdf2_hmac('sha256', b'hunter22', salt, 1000))
+
+    def test_verify(self):
+        hasher = PasswordHasher(0, iterations=1000)
+        stored = hasher.makeHash('hunter22')[0]
+        self.assertTrue(hasher.verify('hunter22', stored, 'salt')[:2] == (True, False))
+        self.assertTrue(hasher.verify('hunter23', stored, 'salt')[:2] == (False, False))
+
+    def test_verify_outdated(self):
+        """A hash made with other settings should still verify, and be flagged for rehashing."""
+        stored = PasswordHasher(0, iterations=1000).makeHash('hunter22')[0]
+
+        hasher = PasswordHasher(0, iterations=2000)
+        self.assertTrue(hasher.verify('hunter22', stored, 'salt')[:2] == (True, True))
+        self.assertTrue(hasher.verify('hunter23', stored, 'salt')[:2] == (False, False))
+
+        hasher = PasswordHasher(0, scheme='pbkdf2_sha256', iterations=1000)
+        self.assertTrue(hasher.verify('hunter22', stored, 'salt')[:2] == (True, True))
+
+    def test_verify_legacy(self):
+        """Raw hashes from before the versioned format should verify with the instance-wide salt."""
+        stored = passwords.pbkdf2('hunter22', 'salt', passwords.LEGACY_ITERATIONS)
+        hasher = PasswordHasher(0)
+        self.assertTrue(hasher.verify('hunter22', stored, 'salt')[:2] == (True, True))
+        self.assertTrue(hasher.verify('hunter22', stored, 'pepper')[:2] == (False, False))
+
+    def test_verify_missing(self):
+        """Checking against no hash should never match, but still cost a hash."""
+        hasher = PasswordHasher(0, iterations=1000)
+        self.assertTrue(hasher.verify('hunter22', None, 'salt')[:2] == (False, False))
+        self.assertTrue(hasher.getStats()['hashed'] == 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import sqlite3
+import unittest
+
+from core.user import throttle
+from core.user.throttle import TokenBucketLimiter, LoginThrottle
+
+
+class Tests_TokenBucketLimiter(unittest.TestCase):
+    """Tests rationing attempts with token buckets."""
+
+    def test_allow(self):
+        """A burst up to the capacity should be allowed, then attempts only as fast as tokens refill."""
+        limiter = TokenBucketLimiter(3, 1)
+        self.assertTrue([limiter.allow('a', 100) for __ in range(4)] == [True, True, True, False])
+        self.assertTrue(limiter.allow('b', 100), 'Keys should have their own buckets.')
+
+        self.assertFalse(limiter.allow('a', 100.5))
+        self.assertTrue(limiter.allow('a', 101.5))
+        self.assertFalse(limiter.allow('a', 101.5))
+
+    def test_refill_capped(self):
+        limiter = TokenBucketLimiter(2, 1)
+        limiter.allow('a', 100)
+        self.assertTrue(limiter.getTokens('a', 1000) == 2)
+
+    def test_sweep(self):
+        """Buckets that have refilled completely should be swept away."""
+        limiter = TokenBucketLimiter(2, 1, shards=4)
+        limiter.allow('a', 100)
+        limiter.allow('b', 100)
+        limiter.allow('b', 100)
+        self.assertTrue(len(limiter) == 2)
+
+        limiter.sweep(101)
+        self.assertTrue(len(limiter) == 1)
+        self.assertTrue(limiter.getTokens('b', 101) == 1)
+
+
+        # Shards sweep themselves as attempts come in.
+        limiter = TokenBucketLimiter(2, 1, shards=1)
+        limiter.allow('a', 100)
+        limiter.allow('b', 100 + throttle.SWEEP_INTERVAL)
+        self.assertTrue(len(limiter) == 1)
+
+    def test_init_invalid(self):
+        self.assertRaises(ValueError, TokenBucketLimiter, 0, 1)
+        self.assertRaises(ValueError, TokenBucketLimiter, 1, 0)
+
+
+class Tests_LoginThrottle(unittest.TestCase):
+    """Tests throttling login attempts per username and address."""
+
+    def test_allow(self):
+        t = LoginThrottle()
+        for i in range(throttle.USERNAME_CAPACITY):
+            self.assertTrue(t.allow('User', 'address' + str(i), 100))
+        self.assertFalse(t.allow('uSER', 'another address', 100), 'Usernames should be compared without case.')
+
+        for i in range(throttle.ADDRESS_CAPACITY):
+            self.assertTrue(t.allow('user' + str(i), 'address', 100))
+        self.assertFalse(t.allow('someone else', 'address', 100))
+
+    def test_persist(self):
+        """Draining buckets should survive a save and load."""
+        if os.path.exists('test/secret/throttle.db'):
+            os.remove('test/secret/throttle.db')
+        connection = sqlite3.connect('test/secret/throttle.db')
+        with open('config/schema.sql', mode='r') as f:
+            connection.executescript(f.read())
+
+        t = LoginThrottle()
+        for __ in range(throttle.USERNAME_CAPACITY):
+            t.allow('user', 'address', 100)
+        t.save(connection, 100)
+
+        restored = LoginThrottle()
+        restored.load(connection)
+        self.assertFalse(restored.allow('user', 'elsewhere', 100))
+        self.assertTrue(restored.allow('someone else', 'address', 100))
+        connection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
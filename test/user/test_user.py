@@ -1,6 +1,8 @@
 import unittest
 
-from core.user.user import User
+from core.database.zdb import Zdb
+from core.cache import LruCache
+from core.user.user import User, resolveDisplaynames
 
 
 class Tests_User(unittest.TestCase):
@@ -29,4 +31,38 @@ class Tests_User(unittest.TestCase):
         with self.assertRaises(ValueError):
             User('userId', '')
 
-        User('100', 'displayname')
\ No newline at end of file
+        User('100', 'displayname')
+
+
+class Tests_Displaynames(unittest.TestCase):
+    """Tests resolving display names in batches through the display name cache."""
+
+    def setUp(self):
+        self.z = Zdb('test/secret/tests.zdb')
+        for userId, name in [('1', 'One'), ('2', 'Two')]:
+            if self.z.getUser(userId) is None:
+                self.z.createUser(userId, name)
+            self.z.getUser(userId).displayname = name
+
+    def tearDown(self):
+        self.z.teardown()
+
+    def test_resolve(self):
+        cache = LruCache(10, 60)
+        names = resolveDisplaynames(self.z, [1, '2', 1, None, 99], cache)
+        self.assertTrue(names == {1: 'One', '2': 'Two', None: None, 99: None})
+
+    def test_resolve_cached(self):
+        """Cached names should be used without going back to the object database."""
+        cache = LruCache(10, 60)
+        resolveDisplaynames(self.z, [1], cache)
+
+        class NoDb:
+            root = None
+        self.assertTrue(resolveDisplaynames(NoDb(), [1], cache) == {1: 'One'})
+
+    def test_invalidate(self):
+        """Changing a display name should drop it from the shared cache."""
+        resolveDisplaynames(self.z, ['1'])
+        self.z.getUser('1').displayname = 'Renamed'
+        self.assertTrue(resolveDisplaynames(self.z, ['1']) == {'1': 'Renamed'})